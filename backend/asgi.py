@@ -0,0 +1,26 @@
+"""Small helpers shared by the raw ASGI middlewares.
+
+Responses built here are plain dicts ({"status", "headers", "body"} with str
+header pairs) so they can be stored in MongoDB and replayed as they are.
+"""
+import json
+from typing import Dict, Optional
+
+
+def stored_response(status_code: int, headers: list, body: bytes) -> dict:
+    return {"status": status_code, "headers": [[k.decode("latin-1"), v.decode("latin-1")] for k, v in headers],
+            "body": body}
+
+
+def json_response(status_code: int, detail: str, headers: Optional[Dict[str, str]] = None) -> dict:
+    """An HTTPException-shaped error response."""
+    body = json.dumps({"detail": detail}).encode()
+    return {"status": status_code, "body": body, "headers": [
+        ["content-type", "application/json"], ["content-length", str(len(body))], *(headers or {}).items()
+    ]}
+
+
+async def send_stored_response(send, response: dict, extra_headers: list = ()):
+    headers = [[k.encode("latin-1"), v.encode("latin-1")] for k, v in [*response["headers"], *extra_headers]]
+    await send({"type": "http.response.start", "status": response["status"], "headers": headers})
+    await send({"type": "http.response.body", "body": bytes(response["body"])})
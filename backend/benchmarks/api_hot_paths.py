@@ -0,0 +1,317 @@
+"""Load-test the API hot paths in-process at fixed concurrency levels.
+
+Seeds a database with synthetic users, groups, expenses and settlements, then
+drives the ASGI app through httpx (no network, no uvicorn) and reports
+latency percentiles and throughput per endpoint and concurrency level as
+JSON, so runs on two commits can be compared with --compare.
+
+The default backend is mongomock-motor, which needs no server but has its own
+performance profile; use --mongo-url against a local MongoDB for numbers that
+reflect production. The target database is dropped before seeding.
+
+Usage:
+    python benchmarks/api_hot_paths.py [--mongo-url mongodb://localhost:27017]
+        [--groups 5] [--members 8] [--expenses-per-group 1000]
+        [--concurrency 1,8,32] [--requests 200] [--output run.json]
+        [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+ENDPOINTS = ("balances", "dashboard", "list_expenses", "login", "create_expense")
+PASSWORD = "bench-password"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", help="Run against this MongoDB instead of mongomock-motor")
+    parser.add_argument("--db-name", default="splitsync_bench")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--groups", type=int, default=5)
+    parser.add_argument("--members", type=int, default=8, help="Members per group")
+    parser.add_argument("--expenses-per-group", type=int, default=1000)
+    parser.add_argument("--settlements-per-group", type=int, default=100)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--bcrypt-rounds", type=int, help="Override BCRYPT_ROUNDS (affects login)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--compare", help="Print p50/p99/RPS changes against an earlier report")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    # Must run before server is imported: it reads these at import time
+    os.environ["MONGO_URL"] = args.mongo_url or os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+    os.environ["DB_NAME"] = args.db_name
+    os.environ.setdefault("SLOW_REQUEST_MS", "0")
+    # The load would otherwise be throttled like a single abusive client
+    os.environ.setdefault("RATE_LIMIT", "0")
+    if args.bcrypt_rounds is not None:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+
+
+def synthetic_dataset(args, password_hash: str):
+    rng = random.Random(args.seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    users = [
+        {
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "email": f"bench-{i}@example.com",
+            "password": password_hash,
+            "name": f"Bench User {i}",
+            "created_at": start.isoformat()
+        }
+        for i in range(args.users)
+    ]
+    groups, expenses, settlements = [], [], []
+    for g in range(args.groups):
+        # The first user is in every group so their dashboard spans all of them
+        members = [users[0]] + rng.sample(users[1:], min(args.members, len(users)) - 1)
+        group_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        groups.append({
+            "id": group_id,
+            "name": f"Bench Group {g}",
+            "description": "",
+            "created_by": users[0]["id"],
+            "members": [{"user_id": u["id"], "name": u["name"], "email": u["email"]} for u in members],
+            "created_at": start.isoformat(),
+            "version": 0
+        })
+        for e in range(args.expenses_per_group):
+            payer = rng.choice(members)
+            participants = rng.sample(members, rng.randint(1, len(members)))
+            share = rng.randint(100, 20000)
+            created = (start + timedelta(minutes=e)).isoformat()
+            expenses.append({
+                "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "group_id": group_id,
+                "description": f"Expense {e}",
+                "amount_cents": share * len(participants),
+                "paid_by": payer["id"],
+                "paid_by_name": payer["name"],
+                "split_type": "equal",
+                "splits": [{"user_id": u["id"], "amount_cents": share} for u in participants],
+                "date": created[:10],
+                "created_at": created
+            })
+        for s in range(args.settlements_per_group):
+            debtor, creditor = rng.sample(members, 2)
+            settlements.append({
+                "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "group_id": group_id,
+                "from_user": debtor["id"],
+                "from_user_name": debtor["name"],
+                "to_user": creditor["id"],
+                "to_user_name": creditor["name"],
+                "amount_cents": rng.randint(100, 5000),
+                "created_at": (start + timedelta(minutes=s, seconds=30)).isoformat()
+            })
+    return users, groups, expenses, settlements
+
+
+async def seed(server, args):
+    await server.client.drop_database(args.db_name)
+    if args.mongo_url:
+        await server.ensure_indexes()
+    password_hash = server.hash_password(PASSWORD)
+    users, groups, expenses, settlements = synthetic_dataset(args, password_hash)
+    chunk = 5000
+    for name, docs in (("users", users), ("groups", groups), ("expenses", expenses), ("settlements", settlements)):
+        for i in range(0, len(docs), chunk):
+            await server.db[name].insert_many(docs[i:i + chunk])
+    for group in groups:
+        await server.rebuild_group_ledger(group["id"])
+    return users, groups
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def request_factory(endpoint: str, users, groups, tokens, rng: random.Random):
+    """Return a coroutine function issuing one request of the given kind."""
+    def member_of(group):
+        member = rng.choice(group["members"])
+        return member, {"Authorization": f"Bearer {tokens[member['user_id']]}"}
+
+    primary = {"Authorization": f"Bearer {tokens[users[0]['id']]}"}
+
+    async def balances(http):
+        group = rng.choice(groups)
+        _, headers = member_of(group)
+        return await http.get(f"/api/groups/{group['id']}/balances", headers=headers)
+
+    async def dashboard(http):
+        return await http.get("/api/dashboard", headers=primary)
+
+    async def list_expenses(http):
+        group = rng.choice(groups)
+        _, headers = member_of(group)
+        return await http.get("/api/expenses", params={"group_id": group["id"]}, headers=headers)
+
+    async def login(http):
+        user = rng.choice(users)
+        return await http.post("/api/auth/login", json={"email": user["email"], "password": PASSWORD})
+
+    async def create_expense(http):
+        group = rng.choice(groups)
+        member, headers = member_of(group)
+        ids = [m["user_id"] for m in group["members"]]
+        return await http.post("/api/expenses", headers=headers, json={
+            "group_id": group["id"],
+            "description": "Benchmark expense",
+            "amount": len(ids) * 10.0,
+            "paid_by": member["user_id"],
+            "split_type": "equal",
+            "splits": [{"user_id": user_id, "amount": 10.0} for user_id in ids]
+        })
+
+    return {
+        "balances": balances,
+        "dashboard": dashboard,
+        "list_expenses": list_expenses,
+        "login": login,
+        "create_expense": create_expense,
+    }[endpoint]
+
+
+async def measure(http, issue, concurrency: int, total: int):
+    latencies, errors = [], 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            response = await issue(http)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        "rps": round(total / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(__file__), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args):
+    import httpx
+    import server
+
+    if not args.mongo_url:
+        from mongomock_motor import AsyncMongoMockClient
+        server.client = AsyncMongoMockClient()
+        server.db = server.client[args.db_name]
+
+    seed_started = time.perf_counter()
+    users, groups = await seed(server, args)
+    seed_seconds = time.perf_counter() - seed_started
+    tokens = {u["id"]: server.create_token(u["id"], u["email"], u["name"], u["created_at"]) for u in users}
+
+    rng = random.Random(args.seed)
+    results = []
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        for endpoint in args.endpoints.split(","):
+            issue = request_factory(endpoint, users, groups, tokens, rng)
+            for _ in range(args.warmup):
+                await issue(http)
+            for concurrency in (int(c) for c in args.concurrency.split(",")):
+                row = await measure(http, issue, concurrency, args.requests)
+                results.append({"endpoint": endpoint, "concurrency": concurrency, **row})
+                print(f"{endpoint:>15} c={concurrency:<4} p50={row['p50_ms']:>9}ms p99={row['p99_ms']:>9}ms "
+                      f"rps={row['rps']:>8} errors={row['errors']}", file=sys.stderr)
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "backend": "mongodb" if args.mongo_url else "mongomock",
+            "python": platform.python_version(),
+            "bcrypt_rounds": server.BCRYPT_ROUNDS,
+            "balance_engine": server.BALANCE_ENGINE,
+            "dataset": {
+                "users": args.users,
+                "groups": args.groups,
+                "members_per_group": args.members,
+                "expenses_per_group": args.expenses_per_group,
+                "settlements_per_group": args.settlements_per_group,
+                "seed": args.seed,
+            },
+            "seed_seconds": round(seed_seconds, 2),
+        },
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(r["endpoint"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\nvs {baseline['meta'].get('commit', baseline_path)}", file=sys.stderr)
+    for row in report["results"]:
+        old = before.get((row["endpoint"], row["concurrency"]))
+        if old is None:
+            continue
+        changes = " ".join(
+            f"{key}={(row[key] - old[key]) / old[key] * 100:+.1f}%" if old[key] else f"{key}=n/a"
+            for key in ("p50_ms", "p99_ms", "rps")
+        )
+        print(f"{row['endpoint']:>15} c={row['concurrency']:<4} {changes}", file=sys.stderr)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    configure_environment(args)
+    report = asyncio.run(run(args))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        compare(report, args.compare)
+    return 1 if any(row["errors"] for row in report["results"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
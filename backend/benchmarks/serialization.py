@@ -0,0 +1,128 @@
+"""Benchmark list-response serialization with and without FAST_JSON.
+
+Builds synthetic expense and settlement documents as they come back from
+MongoDB and measures the CPU time to turn a page of them into a response
+body: once the model-validated way (a response model per row, FastAPI's
+response_model validation, stdlib JSON) and once through the FAST_JSON path
+(API dicts encoded by orjson).
+
+Usage:
+    python benchmarks/serialization.py [--rows 500] [--repeat 200] [--json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "splitsync_bench")
+
+from fastapi.responses import JSONResponse, ORJSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+from server import EXPENSE_ROWS, SETTLEMENT_ROWS  # noqa: E402
+
+
+def expense_docs(count: int, rng: random.Random) -> List[dict]:
+    members = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(6)]
+    docs = []
+    for i in range(count):
+        participants = rng.sample(members, rng.randint(2, len(members)))
+        share = rng.randint(100, 20000)
+        docs.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "group_id": "bench-group",
+            "description": f"Expense {i}",
+            "amount_cents": share * len(participants),
+            "paid_by": participants[0],
+            "paid_by_name": "Bench User",
+            "split_type": "equal",
+            "splits": [{"user_id": user_id, "amount_cents": share} for user_id in participants],
+            "date": "2024-01-01",
+            "created_at": f"2024-01-01T00:00:{i % 60:02d}.000000+00:00"
+        })
+    return docs
+
+
+def settlement_docs(count: int, rng: random.Random) -> List[dict]:
+    return [{
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "group_id": "bench-group",
+        "from_user": "user-a",
+        "from_user_name": "User A",
+        "to_user": "user-b",
+        "to_user_name": "User B",
+        "amount_cents": rng.randint(100, 5000),
+        "created_at": f"2024-01-01T00:00:{i % 60:02d}.000000+00:00"
+    } for i in range(count)]
+
+
+async def validated_body(rows, docs) -> bytes:
+    # What a List[...] route does without FAST_JSON
+    field = create_response_field(name="Response", type_=List[rows.model])
+    content = await serialize_response(field=field, response_content=[rows.model(**rows.to_api(d)) for d in docs])
+    return JSONResponse(content).body
+
+
+async def fast_body(rows, docs) -> bytes:
+    return ORJSONResponse([rows.to_api(d) for d in docs]).body
+
+
+async def cpu_ms(fn, rows, docs, repeat: int) -> float:
+    start = time.process_time()
+    for _ in range(repeat):
+        await fn(rows, docs)
+    return (time.process_time() - start) / repeat * 1000
+
+
+async def run(row_count: int, repeat: int, seed: int):
+    rng = random.Random(seed)
+    results = []
+    for name, rows, docs in (
+        ("expenses", EXPENSE_ROWS, expense_docs(row_count, rng)),
+        ("settlements", SETTLEMENT_ROWS, settlement_docs(row_count, rng)),
+    ):
+        assert json.loads(await validated_body(rows, docs)) == json.loads(await fast_body(rows, docs))
+        validated = await cpu_ms(validated_body, rows, docs, repeat)
+        fast = await cpu_ms(fast_body, rows, docs, repeat)
+        results.append({
+            "listing": name,
+            "rows": row_count,
+            "validated_ms": round(validated, 3),
+            "fast_json_ms": round(fast, 3),
+            "saved_ms": round(validated - fast, 3),
+            "speedup": round(validated / fast, 2) if fast else None,
+        })
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args.rows, args.repeat, args.seed))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print(f"{'listing':>12} {'rows':>6} {'validated ms':>13} {'fast ms':>8} {'saved ms':>9} {'speedup':>8}")
+    for row in results:
+        print(f"{row['listing']:>12} {row['rows']:>6} {row['validated_ms']:>13} {row['fast_json_ms']:>8} "
+              f"{row['saved_ms']:>9} {row['speedup']:>7}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
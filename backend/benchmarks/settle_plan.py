@@ -0,0 +1,106 @@
+"""Benchmark the settle-up planner across group sizes.
+
+Generates synthetic expense histories, derives pairwise debts the way the
+balance ledger does, and compares the number of transfers and the runtime of
+settling pairwise, with the greedy matcher and (for small groups) with the
+exact solver.
+
+Usage:
+    python benchmarks/settle_plan.py [--sizes 5,10,50,500] [--expenses-per-member 20] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "splitsync_bench")
+
+from server import SETTLE_EXACT_MAX, plan_exact_transfers, plan_greedy_transfers  # noqa: E402
+
+
+def synthetic_group(size: int, expenses_per_member: int, rng: random.Random):
+    """Return (pairwise debts, net positions) in cents for a random history."""
+    members = [f"user-{i}" for i in range(size)]
+    pairwise = {}
+    for _ in range(size * expenses_per_member):
+        payer = rng.choice(members)
+        participants = rng.sample(members, rng.randint(1, min(size, 6)))
+        for user_id in participants:
+            if user_id != payer:
+                key = (user_id, payer)
+                pairwise[key] = pairwise.get(key, 0) + rng.randint(100, 10000)
+
+    positions = {user_id: 0 for user_id in members}
+    for (debtor, creditor), cents in pairwise.items():
+        positions[debtor] -= cents
+        positions[creditor] += cents
+
+    # Settling pairwise needs one transfer per pair with a non-zero net debt
+    netted = {}
+    for (debtor, creditor), cents in pairwise.items():
+        pair = tuple(sorted((debtor, creditor)))
+        netted[pair] = netted.get(pair, 0) + (cents if debtor == pair[0] else -cents)
+    pairwise_transfers = sum(1 for cents in netted.values() if cents)
+    return pairwise_transfers, positions
+
+
+def timed(fn, positions, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        transfers = fn(positions)
+    return transfers, (time.perf_counter() - start) / repeat * 1000
+
+
+def run(sizes, expenses_per_member: int, repeat: int, seed: int):
+    rng = random.Random(seed)
+    results = []
+    for size in sizes:
+        pairwise_transfers, positions = synthetic_group(size, expenses_per_member, rng)
+        greedy, greedy_ms = timed(plan_greedy_transfers, positions, repeat)
+        row = {
+            "members": size,
+            "pairwise_transfers": pairwise_transfers,
+            "greedy_transfers": len(greedy),
+            "greedy_ms": round(greedy_ms, 3),
+            "exact_transfers": None,
+            "exact_ms": None,
+        }
+        if size <= SETTLE_EXACT_MAX:
+            exact, exact_ms = timed(plan_exact_transfers, positions, repeat)
+            row["exact_transfers"] = len(exact)
+            row["exact_ms"] = round(exact_ms, 3)
+        results.append(row)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="3,5,8,10,12,25,50,100,250,500,1000")
+    parser.add_argument("--expenses-per-member", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = run(sizes, args.expenses_per_member, args.repeat, args.seed)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print(f"{'members':>8} {'pairwise':>9} {'greedy':>7} {'greedy ms':>10} {'exact':>6} {'exact ms':>9}")
+    for row in results:
+        exact = row["exact_transfers"] if row["exact_transfers"] is not None else "-"
+        exact_ms = row["exact_ms"] if row["exact_ms"] is not None else "-"
+        print(f"{row['members']:>8} {row['pairwise_transfers']:>9} {row['greedy_transfers']:>7} "
+              f"{row['greedy_ms']:>10} {exact:>6} {exact_ms:>9}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""Background rewrite of denormalized profile copies.
+
+A profile change enqueues one job per user in `fanout_jobs`; the worker
+rewrites the stale names in groups, expenses and settlements stage by stage,
+FANOUT_CHUNK documents at a time, under a FANOUT_LEASE-second lease. Stages
+only select documents still holding an old value, so the saved stage is all
+a job needs to resume. Groups go first because new expenses copy the payer's
+name from the group.
+"""
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+
+from workers import BackgroundWorker
+
+FANOUT_CHUNK = int(os.environ.get('FANOUT_CHUNK', '500'))
+FANOUT_CHUNK_DELAY = float(os.environ.get('FANOUT_CHUNK_DELAY', '0.05'))
+FANOUT_LEASE = int(os.environ.get('FANOUT_LEASE', '60'))
+FANOUT_POLL = float(os.environ.get('FANOUT_POLL', '30'))
+
+
+def fanout_stages(user_id: str, name: str, email: str) -> List[tuple]:
+    """(collection, filter for stale copies, update) in job order."""
+    return [
+        ("groups",
+         {"members": {"$elemMatch": {"user_id": user_id, "$or": [{"name": {"$ne": name}}, {"email": {"$ne": email}}]}}},
+         {"$set": {"members.$.name": name, "members.$.email": email}}),
+        ("expenses", {"paid_by": user_id, "paid_by_name": {"$ne": name}}, {"$set": {"paid_by_name": name}}),
+        ("settlements", {"from_user": user_id, "from_user_name": {"$ne": name}}, {"$set": {"from_user_name": name}}),
+        ("settlements", {"to_user": user_id, "to_user_name": {"$ne": name}}, {"$set": {"to_user_name": name}}),
+    ]
+
+
+class ProfileFanout(BackgroundWorker):
+    """`on_rewritten(collection, job, docs)` gets each rewritten chunk ({"_id", "id"} per document)."""
+
+    name = "Profile fan-out"
+
+    def __init__(self, database: Callable, on_rewritten: Callable[[str, dict, List[dict]], Awaitable]):
+        super().__init__(poll_interval=FANOUT_POLL)
+        self.database = database
+        self.on_rewritten = on_rewritten
+        self.worker_id = str(uuid.uuid4())
+        self.jobs_completed = 0
+        self.chunks = 0
+        self.rewritten = 0
+
+    async def enqueue(self, user: dict):
+        # A newer profile replaces a pending or running job and restarts it
+        await self.database().fanout_jobs.update_one(
+            {"user_id": user["id"]},
+            {
+                "$set": {
+                    "name": user["name"],
+                    "email": user["email"],
+                    "stage": 0,
+                    "status": "pending",
+                    "updated_at": datetime.now(timezone.utc).isoformat()
+                },
+                "$inc": {"generation": 1},
+                "$setOnInsert": {"lease_until": None}
+            },
+            upsert=True
+        )
+        self.wakeup.set()
+
+    async def run_once(self) -> Optional[float]:
+        job = await self.claim()
+        if job is None:
+            return None
+        await self.run_job(job)
+        return 0
+
+    async def claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await self.database().fanout_jobs.find_one_and_update(
+            {"status": "pending", "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]},
+            {"$set": {"lease_until": self.lease_deadline(), "worker": self.worker_id}},
+            projection={"_id": 0},
+            sort=[("updated_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def lease_deadline(self) -> datetime:
+        return datetime.fromtimestamp(time.time() + FANOUT_LEASE, timezone.utc)
+
+    async def run_job(self, job: dict):
+        jobs = self.database().fanout_jobs
+        while True:
+            stages = fanout_stages(job["user_id"], job["name"], job["email"])
+            owner = {"user_id": job["user_id"], "generation": job["generation"]}
+            if job["stage"] >= len(stages):
+                done = await jobs.update_one(owner, {"$set": {"status": "done", "lease_until": None}})
+                if done.matched_count:
+                    self.jobs_completed += 1
+                    return
+            else:
+                rewritten = await self.run_chunk(job, *stages[job["stage"]])
+                progress = {"lease_until": self.lease_deadline()}
+                if not rewritten:
+                    progress["stage"] = job["stage"] + 1
+                saved = await jobs.update_one(owner, {"$set": progress})
+                if saved.matched_count:
+                    job.update(progress)
+                    if rewritten:
+                        await asyncio.sleep(FANOUT_CHUNK_DELAY)
+                    continue
+            # Re-enqueued with a newer profile while running: start over with it
+            job = await jobs.find_one({"user_id": job["user_id"]}, {"_id": 0})
+
+    async def run_chunk(self, job: dict, collection: str, query: dict, update: dict) -> int:
+        target = self.database()[collection]
+        docs = await target.find(query, {"_id": 1, "id": 1}).limit(FANOUT_CHUNK).to_list(FANOUT_CHUNK)
+        if not docs:
+            return 0
+        await target.bulk_write([UpdateOne({"_id": doc["_id"], **query}, update) for doc in docs], ordered=False)
+        await self.on_rewritten(collection, job, docs)
+        self.chunks += 1
+        self.rewritten += len(docs)
+        return len(docs)
+
+    def stats(self) -> dict:
+        return {
+            "jobs_completed": self.jobs_completed,
+            "chunks": self.chunks,
+            "documents_rewritten": self.rewritten,
+            "failures": self.failures,
+        }
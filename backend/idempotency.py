@@ -0,0 +1,256 @@
+"""Idempotency-Key handling for mutating requests.
+
+The first request for a (user, key) pair runs and its response is stored in
+`idempotency_keys` for IDEMPOTENCY_TTL_HOURS; retries get it replayed with an
+Idempotent-Replayed header. Retryable 4xx, and 5xx raised before the route
+started, release the key; a later 5xx may follow a partial write, so the key
+is marked failed and retries get 409. Auth routes are skipped: their
+responses carry session tokens.
+"""
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+from fastapi import Request
+from pymongo.errors import DuplicateKeyError
+
+from asgi import json_response, send_stored_response, stored_response
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+IDEMPOTENCY_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+IDEMPOTENCY_EXCLUDED_PREFIX = "/api/auth/"
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_LEASE = float(os.environ.get('IDEMPOTENCY_LEASE', '60'))
+IDEMPOTENCY_RETRYABLE = {408, 409, 425, 429}
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+HANDLER_STARTED = "idempotency.handler_started"
+
+
+def failed_response() -> dict:
+    return json_response(409, "The request with this Idempotency-Key failed part-way; retry with a new key")
+
+
+async def mark_handler_started(request: Request):
+    """Router dependency: from here on a failed request keeps its key."""
+    request.scope[HANDLER_STARTED] = True
+
+
+class IdempotencyStore:
+    """Stored responses: an in-process LRU in front of the `idempotency_keys` collection."""
+
+    def __init__(self, collection: Callable, max_size: int):
+        self.collection = collection
+        self.max_size = max_size
+        # key -> (expires_at timestamp, fingerprint, response)
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.executions = 0
+        self.replays = 0
+        self.collapsed = 0
+        self.conflicts = 0
+        self.mismatches = 0
+        self.failed = 0
+
+    def cached(self, key: str) -> Optional[tuple]:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.time():
+            self.entries.pop(key, None)
+            return None
+        self.entries.move_to_end(key)
+        return entry[1], entry[2]
+
+    def remember(self, key: str, expires_at: datetime, fingerprint: str, response: dict):
+        if self.max_size <= 0:
+            return
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        self.entries[key] = (expires_at.timestamp(), fingerprint, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def claim(self, key: str, fingerprint: str) -> tuple:
+        """Reserve the key for this request.
+
+        Returns ("claimed", lease_id), ("done", stored doc) or ("busy", None).
+        A pending key whose lease ran out belonged to a worker that died
+        mid-request and is taken over.
+        """
+        keys = self.collection()
+        now = datetime.now(timezone.utc)
+        lease_id = str(uuid.uuid4())
+        lease = {"status": "pending", "lease_id": lease_id, "lease_until": now + timedelta(seconds=IDEMPOTENCY_LEASE)}
+        try:
+            await keys.insert_one({
+                "key": key, "fingerprint": fingerprint, "created_at": now,
+                "expires_at": now + timedelta(hours=IDEMPOTENCY_TTL_HOURS), **lease
+            })
+            return "claimed", lease_id
+        except DuplicateKeyError:
+            pass
+        doc = await keys.find_one({"key": key}, {"_id": 0})
+        if doc is None:
+            # Released between our insert and read; let the client retry
+            return "busy", None
+        if doc["status"] != "pending" or doc["fingerprint"] != fingerprint:
+            return "done", doc
+        taken = await keys.update_one(
+            {"key": key, "status": "pending", "lease_until": {"$lt": now}}, {"$set": lease}
+        )
+        return ("claimed", lease_id) if taken.modified_count else ("busy", None)
+
+    async def complete(self, key: str, lease_id: str, response: dict):
+        await self.collection().update_one(
+            {"key": key, "lease_id": lease_id},
+            {"$set": {"status": "done", "response": response}, "$unset": {"lease_until": ""}}
+        )
+
+    async def fail(self, key: str, lease_id: str) -> dict:
+        self.failed += 1
+        response = failed_response()
+        await self.collection().update_one(
+            {"key": key, "lease_id": lease_id},
+            {"$set": {"status": "failed", "response": response}, "$unset": {"lease_until": ""}}
+        )
+        return response
+
+    async def release(self, key: str, lease_id: str):
+        await self.collection().delete_one({"key": key, "lease_id": lease_id})
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "in_flight": len(self.inflight),
+            "executions": self.executions,
+            "replays": self.replays,
+            "collapsed": self.collapsed,
+            "conflicts": self.conflicts,
+            "mismatches": self.mismatches,
+            "failed": self.failed,
+        }
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app, store: IdempotencyStore, identify: Callable):
+        self.app = app
+        self.store = store
+        self.identify = identify
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in IDEMPOTENCY_METHODS or \
+                scope["path"].startswith(IDEMPOTENCY_EXCLUDED_PREFIX):
+            await self.app(scope, receive, send)
+            return
+        raw_key = next((value for name, value in scope["headers"] if name == IDEMPOTENCY_HEADER), None)
+        if raw_key is None:
+            await self.app(scope, receive, send)
+            return
+        if not raw_key or len(raw_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            await send_stored_response(send, json_response(400, "Invalid Idempotency-Key"))
+            return
+
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+
+        store = self.store
+        # Scoped to the user so keys from different accounts never collide
+        user_id = self.identify(scope) or "anonymous"
+        key = hashlib.sha256(user_id.encode() + b"\0" + raw_key).hexdigest()
+        fingerprint = hashlib.sha256(b"\0".join([
+            scope["method"].encode(), scope["path"].encode(), scope.get("query_string", b""), body
+        ])).hexdigest()
+
+        cached = store.cached(key)
+        if cached is not None:
+            await self.replay(send, fingerprint, *cached)
+            return
+        running = store.inflight.get(key)
+        if running is not None:
+            store.collapsed += 1
+            await self.replay(send, fingerprint, *await asyncio.shield(running))
+            return
+
+        # Registered before the first await so concurrent duplicates find it
+        future = store.inflight[key] = asyncio.get_running_loop().create_future()
+        result = (fingerprint, json_response(500, "Internal Server Error"))
+        try:
+            outcome, value = await store.claim(key, fingerprint)
+            if outcome == "done":
+                if value["status"] != "pending":
+                    result = (value["fingerprint"], value["response"])
+                    store.remember(key, value["expires_at"], *result)
+                else:
+                    result = (value["fingerprint"], json_response(409, "Idempotency-Key is in use"))
+                await self.replay(send, fingerprint, *result)
+            elif outcome == "busy":
+                store.conflicts += 1
+                result = (fingerprint, json_response(409, "A request with this Idempotency-Key is in progress",
+                                                     {"retry-after": "1"}))
+                await send_stored_response(send, result[1])
+            else:
+                expires_at = datetime.now(timezone.utc) + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+                try:
+                    result = (fingerprint, await self.execute(scope, receive, send, body))
+                except Exception:
+                    if scope.get(HANDLER_STARTED):
+                        result = (fingerprint, await store.fail(key, value))
+                        store.remember(key, expires_at, *result)
+                    else:
+                        await store.release(key, value)
+                    raise
+                status_code = result[1]["status"]
+                if status_code in IDEMPOTENCY_RETRYABLE or (status_code >= 500 and not scope.get(HANDLER_STARTED)):
+                    await store.release(key, value)
+                elif status_code >= 500:
+                    result = (fingerprint, await store.fail(key, value))
+                    store.remember(key, expires_at, *result)
+                else:
+                    await store.complete(key, value, result[1])
+                    store.remember(key, expires_at, *result)
+        finally:
+            future.set_result(result)
+            store.inflight.pop(key, None)
+
+    async def execute(self, scope, receive, send, body: bytes) -> dict:
+        self.store.executions += 1
+        replayed_body = False
+        status_code, headers, chunks = 500, [], []
+
+        async def receive_body():
+            nonlocal replayed_body
+            if not replayed_body:
+                replayed_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        async def send_and_capture(message):
+            nonlocal status_code, headers
+            if message["type"] == "http.response.start":
+                status_code, headers = message["status"], list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        await self.app(scope, receive_body, send_and_capture)
+        return stored_response(status_code, headers, b"".join(chunks))
+
+    async def replay(self, send, fingerprint: str, stored_fingerprint: str, response: dict):
+        if stored_fingerprint != fingerprint:
+            self.store.mismatches += 1
+            response = json_response(422, "Idempotency-Key was already used for a different request")
+        else:
+            self.store.replays += 1
+        await send_stored_response(send, response, [("idempotent-replayed", "true")])
@@ -0,0 +1,109 @@
+"""Maintenance commands for the SplitSync backend.
+
+Usage:
+    python manage.py ledger verify [GROUP_ID ...]
+    python manage.py ledger rebuild [GROUP_ID ...]
+    python manage.py indexes
+    python manage.py migrate-cents
+    python manage.py reap [--orphans]
+
+Without GROUP_IDs the command runs over every group.
+"""
+import argparse
+import asyncio
+import sys
+
+from server import (
+    client, db, ensure_indexes, group_reaper, migrate_amounts_to_cents, rebuild_group_ledger, report_query_plans,
+    verify_group_ledger
+)
+
+
+async def _group_ids(group_ids):
+    if group_ids:
+        return group_ids
+    return [g["id"] async for g in db.groups.find({}, {"_id": 0, "id": 1})]
+
+
+async def ledger_verify(args) -> int:
+    drifted = 0
+    for group_id in await _group_ids(args.group_ids):
+        drift = await verify_group_ledger(group_id)
+        if drift:
+            drifted += 1
+            print(f"{group_id}: {len(drift)} drifted pair(s) or rollup(s)")
+            for entry in drift:
+                target = f"-> {entry['other_id']}" if "other_id" in entry else f"rollup {entry['rollup']}"
+                print(f"  {entry['user_id']} {target}: "
+                      f"expected {entry['expected']}, stored {entry['stored']}")
+    print(f"{drifted} group(s) with drift")
+    return 1 if drifted else 0
+
+
+async def ledger_rebuild(args) -> int:
+    count = 0
+    for group_id in await _group_ids(args.group_ids):
+        await rebuild_group_ledger(group_id)
+        count += 1
+    print(f"Rebuilt {count} ledger(s)")
+    return 0
+
+
+async def indexes(args) -> int:
+    await ensure_indexes()
+    scans = await report_query_plans()
+    for name in scans:
+        print(f"collection scan: {name}")
+    return 1 if scans else 0
+
+
+async def migrate_cents(args) -> int:
+    migrated = await migrate_amounts_to_cents()
+    print(f"Converted {migrated['expenses']} expense(s) and {migrated['settlements']} settlement(s) "
+          f"to cents, rebuilt {migrated['ledgers']} ledger(s)")
+    return 0
+
+
+async def reap(args) -> int:
+    orphans = await group_reaper.sweep_orphans() if args.orphans else []
+    await group_reaper.sweep_reaped()
+    reaped = await group_reaper.reap_all()
+    deleted = group_reaper.stats()["documents_deleted"]
+    print(f"Reaped {reaped} deleted group(s) ({len(orphans)} orphaned): " +
+          ", ".join(f"{count} {name}" for name, count in deleted.items()))
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="SplitSync maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ledger = commands.add_parser("ledger", help="Balance ledger maintenance")
+    ledger_commands = ledger.add_subparsers(dest="action", required=True)
+    verify = ledger_commands.add_parser("verify", help="Recompute from history and report drift")
+    verify.add_argument("group_ids", nargs="*")
+    verify.set_defaults(handler=ledger_verify)
+    rebuild = ledger_commands.add_parser("rebuild", help="Recompute ledgers and dashboard rollups from history")
+    rebuild.add_argument("group_ids", nargs="*")
+    rebuild.set_defaults(handler=ledger_rebuild)
+
+    index_command = commands.add_parser("indexes", help="Ensure indexes and report collection scans")
+    index_command.set_defaults(handler=indexes)
+
+    migrate = commands.add_parser("migrate-cents", help="Convert float amounts to integer cents")
+    migrate.set_defaults(handler=migrate_cents)
+
+    reap_command = commands.add_parser("reap", help="Purge deleted and orphaned groups' records now")
+    reap_command.add_argument("--orphans", action="store_true",
+                              help="Also scan every expense and settlement for groups deleted without a tombstone")
+    reap_command.set_defaults(handler=reap)
+
+    args = parser.parse_args(argv)
+    try:
+        return asyncio.run(args.handler(args))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
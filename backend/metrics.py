@@ -0,0 +1,311 @@
+"""In-process metrics for the SplitSync backend, exported in Prometheus text format.
+
+Counters, gauges and histograms live in a process-wide `registry`. With
+several uvicorn workers each process reports its own values; scrape every
+worker (or run one per pod) and aggregate in Prometheus.
+"""
+import bisect
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from pymongo import monitoring
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Per-request span totals in seconds, set by the HTTP middleware
+request_spans: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_spans", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Mongo command events arrive on driver threads
+        self.lock = threading.Lock()
+
+    def key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> str:
+        return f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> str:
+        with self.lock:
+            items = sorted(self.values.items())
+        return self.header() + "".join(
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}\n" for key, value in items
+        )
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                # Per-bucket counts (+Inf last), sum, count
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> str:
+        with self.lock:
+            items = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self.series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}\n")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}\n")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}\n")
+        return self.header() + "".join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self.metrics.values())
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route template and status.", ("method", "route", "status")
+)
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency including the response body.", ("method", "route")
+)
+http_in_flight = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being served.", ("method", "route")
+)
+mongo_command_duration = registry.histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency as seen by the driver.", ("collection", "command")
+)
+mongo_command_failures = registry.counter(
+    "mongo_command_failures_total", "MongoDB commands that returned an error.", ("collection", "command")
+)
+mongo_documents_returned = registry.counter(
+    "mongo_documents_returned_total", "Documents returned by find, getMore and aggregate batches.",
+    ("collection", "command")
+)
+rate_limited_requests = registry.counter(
+    "http_requests_rate_limited_total", "Requests rejected with 429 by the rate limiter.", ("route_class",)
+)
+span_duration = registry.histogram(
+    "span_duration_seconds", "Time spent in instrumented sections of request handling.", ("span",)
+)
+
+
+def observe_span(span: str, seconds: float):
+    span_duration.observe(seconds, span=span)
+    spans = request_spans.get()
+    if spans is not None:
+        spans[span] = spans.get(span, 0.0) + seconds
+
+
+class span:
+    """Context manager timing a block into span_duration_seconds."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe_span(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Times every driver command by collection and command name.
+
+    Motor runs commands on its own executor threads, so these events cannot
+    be attributed to the request that issued them; they feed the aggregate
+    histograms only.
+    """
+
+    def __init__(self):
+        self.pending: Dict[tuple, str] = {}
+        self.lock = threading.Lock()
+
+    def started(self, event):
+        command = event.command
+        collection = command.get("collection") if event.command_name == "getMore" else command.get(event.command_name)
+        with self.lock:
+            self.pending[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def _collection(self, event) -> str:
+        with self.lock:
+            return self.pending.pop((event.connection_id, event.request_id), "")
+
+    def succeeded(self, event):
+        collection = self._collection(event)
+        mongo_command_duration.observe(event.duration_micros / 1e6, collection=collection, command=event.command_name)
+        cursor = event.reply.get("cursor") if isinstance(event.reply, dict) else None
+        if cursor:
+            batch = cursor.get("firstBatch", cursor.get("nextBatch", ()))
+            mongo_documents_returned.inc(len(batch), collection=collection, command=event.command_name)
+
+    def failed(self, event):
+        collection = self._collection(event)
+        mongo_command_duration.observe(event.duration_micros / 1e6, collection=collection, command=event.command_name)
+        mongo_command_failures.inc(collection=collection, command=event.command_name)
+
+
+class TimedRoute(APIRoute):
+    """APIRoute that times response-model validation and serialization.
+
+    Use as the router's route_class; the time lands in the
+    response_validation span.
+    """
+
+    def get_route_handler(self):
+        field = self.secure_cloned_response_field
+        if field is not None and not getattr(field, "timed", False):
+            validate, serialize = field.validate, field.serialize
+
+            def timed_validate(*args, **kwargs):
+                with span("response_validation"):
+                    return validate(*args, **kwargs)
+
+            def timed_serialize(*args, **kwargs):
+                with span("response_validation"):
+                    return serialize(*args, **kwargs)
+
+            field.validate, field.serialize, field.timed = timed_validate, timed_serialize, True
+        return super().get_route_handler()
+
+
+def route_template(scope) -> str:
+    """Route path pattern for the request, to keep label cardinality bounded."""
+    if "route_template" not in scope:
+        partial = None
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                scope["route_template"] = route.path
+                break
+            if match == Match.PARTIAL and partial is None:
+                partial = route.path
+        else:
+            scope["route_template"] = partial or "unmatched"
+    return scope["route_template"]
+
+
+class RequestMetricsMiddleware:
+    """Counts and times every HTTP request by route template.
+
+    Requests slower than `slow_request_ms` are logged with their span
+    breakdown; 0 turns the log off.
+    """
+
+    def __init__(self, app, slow_request_ms: float = 0):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(scope)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        spans = {}
+        token = request_spans.set(spans)
+        http_in_flight.inc(method=method, route=route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            request_spans.reset(token)
+            http_in_flight.dec(method=method, route=route)
+            http_requests.inc(method=method, route=route, status=str(status_code))
+            http_request_duration.observe(elapsed, method=method, route=route)
+            if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+                breakdown = "".join(f" {name}={seconds * 1000:.1f}ms" for name, seconds in spans.items())
+                logger.warning("Slow request %s %s -> %d in %.1f ms%s",
+                               method, scope["path"], status_code, elapsed * 1000, breakdown)
@@ -0,0 +1,209 @@
+"""Token-bucket rate limiting per route class.
+
+RATE_LIMIT_<CLASS>="requests/seconds" sets the burst and refill window
+(empty turns the class off). Requests are keyed by user id, or by client IP
+for anonymous requests and the auth class. The client IP is the rightmost
+X-Forwarded-For entry, appended by the ingress; set RATE_LIMIT_TRUST_PROXY=0
+when clients connect directly. LocalBucketStore keeps buckets per process;
+MongoBucketStore shares them through `rate_limits` and lets requests through
+when it is unreachable.
+"""
+import logging
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from asgi import json_response, send_stored_response
+from idempotency import IDEMPOTENCY_METHODS
+from metrics import rate_limited_requests, route_template
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+RATE_LIMIT_TRUST_PROXY = os.environ.get('RATE_LIMIT_TRUST_PROXY', '1') == '1'
+
+
+def parse_rate_limit(value: str) -> Optional[tuple]:
+    if not value:
+        return None
+    requests, _, seconds = value.partition("/")
+    return int(requests), float(seconds or 1)
+
+
+RATE_LIMITS = {
+    name: parse_rate_limit(os.environ.get(f'RATE_LIMIT_{name.upper()}', default))
+    for name, default in (("auth", "10/60"), ("heavy", "60/60"), ("write", "120/60"))
+}
+
+# Routes outside the write class; any other mutating request is a write
+RATE_LIMIT_ROUTES = {
+    ("POST", "/api/auth/login"): "auth",
+    ("POST", "/api/auth/register"): "auth",
+    ("GET", "/api/invites/{token}"): "auth",
+    ("GET", "/api/dashboard"): "heavy",
+    ("GET", "/api/sync"): "heavy",
+    ("GET", "/api/expenses/search"): "heavy",
+    ("GET", "/api/groups/{group_id}/snapshot"): "heavy",
+    ("GET", "/api/groups/{group_id}/settle-plan"): "heavy",
+    ("GET", "/api/groups/{group_id}/export"): "heavy",
+    ("GET", "/api/exports/{export_id}/download"): "heavy",
+    ("POST", "/api/groups/{group_id}/exports"): "heavy",
+    ("POST", "/api/expenses/bulk"): "heavy",
+}
+
+
+def client_ip(scope) -> str:
+    if RATE_LIMIT_TRUST_PROXY:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").rsplit(",", 1)[-1].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class BucketStore(ABC):
+    """Holds token buckets and takes tokens from them atomically."""
+
+    @abstractmethod
+    async def take(self, key: str, capacity: int, rate: float) -> tuple:
+        """Take one token; returns (allowed, tokens left)."""
+
+
+class LocalBucketStore(BucketStore):
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        # key -> (tokens, monotonic time of last update)
+        self.buckets: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def take(self, key: str, capacity: int, rate: float) -> tuple:
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        # An evicted key starts again with a full bucket
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return allowed, tokens
+
+
+class MongoBucketStore(BucketStore):
+    def __init__(self, collection: Callable):
+        self.collection = collection
+
+    async def take(self, key: str, capacity: int, rate: float) -> tuple:
+        now = datetime.now(timezone.utc)
+        refilled = {"$min": [capacity, {"$add": [
+            {"$ifNull": ["$tokens", capacity]},
+            {"$multiply": [rate, {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}]}
+        ]}]}
+        bucket = await self.collection().find_one_and_update(
+            {"key": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    # A bucket left alone this long is full again and can go
+                    "expires_at": now + timedelta(seconds=capacity / rate)
+                }}
+            ],
+            projection={"_id": 0, "allowed": 1, "tokens": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return bucket["allowed"], bucket["tokens"]
+
+
+class RateLimiter:
+    def __init__(self, limits: Dict[str, Optional[tuple]], store: BucketStore, identify: Callable):
+        self.limits = limits
+        self.store = store
+        self.identify = identify
+        self.allowed = {name: 0 for name in limits}
+        self.limited = {name: 0 for name in limits}
+        self.store_errors = 0
+
+    def route_class(self, scope) -> Optional[str]:
+        method = scope["method"]
+        name = RATE_LIMIT_ROUTES.get((method, route_template(scope)))
+        if name is None and method in IDEMPOTENCY_METHODS:
+            name = "write"
+        return name if name and self.limits.get(name) else None
+
+    async def check(self, scope) -> Optional[tuple]:
+        """Charge the request to its bucket; returns (allowed, headers) or None when unlimited."""
+        name = self.route_class(scope)
+        if name is None:
+            return None
+        capacity, seconds = self.limits[name]
+        rate = capacity / seconds
+        user_id = self.identify(scope) if name != "auth" else None
+        key = f"{name}:user:{user_id}" if user_id else f"{name}:ip:{client_ip(scope)}"
+        try:
+            allowed, tokens = await self.store.take(key, capacity, rate)
+        except PyMongoError as e:
+            self.store_errors += 1
+            logger.warning("Rate limit store unavailable, not limiting: %s", e)
+            return None
+        headers = [
+            ("ratelimit-limit", str(capacity)),
+            ("ratelimit-remaining", str(int(tokens))),
+            ("ratelimit-reset", str(math.ceil((capacity - tokens) / rate))),
+            ("ratelimit-policy", f"{capacity};w={seconds:g}"),
+        ]
+        if allowed:
+            self.allowed[name] += 1
+        else:
+            self.limited[name] += 1
+            rate_limited_requests.inc(route_class=name)
+            headers.append(("retry-after", str(math.ceil((1 - tokens) / rate))))
+        return allowed, headers
+
+    def stats(self) -> dict:
+        return {
+            "store": type(self.store).__name__,
+            "limits": {name: f"{limit[0]}/{limit[1]:g}s" if limit else None for name, limit in self.limits.items()},
+            "allowed": dict(self.allowed),
+            "limited": dict(self.limited),
+            "store_errors": self.store_errors,
+        }
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        decision = await self.limiter.check(scope)
+        if decision is None:
+            await self.app(scope, receive, send)
+            return
+
+        allowed, headers = decision
+        if not allowed:
+            await send_stored_response(send, json_response(429, "Too many requests"), headers)
+            return
+
+        encoded = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), *encoded]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
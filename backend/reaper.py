@@ -0,0 +1,135 @@
+"""Background cleanup of deleted groups.
+
+Deleting a group writes a tombstone to `deleted_groups`; the reaper deletes
+the group's records REAP_CHUNK documents at a time and marks the tombstone
+reaped. Every step is idempotent. Reaped tombstones are kept for
+REAP_TOMBSTONE_RETENTION seconds, and every REAP_SWEEP_INTERVAL the reaper
+queues again those a racing write left records for. Groups lost without a
+tombstone are only found by `python manage.py reap --orphans`.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, List
+
+from workers import BackgroundWorker
+
+logger = logging.getLogger(__name__)
+
+REAP_CHUNK = int(os.environ.get('REAP_CHUNK', '1000'))
+REAP_CHUNK_DELAY = float(os.environ.get('REAP_CHUNK_DELAY', '0.05'))
+REAP_SWEEP_INTERVAL = float(os.environ.get('REAP_SWEEP_INTERVAL', '3600'))
+REAP_RETRY_DELAY = float(os.environ.get('REAP_RETRY_DELAY', '60'))
+REAP_TOMBSTONE_RETENTION = int(os.environ.get('REAP_TOMBSTONE_RETENTION', str(7 * 24 * 3600)))
+
+REAPED_COLLECTIONS = ("expenses", "settlements", "changes", "invites", "recurring_expenses")
+
+
+class GroupReaper(BackgroundWorker):
+    name = "Group reaper"
+
+    def __init__(self, database: Callable):
+        super().__init__(poll_interval=REAP_SWEEP_INTERVAL, retry_delay=REAP_RETRY_DELAY)
+        self.database = database
+        self.next_sweep = 0.0
+        self.groups_reaped = 0
+        self.groups_requeued = 0
+        self.orphaned_groups = 0
+        self.deleted = {name: 0 for name in REAPED_COLLECTIONS}
+
+    async def run_once(self) -> float:
+        if time.monotonic() >= self.next_sweep:
+            # A failed sweep waits for the retry delay too, not just the reaping
+            self.next_sweep = time.monotonic() + REAP_RETRY_DELAY
+            await self.sweep_reaped()
+            self.next_sweep = time.monotonic() + REAP_SWEEP_INTERVAL
+        await self.reap_all()
+        return max(0.0, self.next_sweep - time.monotonic())
+
+    async def reap_all(self) -> int:
+        reaped = 0
+        async for tombstone in self.database().deleted_groups.find(
+            {"reaped_at": None}, {"_id": 0}
+        ).sort("deleted_at", 1):
+            await self.reap(tombstone)
+            reaped += 1
+        return reaped
+
+    async def reap(self, tombstone: dict):
+        db = self.database()
+        group_id = tombstone["id"]
+        await db.groups.delete_one({"id": group_id})
+        member_ids = [m["user_id"] for m in tombstone.get("members", [])]
+        rollups = {"user_id": {"$in": member_ids}} if member_ids else {f"groups.{group_id}": {"$exists": True}}
+        await db.user_totals.update_many(rollups, {"$unset": {f"groups.{group_id}": ""}})
+        for name in REAPED_COLLECTIONS:
+            while True:
+                ids = [doc["_id"] for doc in await db[name].find(
+                    {"group_id": group_id}, {"_id": 1}
+                ).limit(REAP_CHUNK).to_list(REAP_CHUNK)]
+                if not ids:
+                    break
+                result = await db[name].delete_many({"_id": {"$in": ids}})
+                self.deleted[name] += result.deleted_count
+                await asyncio.sleep(REAP_CHUNK_DELAY)
+        await db.group_ledgers.delete_one({"group_id": group_id})
+        await db.deleted_groups.update_one({"id": group_id}, {"$set": {"reaped_at": datetime.now(timezone.utc)}})
+        self.groups_reaped += 1
+
+    async def sweep_reaped(self) -> List[str]:
+        """Queue reaped groups that got records back again; returns their ids."""
+        db = self.database()
+        requeued = []
+        async for tombstone in db.deleted_groups.find({"reaped_at": {"$ne": None}}, {"_id": 0, "id": 1}):
+            group_id = tombstone["id"]
+            for name in REAPED_COLLECTIONS:
+                if await db[name].find_one({"group_id": group_id}, {"_id": 1}):
+                    await db.deleted_groups.update_one({"id": group_id}, {"$unset": {"reaped_at": ""}})
+                    requeued.append(group_id)
+                    break
+        if requeued:
+            logger.warning("Found records of %d reaped group(s), queued for reaping again", len(requeued))
+        self.groups_requeued += len(requeued)
+        return requeued
+
+    async def sweep_orphans(self) -> List[str]:
+        """Tombstone missing groups that still own expenses or settlements.
+
+        Reads the group_id of every expense and settlement, so it is left to
+        manage.py rather than run on a schedule.
+        """
+        db = self.database()
+        referenced = set()
+        for name in ("expenses", "settlements"):
+            # A cursor rather than distinct(), whose single reply is capped at 16 MB
+            async for row in db[name].aggregate([{"$group": {"_id": "$group_id"}}], allowDiskUse=True):
+                referenced.add(row["_id"])
+        candidates = sorted(referenced)
+        known = set()
+        for start in range(0, len(candidates), REAP_CHUNK):
+            chunk = candidates[start:start + REAP_CHUNK]
+            for name in ("groups", "deleted_groups"):
+                known.update([g["id"] async for g in db[name].find({"id": {"$in": chunk}}, {"_id": 0, "id": 1})])
+        orphans = [group_id for group_id in candidates if group_id not in known]
+        now = datetime.now(timezone.utc).isoformat()
+        for group_id in orphans:
+            await db.deleted_groups.update_one(
+                {"id": group_id},
+                {"$setOnInsert": {"id": group_id, "members": [], "deleted_at": now, "orphaned": True}},
+                upsert=True
+            )
+        if orphans:
+            logger.warning("Found %d orphaned group(s), queued for reaping", len(orphans))
+        self.orphaned_groups += len(orphans)
+        return orphans
+
+    def stats(self) -> dict:
+        return {
+            "groups_reaped": self.groups_reaped,
+            "groups_requeued": self.groups_requeued,
+            "orphaned_groups": self.orphaned_groups,
+            "documents_deleted": dict(self.deleted),
+            "failures": self.failures,
+        }
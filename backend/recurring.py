@@ -0,0 +1,204 @@
+"""Recurring expense rules and the scheduler that materializes them.
+
+Occurrence n of a template is computed from start_date (monthly and yearly
+rules clamp to short months), and the indexed `next_run_at` lets the
+scheduler sleep until the earliest one is due. Each pass leases up to
+RECURRING_BATCH due templates and inserts their occurrences, at most
+RECURRING_CATCHUP per template, with one insert_many. Expense ids are uuid5
+of (template, date), so a pass retried after a crash cannot duplicate one;
+such duplicates reach `on_run` as `rewritten`.
+"""
+import calendar
+import logging
+import os
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Awaitable, Callable, List
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from workers import BackgroundWorker
+
+logger = logging.getLogger(__name__)
+
+RECURRING_FREQUENCIES = ("daily", "weekly", "monthly", "yearly")
+RECURRING_BATCH = int(os.environ.get('RECURRING_BATCH', '100'))
+RECURRING_CATCHUP = int(os.environ.get('RECURRING_CATCHUP', '366'))
+RECURRING_LEASE = float(os.environ.get('RECURRING_LEASE', '120'))
+RECURRING_POLL = float(os.environ.get('RECURRING_POLL', '60'))
+RECURRING_MIN_SLEEP = 1.0
+RECURRING_NAMESPACE = uuid.UUID("6f1c1d0e-5b8a-4f3e-9a57-2c4d8e1b7a90")
+
+
+def occurrence_date(template: dict, n: int) -> date:
+    start = date.fromisoformat(template["start_date"])
+    step = n * template["interval"]
+    if template["frequency"] == "daily":
+        return start + timedelta(days=step)
+    if template["frequency"] == "weekly":
+        return start + timedelta(weeks=step)
+    months = start.month - 1 + step * (12 if template["frequency"] == "yearly" else 1)
+    year, month = start.year + months // 12, months % 12 + 1
+    return date(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+
+
+def schedule_fields(template: dict, occurrences: int) -> dict:
+    """next_date/next_run_at for the template after `occurrences` runs."""
+    upcoming = occurrence_date(template, occurrences)
+    if template.get("end_date") and upcoming.isoformat() > template["end_date"]:
+        return {"occurrences": occurrences, "next_date": None, "next_run_at": None}
+    return {
+        "occurrences": occurrences,
+        "next_date": upcoming.isoformat(),
+        "next_run_at": datetime(upcoming.year, upcoming.month, upcoming.day, tzinfo=timezone.utc)
+    }
+
+
+def recurring_expense_doc(template: dict, payer: dict, occurrence: date, now: str) -> dict:
+    return {
+        "id": str(uuid.uuid5(RECURRING_NAMESPACE, f"{template['id']}:{occurrence.isoformat()}")),
+        "group_id": template["group_id"],
+        "description": template["description"],
+        "amount_cents": template["amount_cents"],
+        "paid_by": template["paid_by"],
+        "paid_by_name": payer["name"],
+        "split_type": template["split_type"],
+        "splits": template["splits"],
+        "date": occurrence.isoformat(),
+        "created_at": now
+    }
+
+
+class RecurringScheduler(BackgroundWorker):
+    """`on_run(template, group, written, rewritten)` gets one template's inserted expenses."""
+
+    name = "Recurring expense scheduler"
+
+    def __init__(self, database: Callable, on_run: Callable[[dict, dict, List[dict], List[dict]], Awaitable]):
+        super().__init__(poll_interval=RECURRING_POLL)
+        self.database = database
+        self.on_run = on_run
+        self.passes = 0
+        self.templates_run = 0
+        self.expenses_created = 0
+        self.templates_stopped = 0
+
+    async def run_once(self) -> float:
+        while await self.run_due() == RECURRING_BATCH:
+            pass
+        return await self.seconds_until_due()
+
+    async def seconds_until_due(self) -> float:
+        # Templates leased by another worker are its business until the lease
+        # runs out; other workers may also add templates, so never sleep past
+        # RECURRING_POLL, and never less than RECURRING_MIN_SLEEP
+        now = datetime.now(timezone.utc)
+        upcoming = await self.database().recurring_expenses.find_one(
+            {"next_run_at": {"$ne": None}, "$or": [{"lease_until": None}, {"lease_until": {"$lte": now}}]},
+            {"_id": 0, "next_run_at": 1}, sort=[("next_run_at", 1)]
+        )
+        if upcoming is None:
+            return RECURRING_POLL
+        next_run_at = upcoming["next_run_at"]
+        if next_run_at.tzinfo is None:
+            next_run_at = next_run_at.replace(tzinfo=timezone.utc)
+        return min(RECURRING_POLL, max(RECURRING_MIN_SLEEP, (next_run_at - now).total_seconds()))
+
+    async def claim(self, now: datetime, lease_id: str) -> List[dict]:
+        claimed = []
+        while len(claimed) < RECURRING_BATCH:
+            template = await self.database().recurring_expenses.find_one_and_update(
+                {"next_run_at": {"$lte": now}, "$or": [{"lease_until": None}, {"lease_until": {"$lte": now}}]},
+                {"$set": {"lease_id": lease_id, "lease_until": now + timedelta(seconds=RECURRING_LEASE)}},
+                projection={"_id": 0},
+                sort=[("next_run_at", 1)],
+                return_document=ReturnDocument.BEFORE
+            )
+            if template is None:
+                break
+            claimed.append(template)
+        return claimed
+
+    async def run_due(self) -> int:
+        """Materialize every due occurrence of one batch of templates; returns the batch size."""
+        db = self.database()
+        now = datetime.now(timezone.utc)
+        lease_id = str(uuid.uuid4())
+        templates = await self.claim(now, lease_id)
+        if not templates:
+            return 0
+        self.passes += 1
+        groups = {g["id"]: g async for g in db.groups.find(
+            {"id": {"$in": list({t["group_id"] for t in templates})}}, {"_id": 0}
+        )}
+        created_at = now.isoformat()
+        today = now.date()
+        docs, runs, stopped = [], [], []
+        for template in templates:
+            group = groups.get(template["group_id"])
+            payer = next((m for m in group["members"] if m["user_id"] == template["paid_by"]), None) if group else None
+            if payer is None:
+                stopped.append((template, "Group not found" if group is None else "Payer is no longer in the group"))
+                continue
+            count, dates = template["occurrences"], []
+            while len(dates) < RECURRING_CATCHUP:
+                occurrence = occurrence_date(template, count)
+                if occurrence > today or (template.get("end_date") and occurrence.isoformat() > template["end_date"]):
+                    break
+                dates.append(occurrence)
+                count += 1
+            docs.extend(recurring_expense_doc(template, payer, d, created_at) for d in dates)
+            runs.append((template, group, count, len(docs) - len(dates), len(docs)))
+
+        duplicates, failed = set(), set()
+        if docs:
+            try:
+                await db.expenses.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get("writeErrors", []):
+                    if error.get("code") == 11000:
+                        duplicates.add(error["index"])
+                    else:
+                        logger.error("Recurring expense insert failed: %s", error.get("errmsg"))
+                        failed.add(error["index"])
+
+        for template, group, count, start, end in runs:
+            indexes = range(start, end)
+            written = [docs[i] for i in indexes if i not in duplicates and i not in failed]
+            # A duplicate id was inserted by an earlier pass that died before
+            # advancing the template, possibly before its side effects too
+            rewritten = [docs[i] for i in indexes if i in duplicates]
+            if written or rewritten:
+                await self.on_run(template, group, written, rewritten)
+            self.expenses_created += len(written)
+            if any(i in failed for i in indexes):
+                # Leave the schedule where it was; the next pass retries and
+                # finds this pass's inserts as duplicates
+                await db.recurring_expenses.update_one(
+                    {"id": template["id"], "lease_id": lease_id}, {"$unset": {"lease_id": "", "lease_until": ""}}
+                )
+                continue
+            await db.recurring_expenses.update_one(
+                {"id": template["id"], "lease_id": lease_id},
+                {"$set": schedule_fields(template, count), "$unset": {"lease_id": "", "lease_until": ""}}
+            )
+            self.templates_run += 1
+
+        for template, reason in stopped:
+            await db.recurring_expenses.update_one(
+                {"id": template["id"], "lease_id": lease_id},
+                {"$set": {"active": False, "error": reason, "next_date": None, "next_run_at": None},
+                 "$unset": {"lease_id": "", "lease_until": ""}}
+            )
+            self.templates_stopped += 1
+        return len(templates)
+
+    def stats(self) -> dict:
+        return {
+            "passes": self.passes,
+            "templates_run": self.templates_run,
+            "expenses_created": self.expenses_created,
+            "templates_stopped": self.templates_stopped,
+            "failures": self.failures,
+        }
@@ -1,24 +1,60 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, WebSocket, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
 import os
+import io
+import csv
+import json
+import time
+import heapq
+import hashlib
+import asyncio
+import base64
+import math
 import logging
+import tempfile
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr, ConfigDict
-from typing import List, Optional, Dict
+from pydantic import BaseModel, Field, EmailStr, ConfigDict, ValidationError
+from typing import Annotated, List, Optional, Dict
+from collections import OrderedDict
+from abc import ABC, abstractmethod
 import uuid
-from datetime import datetime, timezone
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal, ROUND_HALF_UP
+from concurrent.futures import ThreadPoolExecutor
 import bcrypt
 import jwt
 
+try:
+    import orjson
+except ImportError:  # optional: FAST_JSON falls back to model-validated responses
+    orjson = None
+
+try:
+    import openpyxl
+except ImportError:  # optional: XLSX exports are refused without it
+    openpyxl = None
+
+from metrics import MongoCommandTimer, RequestMetricsMiddleware, TimedRoute, observe_span, registry
+from fanout import ProfileFanout
+from idempotency import IdempotencyMiddleware, IdempotencyStore, mark_handler_started
+from ratelimit import RATE_LIMITS, LocalBucketStore, MongoBucketStore, RateLimiter, RateLimitMiddleware
+from reaper import REAP_TOMBSTONE_RETENTION, GroupReaper
+from recurring import RECURRING_FREQUENCIES, RecurringScheduler, schedule_fields
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandTimer()])
 db = client[os.environ['DB_NAME']]
 
 # JWT Configuration
@@ -28,8 +64,8 @@ JWT_ALGORITHM = "HS256"
 # Create the main app without a prefix
 app = FastAPI(title="SplitSync API")
 
-# Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+# Create a router with the /api prefix; TimedRoute times response validation
+api_router = APIRouter(prefix="/api", route_class=TimedRoute, dependencies=[Depends(mark_handler_started)])
 
 security = HTTPBearer()
 
@@ -42,10 +78,17 @@ logger = logging.getLogger(__name__)
 
 # ==================== MODELS ====================
 
+# Upper bound on any amount accepted from clients, in major units. Sums of
+# amounts in cents must stay well inside MongoDB's 64-bit integers.
+MAX_AMOUNT = 1_000_000_000
+Amount = Annotated[float, Field(gt=0, le=MAX_AMOUNT, allow_inf_nan=False)]
+SplitAmount = Annotated[float, Field(ge=0, le=MAX_AMOUNT, allow_inf_nan=False)]
+
 class UserCreate(BaseModel):
     email: EmailStr
     password: str
     name: str
+    invite_token: Optional[str] = None  # join this invite's group on sign-up
 
 class UserLogin(BaseModel):
     email: EmailStr
@@ -58,6 +101,10 @@ class UserResponse(BaseModel):
     name: str
     created_at: str
 
+class UserUpdate(BaseModel):
+    name: Optional[str] = None
+    email: Optional[EmailStr] = None
+
 class GroupCreate(BaseModel):
     name: str
     description: Optional[str] = ""
@@ -82,12 +129,12 @@ class GroupResponse(BaseModel):
 
 class SplitDetail(BaseModel):
     user_id: str
-    amount: float
+    amount: SplitAmount
 
 class ExpenseCreate(BaseModel):
     group_id: str
     description: str
-    amount: float
+    amount: Amount
     paid_by: str
     split_type: str  # 'equal', 'unequal', 'parts', 'percentage'
     splits: List[SplitDetail]
@@ -95,7 +142,7 @@ class ExpenseCreate(BaseModel):
 
 class ExpenseUpdate(BaseModel):
     description: Optional[str] = None
-    amount: Optional[float] = None
+    amount: Optional[Amount] = None
     paid_by: Optional[str] = None
     split_type: Optional[str] = None
     splits: Optional[List[SplitDetail]] = None
@@ -117,7 +164,7 @@ class SettlementCreate(BaseModel):
     group_id: str
     from_user: str
     to_user: str
-    amount: float
+    amount: Amount
 
 class SettlementResponse(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -138,43 +185,1544 @@ class Balance(BaseModel):
 class AddMemberRequest(BaseModel):
     email: EmailStr
 
+class BulkExpenseRow(BaseModel):
+    description: str
+    amount: Amount
+    paid_by: str  # user_id or email of a group member
+    split_type: str = "equal"
+    splits: List[SplitDetail] = []  # empty = equal split across all members
+    date: Optional[str] = None
+
+class BulkRowError(BaseModel):
+    row: int
+    error: str
+
+class BulkInsertedRow(BaseModel):
+    row: int
+    id: str
+
+class BulkExpenseResult(BaseModel):
+    inserted: List[BulkInsertedRow]
+    errors: List[BulkRowError]
+
+class GroupSnapshot(BaseModel):
+    group: GroupResponse
+    version: int
+    balances: List[Balance]
+    expenses: List[ExpenseResponse]
+    expenses_next_cursor: Optional[str] = None
+    settlements: List[SettlementResponse]
+    settlements_next_cursor: Optional[str] = None
+
+class Change(BaseModel):
+    group_id: str
+    seq: int
+    kind: str  # 'expense', 'settlement', 'member' or 'group'
+    op: str  # 'upsert' or 'delete' (tombstone, doc is empty)
+    id: str
+    doc: Optional[dict] = None
+    created_at: str
+
+class SyncResponse(BaseModel):
+    cursor: str
+    changes: List[Change]
+    reset: List[str]  # groups to reload from /groups/{id}/snapshot
+    removed: List[str]  # groups the user is no longer a member of
+
+class InviteCreate(BaseModel):
+    expires_in_hours: int = Field(168, ge=1, le=720)
+    max_uses: Optional[int] = Field(None, ge=1)
+
+class InviteResponse(BaseModel):
+    id: str
+    token: str
+    url: str
+    group_id: str
+    expires_at: str
+    max_uses: Optional[int] = None
+    uses: int
+    created_at: str
+
+class InvitePreview(BaseModel):
+    group_id: str
+    group_name: str
+    invited_by: str
+    member_count: int
+    expires_at: str
+
+class ExportCreate(BaseModel):
+    format: str = "csv"  # 'csv' or 'xlsx'
+
+class ExportJob(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    group_id: str
+    format: str
+    status: str  # 'pending', 'running', 'done' or 'failed'
+    rows: int = 0
+    size: int = 0
+    error: Optional[str] = None
+    created_at: str
+    download_url: Optional[str] = None
+
+class RecurringExpenseCreate(BaseModel):
+    group_id: str
+    description: str
+    amount: Amount
+    paid_by: str
+    split_type: str
+    splits: List[SplitDetail]
+    frequency: str  # 'daily', 'weekly', 'monthly' or 'yearly'
+    interval: int = Field(1, ge=1, le=366)  # every N days/weeks/months/years
+    start_date: Optional[str] = None  # YYYY-MM-DD, first occurrence; defaults to today
+    end_date: Optional[str] = None  # YYYY-MM-DD, last possible occurrence (inclusive)
+
+class RecurringExpenseResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    group_id: str
+    description: str
+    amount: float
+    paid_by: str
+    paid_by_name: str
+    split_type: str
+    splits: List[SplitDetail]
+    frequency: str
+    interval: int
+    start_date: str
+    end_date: Optional[str] = None
+    next_date: Optional[str] = None  # None once the rule has run out
+    occurrences: int
+    active: bool
+    error: Optional[str] = None
+    created_by: str
+    created_at: str
+
+class ActivityEntry(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    group_id: str
+    group_name: str
+    kind: str  # 'expense', 'settlement' or 'member'
+    op: str  # 'create', 'update', 'delete', 'import', 'recur', 'join' or 'leave'
+    record_id: str
+    actor_id: str
+    actor_name: str
+    description: str
+    amount: Optional[float] = None
+    date: Optional[str] = None
+    created_at: str
+
+class SettleTransfer(BaseModel):
+    from_user: str
+    from_user_name: str
+    to_user: str
+    to_user_name: str
+    amount: float
+
+class SettlePlan(BaseModel):
+    group_id: str
+    method: str  # 'exact' or 'greedy'
+    transfers: List[SettleTransfer]
+
+# ==================== PASSWORD HASHING ====================
+# bcrypt is CPU-bound (~100-300 ms per call) but releases the GIL, so hashing
+# and verification run on a bounded thread pool instead of the event loop.
+# Once PASSWORD_MAX_QUEUE calls are waiting for a worker, further calls are
+# rejected with 503 instead of piling up behind each other.
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+
+class PasswordPool:
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+        self.started_at = time.monotonic()
+
+    async def run(self, fn, *args):
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy, please retry",
+                headers={"Retry-After": "1"}
+            )
+
+        def timed():
+            start = time.perf_counter()
+            result = fn(*args)
+            return result, time.perf_counter() - start
+
+        self.in_flight += 1
+        submitted = time.perf_counter()
+        try:
+            result, elapsed = await asyncio.get_running_loop().run_in_executor(self.executor, timed)
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        self.busy_seconds += elapsed
+        observe_span(fn.__name__, elapsed)
+        observe_span("password_queue", time.perf_counter() - submitted - elapsed)
+        return result
+
+    def stats(self) -> dict:
+        uptime = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": max(0, self.in_flight - self.workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "utilization": round(self.busy_seconds / (uptime * self.workers), 4),
+        }
+
+password_pool = PasswordPool(
+    workers=int(os.environ.get('PASSWORD_WORKERS', str(min(4, os.cpu_count() or 1)))),
+    max_queue=int(os.environ.get('PASSWORD_MAX_QUEUE', '64'))
+)
+
+# ==================== PRINCIPAL CACHE ====================
+# get_current_user runs on every authenticated request. Users are cached per
+# process for PRINCIPAL_CACHE_TTL seconds (LRU-bounded by PRINCIPAL_CACHE_SIZE);
+# anything that changes a user record must call principal_cache.invalidate().
+# With TOKEN_CLAIMS_FRESHNESS > 0, tokens issued within that many seconds are
+# trusted for name/email as well, skipping the lookup entirely.
+
+TOKEN_CLAIMS_FRESHNESS = int(os.environ.get('TOKEN_CLAIMS_FRESHNESS', '0'))
+
+class PrincipalCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.claim_hits = 0
+        self.invalidations = 0
+
+    def get(self, user_id: str) -> Optional[dict]:
+        entry = self.entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            self.entries.pop(user_id, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, user_id: str, user: dict):
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        self.entries[user_id] = (time.monotonic() + self.ttl, user)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        if self.entries.pop(user_id, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "claim_hits": self.claim_hits,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+principal_cache = PrincipalCache(
+    max_size=int(os.environ.get('PRINCIPAL_CACHE_SIZE', '10000')),
+    ttl=float(os.environ.get('PRINCIPAL_CACHE_TTL', '30'))
+)
+
 # ==================== HELPER FUNCTIONS ====================
 
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
 
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
-def create_token(user_id: str, email: str) -> str:
+def create_token(user_id: str, email: str, name: Optional[str] = None, created_at: Optional[str] = None) -> str:
+    now = datetime.now(timezone.utc).timestamp()
     payload = {
         "user_id": user_id,
         "email": email,
-        "exp": datetime.now(timezone.utc).timestamp() + 86400 * 7  # 7 days
+        "iat": int(now),
+        "exp": now + 86400 * 7  # 7 days
     }
+    if name is not None:
+        # Principal claims, only trusted within TOKEN_CLAIMS_FRESHNESS
+        payload["name"] = name
+        payload["created_at"] = created_at
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def authenticate_token(token: str) -> dict:
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         user_id = payload.get("user_id")
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token")
         
-        user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
+        issued_at = payload.get("iat", 0)
+        if TOKEN_CLAIMS_FRESHNESS and "name" in payload and \
+                datetime.now(timezone.utc).timestamp() - issued_at <= TOKEN_CLAIMS_FRESHNESS:
+            principal_cache.claim_hits += 1
+            return {
+                "id": user_id,
+                "email": payload["email"],
+                "name": payload["name"],
+                "created_at": payload["created_at"]
+            }
+        
+        user = principal_cache.get(user_id)
+        if user is None:
+            user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
+            if not user:
+                raise HTTPException(status_code=401, detail="User not found")
+            principal_cache.put(user_id, user)
         return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await authenticate_token(credentials.credentials)
+
+# ==================== MONEY ====================
+# Amounts are stored and summed as integer minor units (cents): expenses and
+# settlements carry `amount_cents` and each split `amount_cents`. The API keeps
+# speaking major units, so conversion happens only at the request/response edge.
+
+def to_cents(amount: float) -> int:
+    # Models bound request amounts; this catches query parameters and the like
+    if not math.isfinite(amount) or abs(amount) > MAX_AMOUNT:
+        raise HTTPException(status_code=400, detail="Amount out of range")
+    return int((Decimal(str(amount)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+def from_cents(cents: int) -> float:
+    return cents / 100
+
+@app.exception_handler(RequestValidationError)
+async def request_validation_error(request: Request, exc: RequestValidationError):
+    # FastAPI's default handler echoes inputs back; a NaN or Infinity amount
+    # cannot be encoded as JSON and turned the 422 into a 500
+    detail = jsonable_encoder(exc.errors(), custom_encoder={float: lambda v: v if math.isfinite(v) else str(v)})
+    return JSONResponse(status_code=422, content={"detail": detail})
+
+def splits_to_cents(splits) -> List[dict]:
+    return [{"user_id": s.user_id, "amount_cents": to_cents(s.amount)} for s in splits]
+
+def expense_to_api(doc: dict) -> dict:
+    out = {k: v for k, v in doc.items() if k not in ("_id", "amount_cents", "splits")}
+    out["amount"] = from_cents(doc["amount_cents"])
+    out["splits"] = [{"user_id": s["user_id"], "amount": from_cents(s["amount_cents"])} for s in doc["splits"]]
+    return out
+
+def settlement_to_api(doc: dict) -> dict:
+    out = {k: v for k, v in doc.items() if k not in ("_id", "amount_cents")}
+    out["amount"] = from_cents(doc["amount_cents"])
+    return out
+
+def expense_response(doc: dict) -> ExpenseResponse:
+    return ExpenseResponse(**expense_to_api(doc))
+
+def settlement_response(doc: dict) -> SettlementResponse:
+    return SettlementResponse(**settlement_to_api(doc))
+
+# ==================== FAST JSON ====================
+# List routes otherwise build one response model per row, have FastAPI
+# validate the list again against response_model and encode it with the
+# stdlib encoder. With FAST_JSON (default on when orjson is installed) rows
+# are projected to the declared fields in the query, converted to API dicts
+# and encoded once by orjson, returned as a ready Response so FastAPI skips
+# its validation pass. The projections must list every field the response
+# models declare.
+
+FAST_JSON = os.environ.get('FAST_JSON', '1') == '1' and orjson is not None
+
+class RowFormat:
+    def __init__(self, model, projection: dict, to_api):
+        self.model = model
+        self.projection = projection
+        self.to_api = to_api
+
+    def response(self, docs: List[dict], headers: Optional[dict] = None):
+        if FAST_JSON:
+            return ORJSONResponse([self.to_api(doc) for doc in docs], headers=headers)
+        return [self.model(**self.to_api(doc)) for doc in docs]
+
+    def line(self, doc: dict) -> bytes:
+        if FAST_JSON:
+            return orjson.dumps(self.to_api(doc)) + b"\n"
+        return (self.model(**self.to_api(doc)).model_dump_json() + "\n").encode('utf-8')
+
+EXPENSE_ROWS = RowFormat(ExpenseResponse, {
+    "_id": 0, "id": 1, "group_id": 1, "description": 1, "amount_cents": 1, "paid_by": 1,
+    "paid_by_name": 1, "split_type": 1, "splits": 1, "date": 1, "created_at": 1
+}, expense_to_api)
+
+SETTLEMENT_ROWS = RowFormat(SettlementResponse, {
+    "_id": 0, "id": 1, "group_id": 1, "from_user": 1, "from_user_name": 1, "to_user": 1,
+    "to_user_name": 1, "amount_cents": 1, "created_at": 1
+}, settlement_to_api)
+
+GROUP_ROWS = RowFormat(GroupResponse, {
+    "_id": 0, "id": 1, "name": 1, "description": 1, "created_by": 1, "members": 1, "created_at": 1
+}, lambda doc: doc)
+
+# ==================== BALANCE LEDGER ====================
+# Each group has one document in `group_ledgers` holding pairwise net balances:
+#   net.<user_id>.<other_id> = amount <other_id> owes <user_id>
+# (negative when <user_id> owes <other_id>). Each user also has one document in
+# `user_totals` with per-group dashboard rollups:
+#   groups.<group_id>.owed / groups.<group_id>.owing
+# Write paths apply deltas with $inc, so balance and dashboard reads never
+# rescan the expense history. Delta paths are "net.<user>.<other>" for the
+# ledger and "totals.<user>.owed|owing" for the rollups.
+
+def expense_balance_deltas(expense: dict, sign: int = 1) -> Dict[str, int]:
+    deltas: Dict[str, int] = {}
+
+    def add(path: str, amount: int):
+        deltas[path] = deltas.get(path, 0) + amount
+
+    paid_by = expense["paid_by"]
+    for split in expense["splits"]:
+        user_id = split["user_id"]
+        if user_id == paid_by:
+            continue
+        amount = split["amount_cents"] * sign
+        add(f"net.{paid_by}.{user_id}", amount)
+        add(f"net.{user_id}.{paid_by}", -amount)
+        add(f"totals.{paid_by}.owed", amount)
+        add(f"totals.{user_id}.owing", amount)
+    return deltas
+
+def settlement_balance_deltas(settlement: dict, sign: int = 1) -> Dict[str, int]:
+    from_user = settlement["from_user"]
+    to_user = settlement["to_user"]
+    if from_user == to_user:
+        return {}
+    amount = settlement["amount_cents"] * sign
+    return {
+        f"net.{from_user}.{to_user}": amount,
+        f"net.{to_user}.{from_user}": -amount,
+        f"totals.{from_user}.owing": -amount,
+        f"totals.{to_user}.owed": -amount,
+    }
+
+def merge_deltas(*deltas: Dict[str, int]) -> Dict[str, int]:
+    merged: Dict[str, int] = {}
+    for delta in deltas:
+        for path, amount in delta.items():
+            merged[path] = merged.get(path, 0) + amount
+    return {path: amount for path, amount in merged.items() if amount}
+
+def empty_totals() -> Dict[str, int]:
+    return {"owed": 0, "owing": 0}
+
+async def compute_group_balances(group_id: str):
+    """Recompute the pairwise ledger and per-user totals of a group from raw history."""
+    net: Dict[str, Dict[str, int]] = {}
+    totals: Dict[str, Dict[str, int]] = {}
+
+    def accumulate(deltas: Dict[str, int]):
+        for path, amount in deltas.items():
+            kind, user_id, key = path.split(".")
+            row = (net if kind == "net" else totals).setdefault(user_id, {})
+            row[key] = row.get(key, 0) + amount
+
+    async for expense in db.expenses.find({"group_id": group_id}, {"_id": 0, "paid_by": 1, "splits": 1}):
+        accumulate(expense_balance_deltas(expense))
+    async for settlement in db.settlements.find(
+        {"group_id": group_id}, {"_id": 0, "from_user": 1, "to_user": 1, "amount_cents": 1}
+    ):
+        accumulate(settlement_balance_deltas(settlement))
+    return net, totals
+
+async def rebuild_group_ledger(group_id: str):
+    net, totals = await compute_group_balances(group_id)
+    await db.group_ledgers.replace_one(
+        {"group_id": group_id},
+        {"group_id": group_id, "net": net, "rebuilt_at": datetime.now(timezone.utc).isoformat()},
+        upsert=True
+    )
+
+    # Members without any activity still get a zero rollup so the dashboard
+    # can tell "nothing owed" apart from "not built yet".
+    group = await db.groups.find_one({"id": group_id}, {"_id": 0, "members.user_id": 1})
+    for member in (group or {}).get("members", []):
+        totals.setdefault(member["user_id"], {})
+    if totals:
+        await db.user_totals.bulk_write([
+            UpdateOne(
+                {"user_id": user_id},
+                {"$set": {f"groups.{group_id}": {**empty_totals(), **user_totals}}},
+                upsert=True
+            )
+            for user_id, user_totals in totals.items()
+        ], ordered=False)
+    return net, totals
+
+async def verify_group_ledger(group_id: str) -> List[dict]:
+    """Compare the stored ledger and dashboard rollups with raw history.
+
+    Returns every drifted pair ({"user_id", "other_id", ...}) and rollup
+    ({"user_id", "rollup": "owed" | "owing", ...}).
+    """
+    expected, expected_totals = await compute_group_balances(group_id)
+    ledger = await db.group_ledgers.find_one({"group_id": group_id}, {"_id": 0})
+    stored = ledger["net"] if ledger else {}
+
+    drift = []
+    for user_id in set(expected) | set(stored):
+        expected_row = expected.get(user_id, {})
+        stored_row = stored.get(user_id, {})
+        for other_id in set(expected_row) | set(stored_row):
+            want = expected_row.get(other_id, 0)
+            have = stored_row.get(other_id, 0)
+            if want != have:
+                drift.append({"user_id": user_id, "other_id": other_id, "expected": want, "stored": have})
+
+    # A missing rollup is rebuilt on first read, so only stored ones can drift
+    group = await db.groups.find_one({"id": group_id}, {"_id": 0, "members.user_id": 1})
+    user_ids = set(expected) | set(expected_totals) | {m["user_id"] for m in (group or {}).get("members", [])}
+    path = f"groups.{group_id}"
+    async for doc in db.user_totals.find(
+        {"user_id": {"$in": list(user_ids)}, path: {"$exists": True}}, {"_id": 0, "user_id": 1, path: 1}
+    ):
+        stored_totals = doc["groups"][group_id]
+        for field in ("owed", "owing"):
+            want = expected_totals.get(doc["user_id"], {}).get(field, 0)
+            have = stored_totals.get(field, 0)
+            if want != have:
+                drift.append({"user_id": doc["user_id"], "rollup": field, "expected": want, "stored": have})
+    return drift
+
+async def apply_balance_deltas(group_id: str, deltas: Dict[str, int]):
+    """Apply balance deltas after the raw expense/settlement write has landed.
+
+    Groups that predate the ledger have no document yet; those are rebuilt from
+    history instead, which already includes the write being applied.
+    """
+    ledger_deltas = {}
+    user_deltas: Dict[str, Dict[str, int]] = {}
+    for path, amount in deltas.items():
+        if not amount:
+            continue
+        if path.startswith("net."):
+            ledger_deltas[path] = amount
+        else:
+            _, user_id, key = path.split(".")
+            user_deltas.setdefault(user_id, {})[f"groups.{group_id}.{key}"] = amount
+    if not ledger_deltas and not user_deltas:
+        return
+
+    update = {"$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
+    if ledger_deltas:
+        update["$inc"] = ledger_deltas
+    result = await db.group_ledgers.update_one({"group_id": group_id}, update)
+    if result.matched_count == 0:
+        await rebuild_group_ledger(group_id)
+        return
+    if user_deltas:
+        await db.user_totals.bulk_write([
+            UpdateOne({"user_id": user_id}, {"$inc": inc}, upsert=True)
+            for user_id, inc in user_deltas.items()
+        ], ordered=False)
+
+async def init_user_totals(group_id: str, user_ids: List[str]):
+    """Create zero rollups for users joining a group."""
+    await db.user_totals.bulk_write([
+        UpdateOne(
+            {"user_id": user_id},
+            {"$inc": {f"groups.{group_id}.owed": 0, f"groups.{group_id}.owing": 0}},
+            upsert=True
+        )
+        for user_id in user_ids
+    ], ordered=False)
+
+async def get_ledger_row(group_id: str, user_id: str) -> Dict[str, int]:
+    ledger = await db.group_ledgers.find_one({"group_id": group_id}, {"_id": 0, f"net.{user_id}": 1})
+    if ledger is None:
+        net, _ = await rebuild_group_ledger(group_id)
+        return net.get(user_id, {})
+    return ledger.get("net", {}).get(user_id, {})
+
+async def get_user_group_totals(user_id: str, group_ids: List[str]) -> Dict[str, Dict[str, int]]:
+    """Return the dashboard rollup of each group, rebuilding any that are missing."""
+    if not group_ids:
+        return {}
+    doc = await db.user_totals.find_one(
+        {"user_id": user_id},
+        {"_id": 0, **{f"groups.{group_id}": 1 for group_id in group_ids}}
+    )
+    group_totals = (doc or {}).get("groups", {})
+    for group_id in group_ids:
+        if group_id not in group_totals:
+            _, totals = await rebuild_group_ledger(group_id)
+            group_totals[group_id] = {**empty_totals(), **totals.get(user_id, {})}
+    return group_totals
+
+# ==================== BALANCE ENGINES ====================
+# BALANCE_ENGINE selects how balances and dashboard totals are computed:
+#   "ledger"    - read the incrementally maintained ledger/rollups (default)
+#   "aggregate" - sum in MongoDB with an aggregation pipeline over raw history
+#   "scan"      - replay raw history in Python
+# The alternatives exist so the ledger can be benchmarked against them.
+
+BALANCE_ENGINES = ("ledger", "aggregate", "scan")
+BALANCE_ENGINE = os.environ.get('BALANCE_ENGINE', 'ledger')
+if BALANCE_ENGINE not in BALANCE_ENGINES:
+    raise RuntimeError(f"BALANCE_ENGINE must be one of {', '.join(BALANCE_ENGINES)}")
+
+def _involves(user_id: str, *fields: str) -> dict:
+    return {"$or": [{field: user_id} for field in fields]}
+
+def _pick(condition: dict, when_true, when_false) -> dict:
+    return {"$cond": [condition, when_true, when_false]}
+
+def _negate(value) -> dict:
+    return {"$multiply": [value, -1]}
+
+def _expense_split_stages(group_filter: dict, user_id: str) -> List[dict]:
+    """Unwind splits of expenses touching the user, keeping only splits between two different people."""
+    return [
+        {"$match": {**group_filter, **_involves(user_id, "paid_by", "splits.user_id")}},
+        {"$unwind": "$splits"},
+        {"$match": {
+            **_involves(user_id, "paid_by", "splits.user_id"),
+            "$expr": {"$ne": ["$paid_by", "$splits.user_id"]}
+        }},
+    ]
+
+def _settlement_stages(group_filter: dict, user_id: str) -> List[dict]:
+    return [
+        {"$match": {**group_filter, **_involves(user_id, "from_user", "to_user")}},
+        {"$match": {"$expr": {"$ne": ["$from_user", "$to_user"]}}},
+    ]
+
+async def aggregate_balance_row(group_id: str, user_id: str) -> Dict[str, int]:
+    group_filter = {"group_id": group_id}
+    i_paid = {"$eq": ["$paid_by", user_id]}
+    i_sent = {"$eq": ["$from_user", user_id]}
+    pipeline = _expense_split_stages(group_filter, user_id) + [
+        {"$project": {
+            "_id": 0,
+            "other_id": _pick(i_paid, "$splits.user_id", "$paid_by"),
+            "amount": _pick(i_paid, "$splits.amount_cents", _negate("$splits.amount_cents"))
+        }},
+        {"$unionWith": {"coll": "settlements", "pipeline": _settlement_stages(group_filter, user_id) + [
+            {"$project": {
+                "_id": 0,
+                "other_id": _pick(i_sent, "$to_user", "$from_user"),
+                "amount": _pick(i_sent, "$amount_cents", _negate("$amount_cents"))
+            }},
+        ]}},
+        {"$group": {"_id": "$other_id", "amount": {"$sum": "$amount"}}},
+    ]
+    return {row["_id"]: row["amount"] async for row in db.expenses.aggregate(pipeline)}
+
+async def aggregate_user_totals(user_id: str, group_ids: List[str]) -> Dict[str, Dict[str, int]]:
+    group_filter = {"group_id": {"$in": group_ids}}
+    i_paid = {"$eq": ["$paid_by", user_id]}
+    i_sent = {"$eq": ["$from_user", user_id]}
+    pipeline = _expense_split_stages(group_filter, user_id) + [
+        {"$project": {
+            "_id": 0,
+            "group_id": 1,
+            "owed": _pick(i_paid, "$splits.amount_cents", 0),
+            "owing": _pick(i_paid, 0, "$splits.amount_cents")
+        }},
+        {"$unionWith": {"coll": "settlements", "pipeline": _settlement_stages(group_filter, user_id) + [
+            {"$project": {
+                "_id": 0,
+                "group_id": 1,
+                "owed": _pick(i_sent, 0, _negate("$amount_cents")),
+                "owing": _pick(i_sent, _negate("$amount_cents"), 0)
+            }},
+        ]}},
+        {"$group": {"_id": "$group_id", "owed": {"$sum": "$owed"}, "owing": {"$sum": "$owing"}}},
+    ]
+    totals = {group_id: empty_totals() for group_id in group_ids}
+    async for row in db.expenses.aggregate(pipeline):
+        totals[row["_id"]] = {"owed": row["owed"], "owing": row["owing"]}
+    return totals
+
+async def load_balance_row(group_id: str, user_id: str) -> Dict[str, int]:
+    """Net balance between the user and every counterparty in the group."""
+    if BALANCE_ENGINE == "aggregate":
+        return await aggregate_balance_row(group_id, user_id)
+    if BALANCE_ENGINE == "scan":
+        net, _ = await compute_group_balances(group_id)
+        return net.get(user_id, {})
+    return await get_ledger_row(group_id, user_id)
+
+async def load_user_totals(user_id: str, group_ids: List[str]) -> Dict[str, Dict[str, int]]:
+    """Owed/owing totals of the user in each of the given groups."""
+    if not group_ids:
+        return {}
+    if BALANCE_ENGINE == "aggregate":
+        return await aggregate_user_totals(user_id, group_ids)
+    if BALANCE_ENGINE == "scan":
+        totals = {}
+        for group_id in group_ids:
+            _, group_totals = await compute_group_balances(group_id)
+            totals[group_id] = {**empty_totals(), **group_totals.get(user_id, {})}
+        return totals
+    return await get_user_group_totals(user_id, group_ids)
+
+# ==================== SETTLE-UP PLANNER ====================
+# Turns per-member net positions (in cents, positive = owed money) into a
+# small set of transfers. The greedy matcher repeatedly pairs the largest
+# creditor with the largest debtor, which needs at most n-1 transfers and runs
+# in O(n log n). For small groups the exact solver finds the minimum: the
+# fewest transfers equals n minus the largest number of disjoint zero-sum
+# subgroups, found with a DP over member subsets.
+
+SETTLE_EXACT_MAX = int(os.environ.get('SETTLE_EXACT_MAX', '12'))
+
+def plan_greedy_transfers(positions: Dict[str, int]) -> List[tuple]:
+    creditors = [(-amount, user_id) for user_id, amount in positions.items() if amount > 0]
+    debtors = [(amount, user_id) for user_id, amount in positions.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((debtor, creditor, amount))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+    return transfers
+
+def plan_exact_transfers(positions: Dict[str, int]) -> List[tuple]:
+    members = [user_id for user_id, amount in positions.items() if amount]
+    n = len(members)
+    full = (1 << n) - 1
+    amounts = [positions[user_id] for user_id in members]
+
+    subset_sum = [0] * (full + 1)
+    best = [0] * (full + 1)  # most zero-sum subgroups any ordering of the subset can be cut into
+    for mask in range(1, full + 1):
+        low = mask & -mask
+        subset_sum[mask] = subset_sum[mask ^ low] + amounts[low.bit_length() - 1]
+        bits = mask
+        while bits:
+            bit = bits & -bits
+            best[mask] = max(best[mask], best[mask ^ bit])
+            bits ^= bit
+        if subset_sum[mask] == 0:
+            best[mask] += 1
+
+    # Recover an ordering whose zero-sum prefixes realise best[full], then
+    # settle each zero-sum subgroup on its own.
+    order = []
+    mask = full
+    while mask:
+        target = best[mask] - (1 if subset_sum[mask] == 0 else 0)
+        bits = mask
+        while bits:
+            bit = bits & -bits
+            if best[mask ^ bit] == target:
+                break
+            bits ^= bit
+        order.append(bit.bit_length() - 1)
+        mask ^= bit
+    order.reverse()
+
+    transfers = []
+    subgroup = {}
+    running = 0
+    for index in order:
+        subgroup[members[index]] = amounts[index]
+        running += amounts[index]
+        if running == 0:
+            transfers.extend(plan_greedy_transfers(subgroup))
+            subgroup = {}
+    if subgroup:
+        transfers.extend(plan_greedy_transfers(subgroup))
+    return transfers
+
+def plan_transfers(positions: Dict[str, int], exact: bool = True):
+    """Return (method, transfers) where transfers are (from_user, to_user, cents)."""
+    if exact and sum(1 for amount in positions.values() if amount) <= SETTLE_EXACT_MAX:
+        return "exact", plan_exact_transfers(positions)
+    return "greedy", plan_greedy_transfers(positions)
+
+async def load_net_positions(group_id: str) -> Dict[str, int]:
+    """Net position of every member: what the group owes them minus what they owe."""
+    if BALANCE_ENGINE == "ledger":
+        ledger = await db.group_ledgers.find_one({"group_id": group_id}, {"_id": 0, "net": 1})
+        net = ledger["net"] if ledger else (await rebuild_group_ledger(group_id))[0]
+    else:
+        net, _ = await compute_group_balances(group_id)
+    return {user_id: sum(row.values()) for user_id, row in net.items()}
+
+# ==================== REALTIME EVENTS ====================
+# Every change appended to the feed is also pushed to connected WebSocket
+# clients. An in-process EventHub fans events out to subscriptions keyed by
+# group_id (plus "user:<id>" for membership changes of that user). Each
+# subscription has a bounded buffer; a consumer that falls WS_SEND_BUFFER
+# events behind is disconnected and expected to catch up through /sync.
+# The EventBroker carries events to the hub of every worker: LocalBroker for a
+# single process, ChangeStreamBroker to share them through a MongoDB change
+# stream on `changes` (requires a replica set).
+
+WS_SEND_BUFFER = int(os.environ.get('WS_SEND_BUFFER', '256'))
+
+def event_keys(change: dict) -> List[str]:
+    keys = [change["group_id"]]
+    if change["kind"] == "member":
+        keys.append(f"user:{change['id']}")
+    return keys
+
+class Subscription:
+    def __init__(self, keys: List[str], max_buffer: int):
+        self.keys = set(keys)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffer)
+        self.overflowed = False
+
+class EventHub:
+    def __init__(self):
+        self.subscribers: Dict[str, set] = {}
+        self.connections = 0
+        self.delivered = 0
+        self.overflows = 0
+
+    def subscribe(self, keys: List[str], max_buffer: int) -> Subscription:
+        subscription = Subscription([], max_buffer)
+        self.add_keys(subscription, keys)
+        self.connections += 1
+        return subscription
+
+    def add_keys(self, subscription: Subscription, keys: List[str]):
+        for key in keys:
+            subscription.keys.add(key)
+            self.subscribers.setdefault(key, set()).add(subscription)
+
+    def remove_keys(self, subscription: Subscription, keys: List[str]):
+        for key in keys:
+            subscription.keys.discard(key)
+            subscribers = self.subscribers.get(key)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[key]
+
+    def unsubscribe(self, subscription: Subscription):
+        self.remove_keys(subscription, list(subscription.keys))
+        self.connections -= 1
+
+    def dispatch(self, change: dict):
+        targets = set()
+        for key in event_keys(change):
+            targets.update(self.subscribers.get(key, ()))
+        for subscription in targets:
+            if subscription.overflowed:
+                continue
+            try:
+                subscription.queue.put_nowait(change)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                subscription.overflowed = True
+                self.overflows += 1
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "channels": len(self.subscribers),
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+        }
+
+class EventBroker(ABC):
+    """Delivers published changes to the hub of every worker."""
+
+    def __init__(self, hub: EventHub):
+        self.hub = hub
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    @abstractmethod
+    async def publish(self, change: dict):
+        ...
+
+class LocalBroker(EventBroker):
+    async def publish(self, change: dict):
+        self.hub.dispatch(change)
+
+class ChangeStreamBroker(EventBroker):
+    # Changes are already persisted to `changes`, so publishing is a no-op and
+    # every worker tails the collection instead.
+
+    def __init__(self, hub: EventHub):
+        super().__init__(hub)
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self.watch())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def publish(self, change: dict):
+        pass
+
+    async def watch(self):
+        resume_token = None
+        while True:
+            try:
+                async with db.changes.watch(
+                    [{"$match": {"operationType": "insert"}}],
+                    resume_after=resume_token
+                ) as stream:
+                    async for event in stream:
+                        resume_token = stream.resume_token
+                        change = {k: v for k, v in event["fullDocument"].items() if k != "_id"}
+                        self.hub.dispatch(change)
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                logger.warning("Change stream interrupted, retrying: %s", e)
+                await asyncio.sleep(1)
+
+EVENT_BROKERS = {"local": LocalBroker, "mongo": ChangeStreamBroker}
+event_hub = EventHub()
+event_broker: EventBroker = EVENT_BROKERS[os.environ.get('EVENT_BROKER', 'local')](event_hub)
+
+# ==================== CHANGE FEED ====================
+# Every group document carries a `version` that doubles as the group's change
+# sequence. Mutating routes bump it after their write lands and append one
+# `changes` document per changed record (deletes as tombstones), so clients
+# can sync by sequence instead of re-downloading history. Bumping after the
+# write also means a snapshot can never be cached under a superseded version.
+# A write that dies between the bump and the append leaves a gap; /sync holds
+# back at a gap for SYNC_GAP_GRACE seconds and then resets the group.
+
+SYNC_MAX_CHANGES = int(os.environ.get('SYNC_MAX_CHANGES', '1000'))
+SYNC_GAP_GRACE = int(os.environ.get('SYNC_GAP_GRACE', '30'))
+
+def bump_version(update: dict, count: int = 1) -> dict:
+    """Add a bump that takes `count` sequence numbers to a group update."""
+    return {
+        **update,
+        "$set": {**update.get("$set", {}), "changed_at": datetime.now(timezone.utc).isoformat()},
+        "$inc": {"version": count}
+    }
+
+def change_entry(kind: str, op: str, record_id: str, doc: Optional[dict] = None) -> dict:
+    return {"kind": kind, "op": op, "id": record_id, "doc": doc}
+
+async def append_changes(group_id: str, last_seq: int, entries: List[dict]):
+    """Store entries under the sequence numbers ending at last_seq."""
+    first_seq = last_seq - len(entries) + 1
+    now = datetime.now(timezone.utc).isoformat()
+    changes = [
+        {"group_id": group_id, "seq": first_seq + i, **entry, "created_at": now}
+        for i, entry in enumerate(entries)
+    ]
+    await db.changes.insert_many([dict(change) for change in changes])
+    for change in changes:
+        await event_broker.publish(change)
+
+async def record_changes(group_id: str, entries: List[dict]) -> int:
+    """Bump the group's version once per entry and append the entries to its feed."""
+    if not entries:
+        return 0
+    group = await db.groups.find_one_and_update(
+        {"id": group_id},
+        bump_version({}, len(entries)),
+        projection={"_id": 0, "version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if group is None:
+        return 0
+    await append_changes(group_id, group["version"], entries)
+    return group["version"]
+
+def encode_sync_cursor(positions: Dict[str, int]) -> str:
+    raw = json.dumps(positions, separators=(",", ":")).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip("=")
+
+def decode_sync_cursor(cursor: str) -> Dict[str, int]:
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(positions, dict) or not all(isinstance(v, int) for v in positions.values()):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return positions
+
+def snapshot_etag(group: dict, user_id: str) -> str:
+    # Balances are per viewer, so the viewer is part of the tag
+    digest = hashlib.sha1(f"{group['id']}:{group.get('version', 0)}:{user_id}".encode('utf-8')).hexdigest()
+    return f'"{digest[:24]}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+# ==================== PROFILE FAN-OUT ====================
+# Profile changes are copied into groups, expenses and settlements by the
+# worker in fanout.py. Every rewritten document goes through record_changes
+# like any other write, so group versions move on and /sync and snapshot
+# ETags see the new names.
+
+# Change-feed kind and API shape of the denormalized rows each stage rewrites
+FANOUT_ROWS = {"expenses": ("expense", expense_to_api), "settlements": ("settlement", settlement_to_api)}
+
+async def record_profile_fanout(collection: str, job: dict, docs: List[dict]):
+    if collection == "groups":
+        member = {"user_id": job["user_id"], "name": job["name"], "email": job["email"]}
+        for doc in docs:
+            await record_changes(doc["id"], [change_entry("member", "upsert", job["user_id"], member)])
+        return
+    kind, to_api = FANOUT_ROWS[collection]
+    by_group: Dict[str, List[dict]] = {}
+    async for row in db[collection].find({"_id": {"$in": [doc["_id"] for doc in docs]}}, {"_id": 0}):
+        by_group.setdefault(row["group_id"], []).append(change_entry(kind, "upsert", row["id"], to_api(row)))
+    for group_id, entries in by_group.items():
+        await record_changes(group_id, entries)
+
+profile_fanout = ProfileFanout(lambda: db, record_profile_fanout)
+
+# ==================== GROUP REAPER ====================
+# Deleted groups are tombstoned by the route and cleaned up by the worker in
+# reaper.py.
+
+group_reaper = GroupReaper(lambda: db)
+
+# ==================== ACTIVITY FEED ====================
+# Each user has their own partition of `activity`, written on every expense,
+# settlement and membership event with one entry per group member (fan-out on
+# write), so /activity is a single indexed range read however many groups the
+# user is in. Entries are denormalized snapshots and are never rewritten.
+# They expire ACTIVITY_RETENTION_DAYS after being written through a TTL index
+# on expires_at (0 keeps them forever); the retention in force when an entry
+# is written applies to it.
+
+ACTIVITY_RETENTION_DAYS = int(os.environ.get('ACTIVITY_RETENTION_DAYS', '90'))
+
+async def record_activity(group: dict, kind: str, op: str, record_id: str, actor: dict, description: str,
+                          amount_cents: Optional[int] = None, date: Optional[str] = None,
+                          extra_user_ids: tuple = ()):
+    now = datetime.now(timezone.utc)
+    entry = {
+        "id": str(uuid.uuid4()),
+        "group_id": group["id"],
+        "group_name": group["name"],
+        "kind": kind,
+        "op": op,
+        "record_id": record_id,
+        "actor_id": actor["id"],
+        "actor_name": actor["name"],
+        "description": description,
+        "amount_cents": amount_cents,
+        "date": date,
+        "created_at": now.isoformat()
+    }
+    if ACTIVITY_RETENTION_DAYS > 0:
+        entry["expires_at"] = now + timedelta(days=ACTIVITY_RETENTION_DAYS)
+    user_ids = {m["user_id"] for m in group["members"]} | set(extra_user_ids)
+    await db.activity.insert_many([{**entry, "user_id": user_id} for user_id in user_ids], ordered=False)
+
+def activity_to_api(doc: dict) -> dict:
+    out = {k: v for k, v in doc.items() if k not in ("_id", "user_id", "amount_cents", "expires_at")}
+    out["amount"] = from_cents(doc["amount_cents"]) if doc.get("amount_cents") is not None else None
+    return out
+
+ACTIVITY_ROWS = RowFormat(ActivityEntry, {"_id": 0, "user_id": 0, "expires_at": 0}, activity_to_api)
+
+# ==================== INVITES ====================
+# An invite is a signed JWT ({typ: invite, jti, group_id, exp}) backed by one
+# `invites` document keyed by jti, so resolving a token is a signature check
+# plus one unique-index read and revoking is deleting the document. Redeeming
+# claims a use with a single conditional update (expiry is the token's, the
+# use limit and the per-minute cap INVITE_REDEMPTIONS_PER_MINUTE are checked
+# in the filter) and then joins with one $addToSet guarded by a $ne on
+# members.user_id, so concurrent redemptions can neither double-join nor
+# overspend max_uses. Expired invites are purged by a TTL index.
+
+INVITE_REDEMPTIONS_PER_MINUTE = int(os.environ.get('INVITE_REDEMPTIONS_PER_MINUTE', '20'))
+INVITE_BASE_URL = os.environ.get('INVITE_BASE_URL', '').rstrip('/')
+
+def create_invite_token(invite_id: str, group_id: str, expires_at: datetime) -> str:
+    payload = {"typ": "invite", "jti": invite_id, "group_id": group_id, "exp": int(expires_at.timestamp())}
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def decode_invite_token(token: str) -> dict:
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=410, detail="Invite has expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=400, detail="Invalid invite")
+    if payload.get("typ") != "invite" or not payload.get("jti"):
+        raise HTTPException(status_code=400, detail="Invalid invite")
+    return payload
+
+def invite_response(doc: dict) -> InviteResponse:
+    expires_at = doc["expires_at"]
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    token = create_invite_token(doc["id"], doc["group_id"], expires_at)
+    return InviteResponse(
+        id=doc["id"],
+        token=token,
+        url=f"{INVITE_BASE_URL}/join/{token}",
+        group_id=doc["group_id"],
+        expires_at=expires_at.isoformat(),
+        max_uses=doc.get("max_uses"),
+        uses=doc.get("uses", 0),
+        created_at=doc["created_at"]
+    )
+
+async def redeem_invite(token: str, user: dict) -> dict:
+    """Add the user to the invite's group and return the group (unchanged if already a member)."""
+    payload = decode_invite_token(token)
+    now = time.time()
+    window = int(now // 60)
+    
+    invite = await db.invites.find_one_and_update(
+        {"id": payload["jti"], "$and": [
+            {"$or": [{"max_uses": None}, {"$expr": {"$lt": ["$uses", "$max_uses"]}}]},
+            {"$or": [{"window": {"$ne": window}}, {"window_count": {"$lt": INVITE_REDEMPTIONS_PER_MINUTE}}]}
+        ]},
+        [{"$set": {
+            "uses": {"$add": ["$uses", 1]},
+            "window_count": {"$cond": [{"$eq": ["$window", window]}, {"$add": ["$window_count", 1]}, 1]},
+            "window": window
+        }}],
+        projection={"_id": 0, "id": 1, "group_id": 1}
+    )
+    if not invite:
+        existing = await db.invites.find_one({"id": payload["jti"]}, {"_id": 0, "uses": 1, "max_uses": 1})
+        if not existing:
+            raise HTTPException(status_code=410, detail="Invite has been revoked")
+        if existing.get("max_uses") is not None and existing["uses"] >= existing["max_uses"]:
+            raise HTTPException(status_code=410, detail="Invite has been used up")
+        raise HTTPException(
+            status_code=429,
+            detail="Too many joins with this invite, please retry shortly",
+            headers={"Retry-After": str(60 - int(now) % 60)}
+        )
+    
+    member = {"user_id": user["id"], "name": user["name"], "email": user["email"]}
+    group = await db.groups.find_one_and_update(
+        {"id": invite["group_id"], "members.user_id": {"$ne": user["id"]}},
+        bump_version({"$addToSet": {"members": member}}),
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not group:
+        # Already a member, or the group is gone: give the use back
+        await db.invites.update_one({"id": invite["id"]}, {"$inc": {"uses": -1}})
+        group = await db.groups.find_one({"id": invite["group_id"], "members.user_id": user["id"]}, {"_id": 0})
+        if not group:
+            raise HTTPException(status_code=404, detail="Group not found")
+        return group
+    
+    await asyncio.gather(
+        append_changes(group["id"], group["version"], [change_entry("member", "upsert", user["id"], member)]),
+        init_user_totals(group["id"], [user["id"]]),
+        record_activity(group, "member", "join", user["id"], user, f"{user['name']} joined the group")
+    )
+    return group
+
+# ==================== STATEMENT EXPORT ====================
+# A statement is a group's full expense and settlement history in
+# chronological order, with the requesting user's balance change per row and
+# a running balance (positive = owed to them, the same sign as the ledger).
+# The two collections are read through their own cursors and merged on
+# (created_at, id), and rows are written out in EXPORT_CHUNK_ROWS batches, so
+# memory stays flat however long the history is. Exports can be streamed
+# straight to the client or run as a background job that writes into the
+# `exports` GridFS bucket, which every worker can serve downloads from.
+# Finished exports are kept for EXPORT_RETENTION_HOURS.
+
+EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', '1000'))
+EXPORT_RETENTION_HOURS = int(os.environ.get('EXPORT_RETENTION_HOURS', '24'))
+EXPORT_CONCURRENCY = int(os.environ.get('EXPORT_CONCURRENCY', '2'))
+EXPORT_SORT = [("created_at", 1), ("id", 1)]
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+STATEMENT_COLUMNS = [
+    "date", "type", "description", "paid_by", "paid_to", "amount", "your_share", "balance_change", "running_balance"
+]
+
+def check_export_format(export_format: str):
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Format must be csv or xlsx")
+    if export_format == "xlsx" and openpyxl is None:
+        raise HTTPException(status_code=400, detail="XLSX export is not available on this server")
+
+def user_balance_change(deltas: Dict[str, int], user_id: str) -> int:
+    prefix = f"net.{user_id}."
+    return sum(amount for path, amount in deltas.items() if path.startswith(prefix))
+
+async def _tagged(cursor, kind: str):
+    async for doc in cursor:
+        yield kind, doc
+
+async def statement_rows(group_id: str, user_id: str):
+    """Yield statement rows (lists in STATEMENT_COLUMNS order), oldest first."""
+    streams = [
+        _tagged(db.expenses.find({"group_id": group_id}, EXPENSE_ROWS.projection)
+                .sort(EXPORT_SORT).batch_size(EXPORT_CHUNK_ROWS), "expense"),
+        _tagged(db.settlements.find({"group_id": group_id}, SETTLEMENT_ROWS.projection)
+                .sort(EXPORT_SORT).batch_size(EXPORT_CHUNK_ROWS), "settlement"),
+    ]
+    heads = [await anext(stream, None) for stream in streams]
+    balance = 0
+    while any(heads):
+        index = min((i for i, head in enumerate(heads) if head),
+                    key=lambda i: (heads[i][1]["created_at"], heads[i][1]["id"]))
+        kind, doc = heads[index]
+        heads[index] = await anext(streams[index], None)
+        
+        if kind == "expense":
+            change = user_balance_change(expense_balance_deltas(doc), user_id)
+            share = next((s["amount_cents"] for s in doc["splits"] if s["user_id"] == user_id), None)
+            row = [doc.get("date") or doc["created_at"][:10], "expense", doc["description"],
+                   doc["paid_by_name"], "", doc["amount_cents"], share]
+        else:
+            change = user_balance_change(settlement_balance_deltas(doc), user_id)
+            row = [doc["created_at"][:10], "settlement", "Settlement",
+                   doc["from_user_name"], doc["to_user_name"], doc["amount_cents"], None]
+        balance += change
+        row[5] = from_cents(row[5])
+        row[6] = from_cents(row[6]) if row[6] is not None else None
+        yield row + [from_cents(change), from_cents(balance)]
+
+async def csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(STATEMENT_COLUMNS)
+    count = 1
+    async for row in rows:
+        writer.writerow(["" if value is None else value for value in row])
+        count += 1
+        if count >= EXPORT_CHUNK_ROWS:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    yield buffer.getvalue().encode('utf-8')
+
+async def xlsx_chunks(rows):
+    # Write-only workbooks spool rows to disk instead of keeping cells in memory
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Statement")
+    sheet.append(STATEMENT_COLUMNS)
+    async for row in rows:
+        sheet.append(row)
+    with tempfile.TemporaryFile() as f:
+        await asyncio.to_thread(workbook.save, f)
+        f.seek(0)
+        while chunk := f.read(256 * 1024):
+            yield chunk
+
+def statement_chunks(group_id: str, user_id: str, export_format: str):
+    rows = statement_rows(group_id, user_id)
+    return csv_chunks(rows) if export_format == "csv" else xlsx_chunks(rows)
+
+def export_filename(group: dict, export_format: str) -> str:
+    return f"splitsync-{group['id'][:8]}-{datetime.now(timezone.utc):%Y%m%d}.{export_format}"
+
+def export_bucket() -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(db, bucket_name="exports")
+
+def export_job_response(job: dict) -> ExportJob:
+    download_url = f"/api/exports/{job['id']}/download" if job["status"] == "done" else None
+    return ExportJob(**job, download_url=download_url)
+
+export_slots = asyncio.Semaphore(EXPORT_CONCURRENCY)
+export_tasks = set()
+
+async def purge_expired_exports():
+    now = datetime.now(timezone.utc)
+    bucket = export_bucket()
+    async for job in db.exports.find({"expires_at": {"$lt": now}}, {"_id": 0, "id": 1, "file_id": 1}):
+        if job.get("file_id") is not None:
+            try:
+                await bucket.delete(job["file_id"])
+            except PyMongoError as e:
+                logger.warning("Could not delete export file %s: %s", job["file_id"], e)
+        await db.exports.delete_one({"id": job["id"]})
+
+async def run_export_job(job: dict, filename: str):
+    async with export_slots:
+        await db.exports.update_one({"id": job["id"]}, {"$set": {"status": "running"}})
+        rows = 0
+        size = 0
+        try:
+            await purge_expired_exports()
+            counted = statement_rows(job["group_id"], job["user_id"])
+
+            async def counting():
+                nonlocal rows
+                async for row in counted:
+                    rows += 1
+                    yield row
+
+            chunks = csv_chunks(counting()) if job["format"] == "csv" else xlsx_chunks(counting())
+            upload = export_bucket().open_upload_stream(
+                filename, metadata={"export_id": job["id"], "content_type": EXPORT_FORMATS[job["format"]]}
+            )
+            async for chunk in chunks:
+                await upload.write(chunk)
+                size += len(chunk)
+            await upload.close()
+            await db.exports.update_one({"id": job["id"]}, {"$set": {
+                "status": "done", "file_id": upload._id, "filename": filename, "rows": rows, "size": size,
+                "expires_at": datetime.now(timezone.utc) + timedelta(hours=EXPORT_RETENTION_HOURS)
+            }})
+        except Exception as e:
+            logger.exception("Export %s failed", job["id"])
+            await db.exports.update_one({"id": job["id"]}, {"$set": {"status": "failed", "error": str(e)}})
+
+# ==================== PAGINATION ====================
+# Listings use keyset pagination on (created_at, id), newest first. The cursor
+# handed to clients is an opaque url-safe encoding of the last row's key.
+
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', '500'))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', '1000'))
+STREAM_BATCH_SIZE = 500
+PAGE_SORT = [("created_at", -1), ("id", -1)]
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+
+def encode_cursor(doc: dict) -> str:
+    raw = json.dumps([doc["created_at"], doc["id"]]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, doc_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(doc_id, str):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, doc_id
+
+def keyset_query(query: dict, cursor: Optional[str]) -> dict:
+    """Restrict a query to the rows that sort after the cursor."""
+    if not cursor:
+        return query
+    created_at, doc_id = decode_cursor(cursor)
+    after_cursor = {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": doc_id}}
+    ]}
+    return {"$and": [query, after_cursor]}
+
+async def fetch_page(collection, query: dict, cursor: Optional[str], limit: int, projection: Optional[dict] = None):
+    """Return one page of rows plus the cursor of the next page (None on the last page)."""
+    docs = await collection.find(keyset_query(query, cursor), projection or {"_id": 0}) \
+        .sort(PAGE_SORT).limit(limit + 1).to_list(limit + 1)
+    if len(docs) > limit:
+        return docs[:limit], encode_cursor(docs[limit - 1])
+    return docs, None
+
+def stream_ndjson(collection, query: dict, rows: RowFormat, cursor: Optional[str], limit: Optional[int]) -> StreamingResponse:
+    """Stream rows as newline-delimited JSON straight off the Motor cursor."""
+    query = keyset_query(query, cursor)
+
+    async def lines():
+        db_cursor = collection.find(query, rows.projection) \
+            .sort(PAGE_SORT).batch_size(STREAM_BATCH_SIZE)
+        if limit:
+            db_cursor = db_cursor.limit(limit)
+        async for doc in db_cursor:
+            yield rows.line(doc)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+async def list_rows(collection, query: dict, rows: RowFormat, response: Response,
+                    cursor: Optional[str], limit: Optional[int], stream: bool):
+    if stream:
+        return stream_ndjson(collection, query, rows, cursor, limit)
+    docs, next_cursor = await fetch_page(collection, query, cursor, limit or DEFAULT_PAGE_SIZE, rows.projection)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return rows.response(docs, headers=dict(response.headers))
+
+# ==================== BULK IMPORT ====================
+
+MAX_BULK_ROWS = int(os.environ.get('MAX_BULK_ROWS', '10000'))
+BULK_INSERT_CHUNK = 1000
+
+def parse_csv_rows(text: str) -> List[dict]:
+    rows = []
+    for record in csv.DictReader(io.StringIO(text)):
+        row = {(k or "").strip().lower(): (v or "").strip() for k, v in record.items()}
+        splits = []
+        for part in filter(None, (p.strip() for p in row.get("splits", "").split(";"))):
+            member, _, amount = part.rpartition(":")
+            splits.append({"user_id": member.strip(), "amount": amount.strip()})
+        rows.append({
+            "description": row.get("description", ""),
+            "amount": row.get("amount", ""),
+            "paid_by": row.get("paid_by", ""),
+            "split_type": row.get("split_type") or "equal",
+            "splits": splits,
+            "date": row.get("date") or None,
+        })
+    return rows
+
+async def read_bulk_rows(request: Request) -> List[dict]:
+    content_type = request.headers.get("content-type", "")
+    try:
+        if content_type.startswith("multipart/form-data"):
+            upload = (await request.form()).get("file")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=400, detail="Missing CSV file")
+            return parse_csv_rows((await upload.read()).decode("utf-8-sig"))
+        if content_type.startswith("text/csv"):
+            return parse_csv_rows((await request.body()).decode("utf-8-sig"))
+        rows = await request.json()
+    except (ValueError, UnicodeDecodeError, csv.Error):
+        raise HTTPException(status_code=400, detail="Could not parse request body")
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of expenses")
+    return rows
+
+def equal_splits(amount_cents: int, user_ids: List[str]) -> List[dict]:
+    share, remainder = divmod(amount_cents, len(user_ids))
+    return [
+        {"user_id": user_id, "amount_cents": share + (1 if i < remainder else 0)}
+        for i, user_id in enumerate(user_ids)
+    ]
+
+def build_bulk_expense_docs(group: dict, rows: List[dict]):
+    """Validate rows against the group's member set and build expense documents.
+
+    Returns (docs, row number of each doc, errors).
+    """
+    members = {m["user_id"]: m for m in group["members"]}
+    member_by_email = {m["email"].lower(): m for m in group["members"]}
+
+    def resolve(ref: str) -> Optional[dict]:
+        return members.get(ref) or member_by_email.get(ref.lower())
+
+    now = datetime.now(timezone.utc).isoformat()
+    docs, row_numbers, errors = [], [], []
+    for index, raw in enumerate(rows):
+        try:
+            row = BulkExpenseRow.model_validate(raw)
+        except ValidationError as e:
+            first = e.errors()[0]
+            location = ".".join(str(part) for part in first["loc"])
+            errors.append(BulkRowError(row=index, error=f"{location}: {first['msg']}" if location else first["msg"]))
+            continue
+
+        payer = resolve(row.paid_by)
+        if not payer:
+            errors.append(BulkRowError(row=index, error="Payer not in group"))
+            continue
+
+        if row.splits:
+            split_members = [resolve(s.user_id) for s in row.splits]
+            if not all(split_members):
+                errors.append(BulkRowError(row=index, error="Split participant not in group"))
+                continue
+            splits = [
+                {"user_id": member["user_id"], "amount_cents": to_cents(s.amount)}
+                for member, s in zip(split_members, row.splits)
+            ]
+        else:
+            splits = equal_splits(to_cents(row.amount), list(members))
+
+        docs.append({
+            "id": str(uuid.uuid4()),
+            "group_id": group["id"],
+            "description": row.description,
+            "amount_cents": to_cents(row.amount),
+            "paid_by": payer["user_id"],
+            "paid_by_name": payer["name"],
+            "split_type": row.split_type,
+            "splits": splits,
+            "date": row.date or now[:10],
+            "created_at": now
+        })
+        row_numbers.append(index)
+    return docs, row_numbers, errors
+
+# ==================== RECURRING EXPENSES ====================
+# The rule math and the scheduler live in recurring.py; this section turns a
+# scheduler run into the same ledger, change feed and activity writes as a
+# created expense.
+
+def parse_rule_date(value: str, field: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"{field} must be a YYYY-MM-DD date")
+
+def recurring_to_api(doc: dict) -> dict:
+    out = {k: v for k, v in doc.items() if k not in ("_id", "amount_cents", "splits", "next_run_at",
+                                                     "lease_id", "lease_until")}
+    out["amount"] = from_cents(doc["amount_cents"])
+    out["splits"] = [{"user_id": s["user_id"], "amount": from_cents(s["amount_cents"])} for s in doc["splits"]]
+    return out
+
+async def record_recurring_run(template: dict, group: dict, written: List[dict], rewritten: List[dict]):
+    group_id = template["group_id"]
+    if rewritten:
+        # The pass that inserted these may have died before its ledger update
+        logger.warning("Recurring expense %s re-ran %d occurrence(s), rebuilding ledger of group %s",
+                       template["id"], len(rewritten), group_id)
+        await rebuild_group_ledger(group_id)
+    elif written:
+        await apply_balance_deltas(group_id, merge_deltas(*(expense_balance_deltas(d) for d in written)))
+    # Upserts are idempotent for clients, so re-announcing rewritten rows is harmless
+    await record_changes(group_id, [change_entry("expense", "upsert", d["id"], expense_to_api(d))
+                                    for d in written + rewritten])
+    if written:
+        await record_activity(group, "expense", "recur", template["id"],
+                              {"id": template["created_by"], "name": template["created_by_name"]},
+                              template["description"], sum(d["amount_cents"] for d in written),
+                              written[-1]["date"])
+
+recurring_scheduler = RecurringScheduler(lambda: db, record_recurring_run)
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/register", response_model=dict)
 async def register(user: UserCreate):
+    if user.invite_token:
+        # Reject a bad invite before creating the account
+        decode_invite_token(user.invite_token)
+    
     # Check if user exists
     existing = await db.users.find_one({"email": user.email})
     if existing:
@@ -186,15 +1734,18 @@ async def register(user: UserCreate):
     user_doc = {
         "id": user_id,
         "email": user.email,
-        "password": hash_password(user.password),
+        "password": await password_pool.run(hash_password, user.password),
         "name": user.name,
         "created_at": now
     }
     
-    await db.users.insert_one(user_doc)
+    try:
+        await db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     
-    token = create_token(user_id, user.email)
-    return {
+    token = create_token(user_id, user.email, user.name, now)
+    result = {
         "token": token,
         "user": {
             "id": user_id,
@@ -203,6 +1754,14 @@ async def register(user: UserCreate):
             "created_at": now
         }
     }
+    if user.invite_token:
+        try:
+            group = await redeem_invite(user.invite_token, user_doc)
+            result["group"] = {"id": group["id"], "name": group["name"]}
+        except HTTPException as e:
+            # The account exists either way; tell the client why the join failed
+            result["invite_error"] = e.detail
+    return result
 
 @api_router.post("/auth/login", response_model=dict)
 async def login(user: UserLogin):
@@ -210,10 +1769,10 @@ async def login(user: UserLogin):
     if not db_user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    if not verify_password(user.password, db_user["password"]):
+    if not await password_pool.run(verify_password, user.password, db_user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    token = create_token(db_user["id"], db_user["email"])
+    token = create_token(db_user["id"], db_user["email"], db_user["name"], db_user["created_at"])
     return {
         "token": token,
         "user": {
@@ -228,6 +1787,29 @@ async def login(user: UserLogin):
 async def get_me(current_user: dict = Depends(get_current_user)):
     return UserResponse(**current_user)
 
+@api_router.put("/auth/me", response_model=UserResponse)
+async def update_me(update: UserUpdate, current_user: dict = Depends(get_current_user)):
+    update_data = {k: v for k, v in update.model_dump().items() if v is not None}
+    if not update_data:
+        return UserResponse(**current_user)
+    
+    try:
+        user = await db.users.find_one_and_update(
+            {"id": current_user["id"]},
+            {"$set": update_data},
+            projection={"_id": 0, "password": 0},
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    principal_cache.invalidate(user["id"])
+    # Copies in groups, expenses and settlements are refreshed in the background
+    await profile_fanout.enqueue(user)
+    return UserResponse(**user)
+
 # ==================== GROUPS ROUTES ====================
 
 @api_router.post("/groups", response_model=GroupResponse)
@@ -251,15 +1833,17 @@ async def create_group(group: GroupCreate, current_user: dict = Depends(get_curr
     }
     
     await db.groups.insert_one(group_doc)
+    await db.group_ledgers.insert_one({"group_id": group_id, "net": {}})
+    await init_user_totals(group_id, [current_user["id"]])
     return GroupResponse(**group_doc)
 
 @api_router.get("/groups", response_model=List[GroupResponse])
 async def list_groups(current_user: dict = Depends(get_current_user)):
     groups = await db.groups.find(
         {"members.user_id": current_user["id"]},
-        {"_id": 0}
+        GROUP_ROWS.projection
     ).to_list(100)
-    return [GroupResponse(**g) for g in groups]
+    return GROUP_ROWS.response(groups)
 
 @api_router.get("/groups/{group_id}", response_model=GroupResponse)
 async def get_group(group_id: str, current_user: dict = Depends(get_current_user)):
@@ -271,28 +1855,81 @@ async def get_group(group_id: str, current_user: dict = Depends(get_current_user
         raise HTTPException(status_code=404, detail="Group not found")
     return GroupResponse(**group)
 
+@api_router.get("/groups/{group_id}/snapshot", response_model=GroupSnapshot)
+async def get_group_snapshot(group_id: str, request: Request, response: Response, current_user: dict = Depends(get_current_user)):
+    """Group, first pages of expenses and settlements, and balances in one response.
+
+    Answers If-None-Match with 304 straight from the group document.
+    """
+    group = await db.groups.find_one(
+        {"id": group_id, "members.user_id": current_user["id"]},
+        {"_id": 0}
+    )
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    
+    etag = snapshot_etag(group, current_user["id"])
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers)
+    
+    (expenses, expenses_cursor), (settlements, settlements_cursor), balances = await asyncio.gather(
+        fetch_page(db.expenses, {"group_id": group_id}, None, DEFAULT_PAGE_SIZE, EXPENSE_ROWS.projection),
+        fetch_page(db.settlements, {"group_id": group_id}, None, DEFAULT_PAGE_SIZE, SETTLEMENT_ROWS.projection),
+        group_balances(group, current_user["id"])
+    )
+    
+    response.headers.update(cache_headers)
+    return GroupSnapshot(
+        group=GroupResponse(**group),
+        version=group.get("version", 0),
+        balances=balances,
+        expenses=[expense_response(e) for e in expenses],
+        expenses_next_cursor=expenses_cursor,
+        settlements=[settlement_response(s) for s in settlements],
+        settlements_next_cursor=settlements_cursor
+    )
+
 @api_router.put("/groups/{group_id}", response_model=GroupResponse)
 async def update_group(group_id: str, update: GroupUpdate, current_user: dict = Depends(get_current_user)):
-    group = await db.groups.find_one({"id": group_id, "members.user_id": current_user["id"]})
+    group = await db.groups.find_one({"id": group_id, "members.user_id": current_user["id"]}, {"_id": 0})
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
     
     update_data = {k: v for k, v in update.model_dump().items() if v is not None}
-    if update_data:
-        await db.groups.update_one({"id": group_id}, {"$set": update_data})
+    if not update_data:
+        return GroupResponse(**group)
     
-    updated = await db.groups.find_one({"id": group_id}, {"_id": 0})
+    updated = await db.groups.find_one_and_update(
+        {"id": group_id},
+        bump_version({"$set": update_data}),
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    await append_changes(group_id, updated["version"], [
+        change_entry("group", "upsert", group_id, {"name": updated["name"], "description": updated["description"]})
+    ])
     return GroupResponse(**updated)
 
 @api_router.delete("/groups/{group_id}")
 async def delete_group(group_id: str, current_user: dict = Depends(get_current_user)):
-    group = await db.groups.find_one({"id": group_id, "created_by": current_user["id"]})
+    group = await db.groups.find_one({"id": group_id, "created_by": current_user["id"]}, {"_id": 0})
     if not group:
         raise HTTPException(status_code=404, detail="Group not found or you're not the owner")
     
+    # Expenses, settlements and the feed are left to the reaper
+    await db.deleted_groups.replace_one(
+        {"id": group_id},
+        {**group, "deleted_at": datetime.now(timezone.utc).isoformat()},
+        upsert=True
+    )
+    await record_changes(group_id, [change_entry("group", "delete", group_id)])
     await db.groups.delete_one({"id": group_id})
-    await db.expenses.delete_many({"group_id": group_id})
-    await db.settlements.delete_many({"group_id": group_id})
+    await db.user_totals.update_many(
+        {"user_id": {"$in": [m["user_id"] for m in group["members"]]}},
+        {"$unset": {f"groups.{group_id}": ""}}
+    )
+    group_reaper.wakeup.set()
     
     return {"message": "Group deleted"}
 
@@ -317,29 +1954,117 @@ async def add_member(group_id: str, request: AddMemberRequest, current_user: dic
         "email": user["email"]
     }
     
-    await db.groups.update_one(
+    updated = await db.groups.find_one_and_update(
         {"id": group_id},
-        {"$push": {"members": new_member}}
+        bump_version({"$push": {"members": new_member}}),
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
+    await append_changes(group_id, updated["version"], [change_entry("member", "upsert", user["id"], new_member)])
+    await init_user_totals(group_id, [user["id"]])
+    await record_activity(updated, "member", "join", user["id"], current_user, f"{user['name']} joined the group")
     
-    updated = await db.groups.find_one({"id": group_id}, {"_id": 0})
     return GroupResponse(**updated)
 
 @api_router.delete("/groups/{group_id}/members/{user_id}")
 async def remove_member(group_id: str, user_id: str, current_user: dict = Depends(get_current_user)):
-    group = await db.groups.find_one({"id": group_id, "members.user_id": current_user["id"]})
+    # Access check, owner guard and removal in one round trip
+    previous = await db.groups.find_one_and_update(
+        {"id": group_id, "members.user_id": {"$all": [current_user["id"], user_id]}, "created_by": {"$ne": user_id}},
+        bump_version({"$pull": {"members": {"user_id": user_id}}}),
+        projection={"_id": 0, "id": 1, "name": 1, "members": 1, "version": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if not previous:
+        group = await db.groups.find_one(
+            {"id": group_id, "members.user_id": current_user["id"]},
+            {"_id": 0, "created_by": 1}
+        )
+        if not group:
+            raise HTTPException(status_code=404, detail="Group not found")
+        if group["created_by"] == user_id:
+            raise HTTPException(status_code=400, detail="Cannot remove group owner")
+        raise HTTPException(status_code=404, detail="Member not found")
+    
+    await append_changes(group_id, previous.get("version", 0) + 1, [change_entry("member", "delete", user_id)])
+    # The removed member's rollup stays: their balance is still in the ledger,
+    # the dashboard only sums groups they belong to, and a re-join picks it up
+
+    # The member list from before the pull still includes the removed member
+    removed = next(m for m in previous["members"] if m["user_id"] == user_id)
+    await record_activity(previous, "member", "leave", user_id, current_user, f"{removed['name']} left the group")
+    
+    return {"message": "Member removed"}
+
+# ==================== INVITES ROUTES ====================
+
+@api_router.post("/groups/{group_id}/invites", response_model=InviteResponse)
+async def create_invite(group_id: str, invite: InviteCreate, current_user: dict = Depends(get_current_user)):
+    group = await db.groups.find_one({"id": group_id, "members.user_id": current_user["id"]}, {"_id": 1})
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
     
-    if group["created_by"] == user_id:
-        raise HTTPException(status_code=400, detail="Cannot remove group owner")
+    invite_doc = {
+        "id": str(uuid.uuid4()),
+        "group_id": group_id,
+        "created_by": current_user["id"],
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        # Whole seconds, matching the token's exp claim
+        "expires_at": datetime.fromtimestamp(int(time.time()) + invite.expires_in_hours * 3600, timezone.utc),
+        "max_uses": invite.max_uses,
+        "uses": 0,
+        "window": 0,
+        "window_count": 0
+    }
+    await db.invites.insert_one(dict(invite_doc))
+    return invite_response(invite_doc)
+
+@api_router.get("/groups/{group_id}/invites", response_model=List[InviteResponse])
+async def list_invites(group_id: str, current_user: dict = Depends(get_current_user)):
+    group = await db.groups.find_one({"id": group_id, "members.user_id": current_user["id"]}, {"_id": 1})
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
     
-    await db.groups.update_one(
-        {"id": group_id},
-        {"$pull": {"members": {"user_id": user_id}}}
-    )
+    invites = await db.invites.find(
+        {"group_id": group_id, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+        {"_id": 0}
+    ).to_list(100)
+    return [invite_response(i) for i in invites]
+
+@api_router.delete("/groups/{group_id}/invites/{invite_id}")
+async def revoke_invite(group_id: str, invite_id: str, current_user: dict = Depends(get_current_user)):
+    group = await db.groups.find_one({"id": group_id, "members.user_id": current_user["id"]}, {"_id": 1})
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
     
-    return {"message": "Member removed"}
+    result = await db.invites.delete_one({"id": invite_id, "group_id": group_id})
+    if not result.deleted_count:
+        raise HTTPException(status_code=404, detail="Invite not found")
+    return {"message": "Invite revoked"}
+
+@api_router.get("/invites/{token}", response_model=InvitePreview)
+async def preview_invite(token: str):
+    """What the join page shows before sign-up; the token itself is the credential."""
+    payload = decode_invite_token(token)
+    invite = await db.invites.find_one({"id": payload["jti"]}, {"_id": 0, "group_id": 1, "created_by": 1, "expires_at": 1})
+    if not invite:
+        raise HTTPException(status_code=410, detail="Invite has been revoked")
+    group = await db.groups.find_one({"id": invite["group_id"]}, {"_id": 0, "id": 1, "name": 1, "members": 1})
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    
+    inviter = next((m["name"] for m in group["members"] if m["user_id"] == invite["created_by"]), "A former member")
+    return InvitePreview(
+        group_id=group["id"],
+        group_name=group["name"],
+        invited_by=inviter,
+        member_count=len(group["members"]),
+        expires_at=datetime.fromtimestamp(payload["exp"], timezone.utc).isoformat()
+    )
+
+@api_router.post("/invites/{token}/accept", response_model=GroupResponse)
+async def accept_invite(token: str, current_user: dict = Depends(get_current_user)):
+    return GroupResponse(**await redeem_invite(token, current_user))
 
 # ==================== EXPENSES ROUTES ====================
 
@@ -365,31 +2090,135 @@ async def create_expense(expense: ExpenseCreate, current_user: dict = Depends(ge
         "id": expense_id,
         "group_id": expense.group_id,
         "description": expense.description,
-        "amount": expense.amount,
+        "amount_cents": to_cents(expense.amount),
         "paid_by": expense.paid_by,
         "paid_by_name": payer["name"],
         "split_type": expense.split_type,
-        "splits": [s.model_dump() for s in expense.splits],
+        "splits": splits_to_cents(expense.splits),
         "date": expense.date or now[:10],
         "created_at": now
     }
     
     await db.expenses.insert_one(expense_doc)
-    return ExpenseResponse(**expense_doc)
+    await apply_balance_deltas(expense.group_id, expense_balance_deltas(expense_doc))
+    await record_changes(expense.group_id, [change_entry("expense", "upsert", expense_id, expense_to_api(expense_doc))])
+    await record_activity(group, "expense", "create", expense_id, current_user, expense_doc["description"],
+                          expense_doc["amount_cents"], expense_doc["date"])
+    return expense_response(expense_doc)
+
+@api_router.post("/expenses/bulk", response_model=BulkExpenseResult)
+async def bulk_create_expenses(group_id: str, request: Request, current_user: dict = Depends(get_current_user)):
+    """Import many expenses into one group from a JSON array or a CSV upload.
+
+    CSV columns: description, amount, paid_by, split_type, splits, date where
+    splits is "member:amount;member:amount" (members by user_id or email).
+    """
+    # Verify group access
+    group = await db.groups.find_one(
+        {"id": group_id, "members.user_id": current_user["id"]},
+        {"_id": 0}
+    )
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    
+    rows = await read_bulk_rows(request)
+    if len(rows) > MAX_BULK_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ROWS} rows per request")
+    
+    docs, row_numbers, errors = build_bulk_expense_docs(group, rows)
+    
+    inserted = []
+    written = []
+    for start in range(0, len(docs), BULK_INSERT_CHUNK):
+        chunk = docs[start:start + BULK_INSERT_CHUNK]
+        failed = {}
+        try:
+            await db.expenses.insert_many(chunk, ordered=False)
+        except BulkWriteError as e:
+            failed = {err["index"]: err["errmsg"] for err in e.details.get("writeErrors", [])}
+        for offset, doc in enumerate(chunk):
+            row = row_numbers[start + offset]
+            if offset in failed:
+                errors.append(BulkRowError(row=row, error=failed[offset]))
+            else:
+                inserted.append(BulkInsertedRow(row=row, id=doc["id"]))
+                written.append(doc)
+    
+    # Balance deltas for the whole batch go out in one update
+    await apply_balance_deltas(group_id, merge_deltas(*(expense_balance_deltas(d) for d in written)))
+    await record_changes(group_id, [change_entry("expense", "upsert", d["id"], expense_to_api(d)) for d in written])
+    if written:
+        # One entry per import rather than per row
+        await record_activity(group, "expense", "import", group_id, current_user,
+                              f"Imported {len(written)} expense{'s' if len(written) != 1 else ''}",
+                              sum(d["amount_cents"] for d in written))
+    
+    errors.sort(key=lambda e: e.row)
+    return BulkExpenseResult(inserted=inserted, errors=errors)
+
+@api_router.get("/expenses/search", response_model=List[ExpenseResponse])
+async def search_expenses(
+    response: Response,
+    group_id: Optional[str] = None,
+    q: Optional[str] = Query(None, min_length=1, max_length=200),
+    date_from: Optional[str] = Query(None, pattern=DATE_PATTERN),
+    date_to: Optional[str] = Query(None, pattern=DATE_PATTERN),
+    paid_by: Optional[str] = None,
+    participant: Optional[str] = None,
+    min_amount: Optional[float] = Query(None, ge=0),
+    max_amount: Optional[float] = Query(None, ge=0),
+    split_type: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Filter expenses in one group, or across all of the user's groups, newest first.
+
+    `q` is a full-text search on the description; `participant` matches any
+    user in the splits; dates are inclusive YYYY-MM-DD bounds on the expense date.
+    """
+    if group_id:
+        group = await db.groups.find_one({"id": group_id, "members.user_id": current_user["id"]}, {"_id": 1})
+        if not group:
+            raise HTTPException(status_code=404, detail="Group not found")
+        query = {"group_id": group_id}
+    else:
+        group_ids = [g["id"] async for g in db.groups.find({"members.user_id": current_user["id"]}, {"_id": 0, "id": 1})]
+        query = {"group_id": {"$in": group_ids}}
+    
+    if paid_by:
+        query["paid_by"] = paid_by
+    if participant:
+        query["splits.user_id"] = participant
+    if split_type:
+        query["split_type"] = split_type
+    if date_from or date_to:
+        query["date"] = {k: v for k, v in (("$gte", date_from), ("$lte", date_to)) if v}
+    if min_amount is not None or max_amount is not None:
+        query["amount_cents"] = {
+            k: to_cents(v) for k, v in (("$gte", min_amount), ("$lte", max_amount)) if v is not None
+        }
+    if q:
+        query["$text"] = {"$search": q}
+    
+    return await list_rows(db.expenses, query, EXPENSE_ROWS, response, cursor, limit, stream)
 
 @api_router.get("/expenses", response_model=List[ExpenseResponse])
-async def list_expenses(group_id: str, current_user: dict = Depends(get_current_user)):
+async def list_expenses(
+    group_id: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
     # Verify group access
     group = await db.groups.find_one({"id": group_id, "members.user_id": current_user["id"]})
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
     
-    expenses = await db.expenses.find(
-        {"group_id": group_id},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(500)
-    
-    return [ExpenseResponse(**e) for e in expenses]
+    return await list_rows(db.expenses, {"group_id": group_id}, EXPENSE_ROWS, response, cursor, limit, stream)
 
 @api_router.put("/expenses/{expense_id}", response_model=ExpenseResponse)
 async def update_expense(expense_id: str, update: ExpenseUpdate, current_user: dict = Depends(get_current_user)):
@@ -406,7 +2235,9 @@ async def update_expense(expense_id: str, update: ExpenseUpdate, current_user: d
     for k, v in update.model_dump().items():
         if v is not None:
             if k == "splits":
-                update_data[k] = [s.model_dump() if hasattr(s, 'model_dump') else s for s in v]
+                update_data[k] = splits_to_cents(update.splits)
+            elif k == "amount":
+                update_data["amount_cents"] = to_cents(v)
             else:
                 update_data[k] = v
     
@@ -416,11 +2247,27 @@ async def update_expense(expense_id: str, update: ExpenseUpdate, current_user: d
         if payer:
             update_data["paid_by_name"] = payer["name"]
     
-    if update_data:
-        await db.expenses.update_one({"id": expense_id}, {"$set": update_data})
+    if not update_data:
+        return expense_response(expense)
     
-    updated = await db.expenses.find_one({"id": expense_id}, {"_id": 0})
-    return ExpenseResponse(**updated)
+    # Diff against the document as it was at the moment of this write, so
+    # concurrent updates each apply their own delta exactly once
+    previous = await db.expenses.find_one_and_update(
+        {"id": expense_id}, {"$set": update_data}, projection={"_id": 0}, return_document=ReturnDocument.BEFORE
+    )
+    if previous is None:
+        raise HTTPException(status_code=404, detail="Expense not found")
+    
+    updated = {**previous, **update_data}
+    if "paid_by" in update_data or "splits" in update_data:
+        await apply_balance_deltas(expense["group_id"], merge_deltas(
+            expense_balance_deltas(previous, sign=-1),
+            expense_balance_deltas(updated)
+        ))
+    await record_changes(expense["group_id"], [change_entry("expense", "upsert", expense_id, expense_to_api(updated))])
+    await record_activity(group, "expense", "update", expense_id, current_user, updated["description"],
+                          updated["amount_cents"], updated.get("date"))
+    return expense_response(updated)
 
 @api_router.delete("/expenses/{expense_id}")
 async def delete_expense(expense_id: str, current_user: dict = Depends(get_current_user)):
@@ -433,7 +2280,15 @@ async def delete_expense(expense_id: str, current_user: dict = Depends(get_curre
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
     
-    await db.expenses.delete_one({"id": expense_id})
+    # Only the request that actually removed the document reverses its balance
+    expense = await db.expenses.find_one_and_delete({"id": expense_id}, projection={"_id": 0})
+    if expense is None:
+        raise HTTPException(status_code=404, detail="Expense not found")
+    
+    await apply_balance_deltas(expense["group_id"], expense_balance_deltas(expense, sign=-1))
+    await record_changes(expense["group_id"], [change_entry("expense", "delete", expense_id)])
+    await record_activity(group, "expense", "delete", expense_id, current_user, expense["description"],
+                          expense["amount_cents"], expense.get("date"))
     return {"message": "Expense deleted"}
 
 # ==================== SETTLEMENTS ROUTES ====================
@@ -464,92 +2319,381 @@ async def create_settlement(settlement: SettlementCreate, current_user: dict = D
         "from_user_name": from_user["name"],
         "to_user": settlement.to_user,
         "to_user_name": to_user["name"],
-        "amount": settlement.amount,
+        "amount_cents": to_cents(settlement.amount),
         "created_at": now
     }
     
     await db.settlements.insert_one(settlement_doc)
-    return SettlementResponse(**settlement_doc)
+    await apply_balance_deltas(settlement.group_id, settlement_balance_deltas(settlement_doc))
+    await record_changes(settlement.group_id, [
+        change_entry("settlement", "upsert", settlement_id, settlement_to_api(settlement_doc))
+    ])
+    await record_activity(group, "settlement", "create", settlement_id, current_user,
+                          f"{from_user['name']} paid {to_user['name']}", settlement_doc["amount_cents"])
+    return settlement_response(settlement_doc)
 
 @api_router.get("/settlements", response_model=List[SettlementResponse])
-async def list_settlements(group_id: str, current_user: dict = Depends(get_current_user)):
+async def list_settlements(
+    group_id: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
     # Verify group access
     group = await db.groups.find_one({"id": group_id, "members.user_id": current_user["id"]})
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
     
-    settlements = await db.settlements.find(
-        {"group_id": group_id},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(500)
-    
-    return [SettlementResponse(**s) for s in settlements]
+    return await list_rows(db.settlements, {"group_id": group_id}, SETTLEMENT_ROWS, response, cursor, limit, stream)
 
-# ==================== BALANCES ROUTE ====================
+# ==================== RECURRING EXPENSES ROUTES ====================
 
-@api_router.get("/groups/{group_id}/balances", response_model=List[Balance])
-async def get_balances(group_id: str, current_user: dict = Depends(get_current_user)):
+@api_router.post("/recurring-expenses", response_model=RecurringExpenseResponse)
+async def create_recurring_expense(recurring: RecurringExpenseCreate, current_user: dict = Depends(get_current_user)):
     # Verify group access
     group = await db.groups.find_one(
-        {"id": group_id, "members.user_id": current_user["id"]},
+        {"id": recurring.group_id, "members.user_id": current_user["id"]},
         {"_id": 0}
     )
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
     
+    payer = next((m for m in group["members"] if m["user_id"] == recurring.paid_by), None)
+    if not payer:
+        raise HTTPException(status_code=400, detail="Payer not in group")
+    if recurring.frequency not in RECURRING_FREQUENCIES:
+        raise HTTPException(status_code=400, detail=f"frequency must be one of {', '.join(RECURRING_FREQUENCIES)}")
+    
+    now = datetime.now(timezone.utc)
+    start = parse_rule_date(recurring.start_date, "start_date") if recurring.start_date else now.date()
+    end = parse_rule_date(recurring.end_date, "end_date") if recurring.end_date else None
+    if end and end < start:
+        raise HTTPException(status_code=400, detail="end_date is before start_date")
+    
+    template = {
+        "id": str(uuid.uuid4()),
+        "group_id": recurring.group_id,
+        "description": recurring.description,
+        "amount_cents": to_cents(recurring.amount),
+        "paid_by": recurring.paid_by,
+        "paid_by_name": payer["name"],
+        "split_type": recurring.split_type,
+        "splits": splits_to_cents(recurring.splits),
+        "frequency": recurring.frequency,
+        "interval": recurring.interval,
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat() if end else None,
+        "active": True,
+        "error": None,
+        "created_by": current_user["id"],
+        "created_by_name": current_user["name"],
+        "created_at": now.isoformat()
+    }
+    template.update(schedule_fields(template, 0))
+    
+    await db.recurring_expenses.insert_one(dict(template))
+    recurring_scheduler.wakeup.set()
+    return RecurringExpenseResponse(**recurring_to_api(template))
+
+@api_router.get("/recurring-expenses", response_model=List[RecurringExpenseResponse])
+async def list_recurring_expenses(group_id: str, current_user: dict = Depends(get_current_user)):
+    # Verify group access
+    group = await db.groups.find_one({"id": group_id, "members.user_id": current_user["id"]}, {"_id": 1})
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    
+    templates = await db.recurring_expenses.find({"group_id": group_id}, {"_id": 0}).sort("created_at", 1).to_list(1000)
+    return [RecurringExpenseResponse(**recurring_to_api(t)) for t in templates]
+
+@api_router.delete("/recurring-expenses/{recurring_id}")
+async def delete_recurring_expense(recurring_id: str, current_user: dict = Depends(get_current_user)):
+    template = await db.recurring_expenses.find_one({"id": recurring_id}, {"_id": 0, "group_id": 1})
+    if not template:
+        raise HTTPException(status_code=404, detail="Recurring expense not found")
+    
+    group = await db.groups.find_one({"id": template["group_id"], "members.user_id": current_user["id"]}, {"_id": 1})
+    if not group:
+        raise HTTPException(status_code=404, detail="Recurring expense not found")
+    
+    # Expenses it already created are ordinary expenses and stay
+    await db.recurring_expenses.delete_one({"id": recurring_id})
+    return {"message": "Recurring expense deleted"}
+
+# ==================== BALANCES ROUTE ====================
+
+async def group_balances(group: dict, current_user_id: str) -> List[Balance]:
     # Initialize balances for current user
-    balances: Dict[str, float] = {}
+    balances: Dict[str, int] = {}
     member_names: Dict[str, str] = {}
     
     for member in group["members"]:
-        if member["user_id"] != current_user["id"]:
-            balances[member["user_id"]] = 0.0
+        if member["user_id"] != current_user_id:
+            balances[member["user_id"]] = 0
             member_names[member["user_id"]] = member["name"]
     
-    # Get all expenses
-    expenses = await db.expenses.find({"group_id": group_id}, {"_id": 0}).to_list(1000)
-    
-    for expense in expenses:
-        paid_by = expense["paid_by"]
-        splits = expense["splits"]
-        
-        for split in splits:
-            user_id = split["user_id"]
-            amount = split["amount"]
-            
-            if paid_by == current_user["id"] and user_id != current_user["id"]:
-                # I paid, others owe me
-                balances[user_id] = balances.get(user_id, 0) + amount
-            elif paid_by != current_user["id"] and user_id == current_user["id"]:
-                # Others paid, I owe them
-                balances[paid_by] = balances.get(paid_by, 0) - amount
-    
-    # Get all settlements
-    settlements = await db.settlements.find({"group_id": group_id}, {"_id": 0}).to_list(1000)
-    
-    for settlement in settlements:
-        from_user = settlement["from_user"]
-        to_user = settlement["to_user"]
-        amount = settlement["amount"]
-        
-        if from_user == current_user["id"]:
-            # I paid someone
-            balances[to_user] = balances.get(to_user, 0) + amount
-        elif to_user == current_user["id"]:
-            # Someone paid me
-            balances[from_user] = balances.get(from_user, 0) - amount
+    for user_id, amount in (await load_balance_row(group["id"], current_user_id)).items():
+        if user_id != current_user_id:
+            balances[user_id] = amount
     
     result = []
     for user_id, amount in balances.items():
-        if abs(amount) > 0.01:  # Only include non-zero balances
+        if amount:  # Only include non-zero balances
             result.append(Balance(
                 user_id=user_id,
                 user_name=member_names.get(user_id, "Unknown"),
-                amount=round(amount, 2)
+                amount=from_cents(amount)
             ))
     
     return result
 
+@api_router.get("/groups/{group_id}/balances", response_model=List[Balance])
+async def get_balances(group_id: str, current_user: dict = Depends(get_current_user)):
+    # Verify group access
+    group = await db.groups.find_one(
+        {"id": group_id, "members.user_id": current_user["id"]},
+        {"_id": 0}
+    )
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    
+    return await group_balances(group, current_user["id"])
+
+@api_router.get("/groups/{group_id}/settle-plan", response_model=SettlePlan)
+async def get_settle_plan(group_id: str, exact: bool = True, current_user: dict = Depends(get_current_user)):
+    # Verify group access
+    group = await db.groups.find_one(
+        {"id": group_id, "members.user_id": current_user["id"]},
+        {"_id": 0}
+    )
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    
+    member_names = {m["user_id"]: m["name"] for m in group["members"]}
+    positions = await load_net_positions(group_id)
+    method, transfers = plan_transfers(positions, exact=exact)
+    
+    return SettlePlan(
+        group_id=group_id,
+        method=method,
+        transfers=[
+            SettleTransfer(
+                from_user=from_user,
+                from_user_name=member_names.get(from_user, "Unknown"),
+                to_user=to_user,
+                to_user_name=member_names.get(to_user, "Unknown"),
+                amount=from_cents(cents)
+            )
+            for from_user, to_user, cents in transfers
+        ]
+    )
+
+# ==================== EXPORT ROUTES ====================
+
+@api_router.get("/groups/{group_id}/export")
+async def export_statement(
+    group_id: str,
+    export_format: str = Query("csv", alias="format"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Stream the group's full history as CSV or XLSX with the caller's running balance."""
+    check_export_format(export_format)
+    group = await db.groups.find_one({"id": group_id, "members.user_id": current_user["id"]}, {"_id": 0, "id": 1})
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    
+    return StreamingResponse(
+        statement_chunks(group_id, current_user["id"], export_format),
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{export_filename(group, export_format)}"'}
+    )
+
+@api_router.post("/groups/{group_id}/exports", response_model=ExportJob, status_code=202)
+async def start_export(group_id: str, export: ExportCreate, current_user: dict = Depends(get_current_user)):
+    """Build the statement in the background; poll the job, then fetch download_url."""
+    check_export_format(export.format)
+    group = await db.groups.find_one({"id": group_id, "members.user_id": current_user["id"]}, {"_id": 0, "id": 1})
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    
+    job = {
+        "id": str(uuid.uuid4()),
+        "user_id": current_user["id"],
+        "group_id": group_id,
+        "format": export.format,
+        "status": "pending",
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        # Replaced with the download's own expiry once the file is written
+        "expires_at": datetime.now(timezone.utc) + timedelta(hours=EXPORT_RETENTION_HOURS)
+    }
+    await db.exports.insert_one(dict(job))
+    task = asyncio.create_task(run_export_job(job, export_filename(group, export.format)))
+    export_tasks.add(task)
+    task.add_done_callback(export_tasks.discard)
+    return export_job_response(job)
+
+@api_router.get("/exports/{export_id}", response_model=ExportJob)
+async def get_export(export_id: str, current_user: dict = Depends(get_current_user)):
+    job = await db.exports.find_one({"id": export_id, "user_id": current_user["id"]}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export not found")
+    return export_job_response(job)
+
+@api_router.get("/exports/{export_id}/download")
+async def download_export(export_id: str, current_user: dict = Depends(get_current_user)):
+    job = await db.exports.find_one({"id": export_id, "user_id": current_user["id"]}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export not found")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Export is {job['status']}")
+    
+    download = await export_bucket().open_download_stream(job["file_id"])
+
+    async def chunks():
+        while chunk := await download.readchunk():
+            yield chunk
+
+    return StreamingResponse(
+        chunks(),
+        media_type=EXPORT_FORMATS[job["format"]],
+        headers={
+            "Content-Disposition": f'attachment; filename="{job["filename"]}"',
+            "Content-Length": str(job["size"])
+        }
+    )
+
+# ==================== SYNC ROUTE ====================
+
+@api_router.get("/sync", response_model=SyncResponse)
+async def sync(since: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Changes across all of the user's groups since a previous sync cursor.
+
+    Without `since` (or for groups the cursor does not know yet) the group is
+    listed under `reset` and should be loaded from its snapshot once. So is a
+    group whose feed has a gap older than SYNC_GAP_GRACE.
+    """
+    positions = decode_sync_cursor(since) if since else {}
+    groups = await db.groups.find(
+        {"members.user_id": current_user["id"]},
+        {"_id": 0, "id": 1, "version": 1, "changed_at": 1}
+    ).to_list(None)
+    versions = {g["id"]: g.get("version", 0) for g in groups}
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=SYNC_GAP_GRACE)
+    
+    def outlived_grace(timestamp: Optional[str]) -> bool:
+        return not timestamp or datetime.fromisoformat(timestamp) < cutoff
+    
+    removed = [group_id for group_id in positions if group_id not in versions]
+    reset = []
+    pending = []
+    new_positions = {}
+    for group_id, version in versions.items():
+        seen = positions.get(group_id)
+        if seen is None or seen > version or version - seen > SYNC_MAX_CHANGES:
+            reset.append(group_id)
+            new_positions[group_id] = version
+            continue
+        new_positions[group_id] = seen
+        if version > seen:
+            pending.append({"group_id": group_id, "seq": {"$gt": seen}})
+    
+    changes = []
+    if pending:
+        gapped = set()
+        lost = set()
+        async for change in db.changes.find({"$or": pending}, {"_id": 0}).sort([("group_id", 1), ("seq", 1)]):
+            group_id = change["group_id"]
+            if group_id in gapped:
+                continue
+            # Only advance over a contiguous run, so a change whose insert is
+            # still in flight is picked up by the next sync instead of skipped
+            if change["seq"] != new_positions[group_id] + 1:
+                gapped.add(group_id)
+                # The missing change took its number before this one was written
+                if outlived_grace(change["created_at"]):
+                    lost.add(group_id)
+                continue
+            new_positions[group_id] = change["seq"]
+            changes.append(change)
+        # A gap at the end of the feed is dated by the group's last bump
+        for group in groups:
+            group_id = group["id"]
+            if group_id not in gapped and new_positions[group_id] < versions[group_id] and \
+                    outlived_grace(group.get("changed_at")):
+                lost.add(group_id)
+        for group_id in lost:
+            reset.append(group_id)
+            new_positions[group_id] = versions[group_id]
+        changes = [change for change in changes if change["group_id"] not in lost]
+    
+    return SyncResponse(
+        cursor=encode_sync_cursor(new_positions),
+        changes=[Change(**change) for change in changes],
+        reset=reset,
+        removed=removed
+    )
+
+# ==================== ACTIVITY ROUTE ====================
+
+@api_router.get("/activity", response_model=List[ActivityEntry])
+async def list_activity(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user)
+):
+    """The user's activity across all groups, newest first."""
+    return await list_rows(db.activity, {"user_id": current_user["id"]}, ACTIVITY_ROWS, response, cursor, limit, False)
+
+# ==================== EVENTS ROUTE ====================
+
+@api_router.websocket("/ws")
+async def events_socket(websocket: WebSocket, token: str):
+    """Push feed changes of the user's groups as JSON messages.
+
+    Browsers cannot set headers on WebSocket requests, so the JWT is passed as
+    the `token` query parameter.
+    """
+    try:
+        current_user = await authenticate_token(token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    
+    user_id = current_user["id"]
+    groups = await db.groups.find({"members.user_id": user_id}, {"_id": 0, "id": 1}).to_list(100)
+    subscription = event_hub.subscribe([g["id"] for g in groups] + [f"user:{user_id}"], WS_SEND_BUFFER)
+    await websocket.accept()
+    
+    async def send_events():
+        while True:
+            change = await subscription.queue.get()
+            if subscription.overflowed:
+                await websocket.close(code=1013, reason="Too far behind, resync via /api/sync")
+                return
+            if change["kind"] == "member" and change["id"] == user_id:
+                if change["op"] == "upsert":
+                    event_hub.add_keys(subscription, [change["group_id"]])
+                else:
+                    event_hub.remove_keys(subscription, [change["group_id"]])
+            await websocket.send_json(change)
+    
+    async def receive_until_closed():
+        # Incoming messages (e.g. keep-alive pings) are ignored
+        while True:
+            await websocket.receive_text()
+    
+    tasks = [asyncio.create_task(send_events()), asyncio.create_task(receive_until_closed())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        event_hub.unsubscribe(subscription)
+        for task in tasks:
+            task.cancel()
+        # Collects disconnect errors raised inside the tasks
+        await asyncio.gather(*tasks, return_exceptions=True)
+
 # ==================== DASHBOARD ROUTE ====================
 
 @api_router.get("/dashboard")
@@ -557,62 +2701,238 @@ async def get_dashboard(current_user: dict = Depends(get_current_user)):
     # Get all user's groups
     groups = await db.groups.find(
         {"members.user_id": current_user["id"]},
-        {"_id": 0}
+        {"_id": 0, "id": 1, "name": 1}
     ).to_list(100)
     
-    total_owed = 0.0  # Money owed to me
-    total_owing = 0.0  # Money I owe
     recent_expenses = []
     
-    for group in groups:
-        # Calculate balances for this group
-        expenses = await db.expenses.find({"group_id": group["id"]}, {"_id": 0}).to_list(1000)
-        settlements = await db.settlements.find({"group_id": group["id"]}, {"_id": 0}).to_list(1000)
-        
-        for expense in expenses:
-            paid_by = expense["paid_by"]
-            splits = expense["splits"]
-            
-            for split in splits:
-                user_id = split["user_id"]
-                amount = split["amount"]
-                
-                if paid_by == current_user["id"] and user_id != current_user["id"]:
-                    total_owed += amount
-                elif paid_by != current_user["id"] and user_id == current_user["id"]:
-                    total_owing += amount
-        
-        for settlement in settlements:
-            from_user = settlement["from_user"]
-            to_user = settlement["to_user"]
-            amount = settlement["amount"]
-            
-            if from_user == current_user["id"]:
-                total_owing -= amount
-            elif to_user == current_user["id"]:
-                total_owed -= amount
+    group_totals = await load_user_totals(current_user["id"], [g["id"] for g in groups])
+    total_owed = sum(t["owed"] for t in group_totals.values())  # Money owed to me
+    total_owing = sum(t["owing"] for t in group_totals.values())  # Money I owe
     
     # Get recent expenses across all groups
-    user_group_ids = [g["id"] for g in groups]
-    if user_group_ids:
+    group_names = {g["id"]: g["name"] for g in groups}
+    if group_names:
         recent = await db.expenses.find(
-            {"group_id": {"$in": user_group_ids}},
+            {"group_id": {"$in": list(group_names)}},
             {"_id": 0}
         ).sort("created_at", -1).limit(10).to_list(10)
         
         for exp in recent:
-            group = next((g for g in groups if g["id"] == exp["group_id"]), None)
-            exp["group_name"] = group["name"] if group else "Unknown"
+            exp = expense_to_api(exp)
+            exp["group_name"] = group_names.get(exp["group_id"], "Unknown")
             recent_expenses.append(exp)
     
     return {
-        "total_owed": round(max(0, total_owed - total_owing), 2),
-        "total_owing": round(max(0, total_owing - total_owed), 2),
-        "net_balance": round(total_owed - total_owing, 2),
+        "total_owed": from_cents(max(0, total_owed - total_owing)),
+        "total_owing": from_cents(max(0, total_owing - total_owed)),
+        "net_balance": from_cents(total_owed - total_owing),
         "groups_count": len(groups),
         "recent_expenses": recent_expenses
     }
 
+# ==================== INDEXES ====================
+# Indexes ensured at startup as (collection, keys, options).
+INDEXES = [
+    ("users", [("email", 1)], {"unique": True}),
+    ("users", [("id", 1)], {"unique": True}),
+    ("groups", [("id", 1)], {"unique": True}),
+    ("groups", [("members.user_id", 1)], {}),
+    ("expenses", [("id", 1)], {"unique": True}),
+    ("settlements", [("id", 1)], {"unique": True}),
+    ("settlements", [("group_id", 1), ("created_at", -1), ("id", -1)], {}),
+    ("group_ledgers", [("group_id", 1)], {"unique": True}),
+    ("user_totals", [("user_id", 1)], {"unique": True}),
+    ("changes", [("group_id", 1), ("seq", 1)], {"unique": True}),
+    ("expenses", [("paid_by", 1)], {}),
+    ("settlements", [("from_user", 1)], {}),
+    ("settlements", [("to_user", 1)], {}),
+    ("fanout_jobs", [("user_id", 1)], {"unique": True}),
+    ("fanout_jobs", [("status", 1), ("updated_at", 1)], {}),
+    # Expense search: equality filters ahead of the keyset sort, ranges after it
+    ("expenses", [("group_id", 1), ("paid_by", 1), ("created_at", -1), ("id", -1)], {}),
+    ("expenses", [("group_id", 1), ("splits.user_id", 1), ("created_at", -1), ("id", -1)], {}),
+    ("expenses", [("group_id", 1), ("split_type", 1), ("created_at", -1), ("id", -1)], {}),
+    # Also serves the plain (group_id, created_at, id) listing as a prefix
+    ("expenses", [("group_id", 1), ("created_at", -1), ("id", -1), ("date", 1), ("amount_cents", 1)], {}),
+    ("expenses", [("description", "text")], {}),
+    ("activity", [("user_id", 1), ("created_at", -1), ("id", -1)], {}),
+    ("activity", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ("invites", [("id", 1)], {"unique": True}),
+    ("invites", [("group_id", 1)], {}),
+    ("invites", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ("recurring_expenses", [("id", 1)], {"unique": True}),
+    ("recurring_expenses", [("group_id", 1)], {}),
+    ("recurring_expenses", [("next_run_at", 1)], {}),
+    ("exports", [("id", 1)], {"unique": True}),
+    ("exports", [("expires_at", 1)], {}),
+    ("idempotency_keys", [("key", 1)], {"unique": True}),
+    ("idempotency_keys", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ("rate_limits", [("key", 1)], {"unique": True}),
+    ("rate_limits", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ("deleted_groups", [("id", 1)], {"unique": True}),
+    ("deleted_groups", [("deleted_at", 1)], {}),
+    ("deleted_groups", [("reaped_at", 1)], {"expireAfterSeconds": REAP_TOMBSTONE_RETENTION}),
+]
+
+# Representative shapes of the queries issued by the routes above, as
+# (name, collection, filter, sort). Keep this in sync when adding routes so
+# the startup report catches queries that fall back to a collection scan.
+QUERY_PLANS = [
+    ("login", "users", {"email": "?"}, None),
+    ("get_current_user", "users", {"id": "?"}, None),
+    ("list_groups", "groups", {"members.user_id": "?"}, None),
+    ("group_access", "groups", {"id": "?", "members.user_id": "?"}, None),
+    ("list_expenses", "expenses", {"group_id": "?"}, PAGE_SORT),
+    ("get_expense", "expenses", {"id": "?"}, None),
+    ("recent_expenses", "expenses", {"group_id": {"$in": ["?"]}}, [("created_at", -1)]),
+    ("list_settlements", "settlements", {"group_id": "?"}, PAGE_SORT),
+    ("search_paid_by", "expenses", {"group_id": "?", "paid_by": "?"}, PAGE_SORT),
+    ("search_participant", "expenses", {"group_id": {"$in": ["?"]}, "splits.user_id": "?"}, PAGE_SORT),
+    ("search_split_type", "expenses", {"group_id": "?", "split_type": "?"}, PAGE_SORT),
+    ("search_ranges", "expenses",
+     {"group_id": "?", "date": {"$gte": "?", "$lte": "?"}, "amount_cents": {"$gte": 0}}, PAGE_SORT),
+    ("search_text", "expenses", {"group_id": "?", "$text": {"$search": "?"}}, PAGE_SORT),
+    ("group_ledger", "group_ledgers", {"group_id": "?"}, None),
+    ("activity", "activity", {"user_id": "?"}, PAGE_SORT),
+    ("invite", "invites", {"id": "?"}, None),
+    ("recurring_due", "recurring_expenses", {"next_run_at": {"$lte": "?"}}, [("next_run_at", 1)]),
+    ("recurring_list", "recurring_expenses", {"group_id": "?"}, None),
+    ("user_totals", "user_totals", {"user_id": "?"}, None),
+    ("fanout_claim", "fanout_jobs", {"status": "pending"}, [("updated_at", 1)]),
+    ("fanout_expenses", "expenses", {"paid_by": "?", "paid_by_name": {"$ne": "?"}}, None),
+    ("fanout_settlements_from", "settlements", {"from_user": "?", "from_user_name": {"$ne": "?"}}, None),
+    ("fanout_settlements_to", "settlements", {"to_user": "?", "to_user_name": {"$ne": "?"}}, None),
+    ("sync", "changes", {"$or": [{"group_id": "?", "seq": {"$gt": 0}}]}, [("group_id", 1), ("seq", 1)]),
+]
+
+# Indexes made redundant by a wider one in INDEXES, dropped where they exist
+RETIRED_INDEXES = [
+    ("expenses", [("group_id", 1), ("created_at", -1), ("id", -1)]),
+]
+
+async def ensure_indexes():
+    for collection, keys, options in INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except OperationFailure as e:
+            logger.error("Could not create index %s on %s: %s", keys, collection, e)
+    # Only after their replacements exist
+    for collection, keys in RETIRED_INDEXES:
+        try:
+            await db[collection].drop_index(keys)
+        except OperationFailure as e:
+            if e.code != 27:  # IndexNotFound
+                logger.error("Could not drop index %s on %s: %s", keys, collection, e)
+
+def _plan_stages(plan: dict) -> List[str]:
+    stages = [plan.get("stage", "")]
+    for child in plan.get("inputStages", []) + [plan[k] for k in ("inputStage", "queryPlan") if k in plan]:
+        stages.extend(_plan_stages(child))
+    return stages
+
+async def report_query_plans() -> List[str]:
+    """Explain every query in QUERY_PLANS and log the ones that scan a whole collection."""
+    scans = []
+    for name, collection, query, sort in QUERY_PLANS:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explained = await cursor.explain()
+        if "COLLSCAN" in _plan_stages(explained["queryPlanner"]["winningPlan"]):
+            scans.append(name)
+            logger.warning("Query %s on %s is a collection scan: %s", name, collection, query)
+    logger.info("Query plan report: %d of %d queries are collection scans", len(scans), len(QUERY_PLANS))
+    return scans
+
+# ==================== MIGRATIONS ====================
+# Readers assume integer cents, so startup converts any legacy float amounts
+# before the app serves requests (MIGRATE_ON_STARTUP=0 leaves it to manage.py).
+
+MIGRATION_CHUNK = 1000
+
+async def has_legacy_amounts() -> bool:
+    for collection in ("expenses", "settlements"):
+        if await db[collection].find_one({"amount_cents": {"$exists": False}}, {"_id": 1}):
+            return True
+    return False
+
+async def migrate_amounts_to_cents() -> Dict[str, int]:
+    """Convert legacy float `amount` fields to integer cents, then rebuild every ledger.
+
+    Safe to re-run: only documents without `amount_cents` are touched.
+    """
+    migrated = {}
+    for collection, has_splits in (("expenses", True), ("settlements", False)):
+        count = 0
+        while True:
+            docs = await db[collection].find(
+                {"amount_cents": {"$exists": False}},
+                {"_id": 1, "amount": 1, "splits": 1}
+            ).limit(MIGRATION_CHUNK).to_list(MIGRATION_CHUNK)
+            if not docs:
+                break
+            ops = []
+            for doc in docs:
+                update = {"amount_cents": to_cents(doc.get("amount", 0))}
+                if has_splits:
+                    update["splits"] = [
+                        {"user_id": s["user_id"], "amount_cents": s.get("amount_cents", to_cents(s.get("amount", 0)))}
+                        for s in doc.get("splits", [])
+                    ]
+                ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": update, "$unset": {"amount": ""}}))
+            await db[collection].bulk_write(ops, ordered=False)
+            count += len(ops)
+        migrated[collection] = count
+
+    # Ledgers and rollups still hold float sums; recompute them in cents
+    group_ids = [g["id"] async for g in db.groups.find({}, {"_id": 0, "id": 1})]
+    for group_id in group_ids:
+        await rebuild_group_ledger(group_id)
+    migrated["ledgers"] = len(group_ids)
+    return migrated
+
+# ==================== IDEMPOTENCY ====================
+# Idempotency-Key replay lives in idempotency.py; keys are scoped to the
+# bearer token's user.
+
+def bearer_user_id(scope) -> Optional[str]:
+    """User id from a valid bearer token, for middleware that runs before get_current_user."""
+    if "bearer_user_id" not in scope:
+        user_id = None
+        for name, value in scope["headers"]:
+            if name == b"authorization" and value[:7].lower() == b"bearer ":
+                try:
+                    payload = jwt.decode(value[7:].decode("latin-1"), JWT_SECRET, algorithms=[JWT_ALGORITHM])
+                    user_id = payload.get("user_id")
+                except jwt.InvalidTokenError:
+                    pass
+                break
+        scope["bearer_user_id"] = user_id
+    return scope["bearer_user_id"]
+
+idempotency_store = IdempotencyStore(lambda: db.idempotency_keys,
+                                     max_size=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '5000')))
+
+# ==================== RATE LIMITING ====================
+# Token buckets per route class (ratelimit.py). Buckets live in this process
+# by default (RATE_LIMIT_STORE=local, so N workers allow up to N times the
+# limit); =mongo shares them across workers through `rate_limits`.
+
+BUCKET_STORES = {"local": LocalBucketStore, "mongo": lambda: MongoBucketStore(lambda: db.rate_limits)}
+rate_limiter = RateLimiter(RATE_LIMITS, BUCKET_STORES[os.environ.get('RATE_LIMIT_STORE', 'local')](),
+                           identify=bearer_user_id)
+
+# ==================== METRICS ====================
+# Request latency and in-flight counts per route template
+# (metrics.RequestMetricsMiddleware), MongoDB command timings
+# (metrics.MongoCommandTimer on the client) and spans for password hashing
+# and response-model validation, all exported on /api/metrics. Requests
+# slower than SLOW_REQUEST_MS are logged with their span breakdown; 0 turns
+# the log off.
+
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '1000'))
+
 # ==================== STATUS ROUTES ====================
 
 @api_router.get("/")
@@ -623,17 +2943,91 @@ async def root():
 async def health():
     return {"status": "healthy"}
 
+@api_router.get("/stats")
+async def stats():
+    return {
+        "password_pool": password_pool.stats(),
+        "principal_cache": principal_cache.stats(),
+        "events": event_hub.stats(),
+        "profile_fanout": profile_fanout.stats(),
+        "group_reaper": group_reaper.stats(),
+        "idempotency": idempotency_store.stats(),
+        "recurring_expenses": recurring_scheduler.stats(),
+        "rate_limits": rate_limiter.stats()
+    }
+
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Innermost, so replayed responses still get CORS headers and metrics
+app.add_middleware(IdempotencyMiddleware, store=idempotency_store, identify=bearer_user_id)
+
+# Outside idempotency so a rejected request never claims its key
+if os.environ.get('RATE_LIMIT', '1') == '1':
+    app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        NEXT_CURSOR_HEADER, "ETag", "Idempotent-Replayed", "Retry-After",
+        "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "RateLimit-Policy"
+    ],
 )
 
+app.add_middleware(RequestMetricsMiddleware, slow_request_ms=SLOW_REQUEST_MS)
+
+@app.on_event("startup")
+async def ensure_db_indexes():
+    try:
+        if os.environ.get('ENSURE_INDEXES', '1') == '1':
+            await ensure_indexes()
+        if os.environ.get('QUERY_PLAN_REPORT', '1') == '1':
+            await report_query_plans()
+    except PyMongoError as e:
+        logger.error("Index bootstrap failed: %s", e)
+
+@app.on_event("startup")
+async def migrate_legacy_amounts():
+    if os.environ.get('MIGRATE_ON_STARTUP', '1') != '1':
+        return
+    try:
+        if await has_legacy_amounts():
+            logger.info("Migrated legacy amounts to cents: %s", await migrate_amounts_to_cents())
+    except PyMongoError as e:
+        logger.error("Amount migration failed: %s", e)
+
+@app.on_event("startup")
+async def start_event_broker():
+    await event_broker.start()
+
+@app.on_event("startup")
+async def start_profile_fanout():
+    if os.environ.get('PROFILE_FANOUT_WORKER', '1') == '1':
+        await profile_fanout.start()
+
+@app.on_event("startup")
+async def start_group_reaper():
+    if os.environ.get('GROUP_REAPER', '1') == '1':
+        await group_reaper.start()
+
+@app.on_event("startup")
+async def start_recurring_scheduler():
+    if os.environ.get('RECURRING_SCHEDULER', '1') == '1':
+        await recurring_scheduler.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await event_broker.stop()
+    await profile_fanout.stop()
+    await group_reaper.stop()
+    await recurring_scheduler.stop()
     client.close()
+    password_pool.executor.shutdown(wait=False)
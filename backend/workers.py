@@ -0,0 +1,57 @@
+"""Base class for the in-process background workers.
+
+A worker is a task that calls `run_once` until it is cancelled. Between
+passes it sleeps for the delay `run_once` returns (None means the worker's
+poll interval, 0 means go again at once) or until `wakeup` is set, so
+request handlers can nudge it after queueing work. A pass that raises is
+logged and retried after `retry_delay`.
+"""
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWorker(ABC):
+    name = "Background worker"
+
+    def __init__(self, poll_interval: float, retry_delay: Optional[float] = None):
+        self.poll_interval = poll_interval
+        self.retry_delay = poll_interval if retry_delay is None else retry_delay
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.failures = 0
+
+    async def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    @abstractmethod
+    async def run_once(self) -> Optional[float]:
+        ...
+
+    async def run(self):
+        while True:
+            # Cleared before the pass so a wakeup that arrives during it is not lost
+            self.wakeup.clear()
+            try:
+                delay = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failures += 1
+                logger.exception("%s failed, retrying in %g s", self.name, self.retry_delay)
+                delay = self.retry_delay
+            if delay is None:
+                delay = self.poll_interval
+            if delay <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
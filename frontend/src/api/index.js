@@ -2,6 +2,17 @@ import axios from 'axios';
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
+// Writes carry an Idempotency-Key so a retried request replays the original
+// response instead of writing twice. Retries reuse the config, and the key.
+// Auth calls are left out: the server does not store responses with tokens.
+axios.interceptors.request.use((config) => {
+  if (['post', 'put', 'patch', 'delete'].includes(config.method) && !config.url.includes('/auth/') &&
+      !config.headers['Idempotency-Key']) {
+    config.headers['Idempotency-Key'] = crypto.randomUUID();
+  }
+  return config;
+});
+
 // Groups API
 export const groupsApi = {
   list: () => axios.get(`${API}/groups`),
@@ -12,22 +23,54 @@ export const groupsApi = {
   addMember: (groupId, email) => axios.post(`${API}/groups/${groupId}/members`, { email }),
   removeMember: (groupId, userId) => axios.delete(`${API}/groups/${groupId}/members/${userId}`),
   getBalances: (groupId) => axios.get(`${API}/groups/${groupId}/balances`),
+  getSnapshot: (groupId) => axios.get(`${API}/groups/${groupId}/snapshot`),
+  createInvite: (groupId, data = {}) => axios.post(`${API}/groups/${groupId}/invites`, data),
+  listInvites: (groupId) => axios.get(`${API}/groups/${groupId}/invites`),
+  revokeInvite: (groupId, inviteId) => axios.delete(`${API}/groups/${groupId}/invites/${inviteId}`),
+  exportStatement: (groupId, format = 'csv') =>
+    axios.get(`${API}/groups/${groupId}/export`, { params: { format }, responseType: 'blob' }),
+  startExport: (groupId, format = 'csv') => axios.post(`${API}/groups/${groupId}/exports`, { format }),
+};
+
+// Exports API
+export const exportsApi = {
+  get: (id) => axios.get(`${API}/exports/${id}`),
+  download: (id) => axios.get(`${API}/exports/${id}/download`, { responseType: 'blob' }),
+};
+
+// Invites API
+export const invitesApi = {
+  preview: (token) => axios.get(`${API}/invites/${token}`),
+  accept: (token) => axios.post(`${API}/invites/${token}/accept`),
 };
 
 // Expenses API
 export const expensesApi = {
   list: (groupId) => axios.get(`${API}/expenses?group_id=${groupId}`),
+  search: (params) => axios.get(`${API}/expenses/search`, { params }),
   create: (data) => axios.post(`${API}/expenses`, data),
   update: (id, data) => axios.put(`${API}/expenses/${id}`, data),
   delete: (id) => axios.delete(`${API}/expenses/${id}`),
 };
 
+// Recurring expenses API
+export const recurringExpensesApi = {
+  list: (groupId) => axios.get(`${API}/recurring-expenses?group_id=${groupId}`),
+  create: (data) => axios.post(`${API}/recurring-expenses`, data),
+  delete: (id) => axios.delete(`${API}/recurring-expenses/${id}`),
+};
+
 // Settlements API
 export const settlementsApi = {
   list: (groupId) => axios.get(`${API}/settlements?group_id=${groupId}`),
   create: (data) => axios.post(`${API}/settlements`, data),
 };
 
+// Activity API
+export const activityApi = {
+  list: (params) => axios.get(`${API}/activity`, { params }),
+};
+
 // Dashboard API
 export const dashboardApi = {
   get: () => axios.get(`${API}/dashboard`),
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { useAuth } from '../context/AuthContext';
-import { dashboardApi } from '../api';
+import { activityApi } from '../api';
 import { formatCurrency, formatDate } from '../lib/utils';
 import { detectExpenseCategory } from '../lib/expenseCategories';
 import BottomNav from '../components/BottomNav';
@@ -18,8 +18,8 @@ const ActivityPage = () => {
 
   const fetchActivity = async () => {
     try {
-      const response = await dashboardApi.get();
-      setExpenses(response.data.recent_expenses || []);
+      const response = await activityApi.list({ limit: 50 });
+      setExpenses(response.data || []);
     } catch (error) {
       toast.error('Failed to load activity');
     } finally {
@@ -76,12 +76,14 @@ const ActivityPage = () => {
                     <div className="flex-1 min-w-0">
                       <p className="font-semibold text-sm truncate">{expense.description}</p>
                       <p className="text-xs text-muted-foreground font-mono">
-                        {expense.group_name} · {formatDate(expense.date)}
+                        {expense.group_name} · {expense.actor_name} · {formatDate(expense.date || expense.created_at)}
                       </p>
                     </div>
-                    <p className="font-bold currency text-sm">
-                      {formatCurrency(expense.amount)}
-                    </p>
+                    {expense.amount != null && (
+                      <p className={`font-bold currency text-sm ${expense.op === 'delete' ? 'line-through text-muted-foreground' : ''}`}>
+                        {formatCurrency(expense.amount)}
+                      </p>
+                    )}
                   </div>
                 </div>
               );
@@ -80,16 +80,11 @@ const GroupDetailPage = () => {
 
   const fetchData = useCallback(async () => {
     try {
-      const [groupRes, expensesRes, balancesRes, settlementsRes] = await Promise.all([
-        groupsApi.get(groupId),
-        expensesApi.list(groupId),
-        groupsApi.getBalances(groupId),
-        settlementsApi.list(groupId)
-      ]);
-      setGroup(groupRes.data);
-      setExpenses(expensesRes.data);
-      setBalances(balancesRes.data);
-      setSettlements(settlementsRes.data);
+      const { data } = await groupsApi.getSnapshot(groupId);
+      setGroup(data.group);
+      setExpenses(data.expenses);
+      setBalances(data.balances);
+      setSettlements(data.settlements);
     } catch (error) {
       toast.error('Failed to load group');
       navigate('/groups');
@@ -0,0 +1,80 @@
+"""Run the API in-process against mongomock-motor.
+
+Requests go through httpx's ASGI transport, so startup hooks (index builds,
+background workers) do not run; tests that need indexes call
+server.ensure_indexes() themselves.
+"""
+import functools
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "splitsync_test")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("RATE_LIMIT", "0")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import httpx  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    client = AsyncMongoMockClient()
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", client[os.environ["DB_NAME"]])
+    server.idempotency_store.entries.clear()
+    return server.db
+
+
+@pytest.fixture
+async def api(db):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+        yield client
+
+
+def patch_collection(monkeypatch, collection: str, method: str, replacement):
+    """Route db.<collection>.<method> through `replacement(original, *args, **kwargs)`.
+
+    mongomock-motor returns a new collection object on every attribute access,
+    so the method is patched on the class and only diverted for `collection`.
+    """
+    cls = type(server.db[collection])
+    original = getattr(cls, method)
+
+    async def patched(self, *args, **kwargs):
+        if self.name != collection:
+            return await original(self, *args, **kwargs)
+        return await replacement(functools.partial(original, self), *args, **kwargs)
+
+    monkeypatch.setattr(cls, method, patched)
+
+
+async def register(api, email: str, name: str) -> tuple:
+    """Register a user; returns (auth headers, user id)."""
+    response = await api.post("/api/auth/register", json={"email": email, "password": "secret", "name": name})
+    assert response.status_code == 200, response.text
+    body = response.json()
+    return {"Authorization": f"Bearer {body['token']}"}, body["user"]["id"]
+
+
+async def group_of_two(api) -> tuple:
+    """Alice's group with Bob added; returns (group id, (alice headers, id), (bob headers, id))."""
+    alice = await register(api, "alice@example.com", "Alice")
+    bob = await register(api, "bob@example.com", "Bob")
+    group = await api.post("/api/groups", json={"name": "Trip"}, headers=alice[0])
+    assert group.status_code == 200, group.text
+    added = await api.post(f"/api/groups/{group.json()['id']}/members", json={"email": "bob@example.com"},
+                           headers=alice[0])
+    assert added.status_code == 200, added.text
+    return group.json()["id"], alice, bob
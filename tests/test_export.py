@@ -0,0 +1,64 @@
+"""Statement export: row order, the caller's running balance and the CSV output."""
+import csv
+import io
+
+import pytest
+
+import server
+from tests.conftest import group_of_two
+
+pytestmark = pytest.mark.anyio
+
+
+async def history(api) -> tuple:
+    """Three rows; Bob's balance goes -20.00, -7.75, -3.25."""
+    group_id, (alice, alice_id), (bob, bob_id) = await group_of_two(api)
+    writes = [
+        ("/api/expenses", alice, {"group_id": group_id, "description": "Hotel", "amount": 30, "paid_by": alice_id,
+                                  "split_type": "exact",
+                                  "splits": [{"user_id": alice_id, "amount": 10}, {"user_id": bob_id, "amount": 20}]}),
+        ("/api/settlements", bob, {"group_id": group_id, "from_user": bob_id, "to_user": alice_id, "amount": 12.25}),
+        ("/api/expenses", bob, {"group_id": group_id, "description": "Taxi", "amount": 9, "paid_by": bob_id,
+                                "split_type": "equal",
+                                "splits": [{"user_id": alice_id, "amount": 4.5}, {"user_id": bob_id, "amount": 4.5}]}),
+    ]
+    for path, headers, body in writes:
+        response = await api.post(path, json=body, headers=headers)
+        assert response.status_code == 200, response.text
+    return group_id, bob, bob_id
+
+
+async def test_running_balance_follows_the_ledger(api):
+    group_id, _, bob_id = await history(api)
+
+    rows = [row async for row in server.statement_rows(group_id, bob_id)]
+    assert [row[1:3] for row in rows] == [["expense", "Hotel"], ["settlement", "Settlement"], ["expense", "Taxi"]]
+    assert [row[7] for row in rows] == [-20.0, 12.25, 4.5]
+    assert [row[8] for row in rows] == [-20.0, -7.75, -3.25]
+
+    net = (await server.db.group_ledgers.find_one({"group_id": group_id}))["net"]
+    assert server.from_cents(sum(net[bob_id].values())) == rows[-1][8]
+
+
+async def test_csv_export(api, monkeypatch):
+    # Flush after every other row so the output spans several chunks
+    monkeypatch.setattr(server, "EXPORT_CHUNK_ROWS", 2)
+    group_id, bob, _ = await history(api)
+
+    response = await api.get(f"/api/groups/{group_id}/export", params={"format": "csv"}, headers=bob)
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "text/csv; charset=utf-8"
+    assert response.headers["content-disposition"].endswith('.csv"')
+
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == server.STATEMENT_COLUMNS
+    assert rows[1][1:] == ["expense", "Hotel", "Alice", "", "30.0", "20.0", "-20.0", "-20.0"]
+    assert rows[2][1:] == ["settlement", "Settlement", "Bob", "Alice", "12.25", "", "12.25", "-7.75"]
+    assert rows[3][1:] == ["expense", "Taxi", "Bob", "", "9.0", "4.5", "4.5", "-3.25"]
+    assert len(rows) == 4
+
+
+async def test_unknown_export_format_is_refused(api):
+    group_id, bob, _ = await history(api)
+    response = await api.get(f"/api/groups/{group_id}/export", params={"format": "pdf"}, headers=bob)
+    assert response.status_code == 400
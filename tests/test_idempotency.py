@@ -0,0 +1,144 @@
+"""Idempotency-Key replay, mismatch, release and failure behaviour."""
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import server
+from asgi import json_response, send_stored_response
+from idempotency import IdempotencyMiddleware, IdempotencyStore
+from tests.conftest import group_of_two, patch_collection, register
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def indexed(db):
+    # The claim relies on the unique index on idempotency_keys.key
+    await server.ensure_indexes()
+
+
+def lunch(group_id: str, payer: str, amount: float = 12) -> dict:
+    return {"group_id": group_id, "description": "Lunch", "amount": amount, "paid_by": payer,
+            "split_type": "equal", "splits": [{"user_id": payer, "amount": amount}]}
+
+
+def fail_group_reads_once(monkeypatch, error: Exception):
+    calls = 0
+
+    async def failing_find_one(find_one, *args, **kwargs):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise error
+        return await find_one(*args, **kwargs)
+
+    patch_collection(monkeypatch, "groups", "find_one", failing_find_one)
+
+
+async def test_retry_replays_the_stored_response(api, indexed):
+    group_id, (alice, alice_id), _ = await group_of_two(api)
+    headers = {**alice, "Idempotency-Key": "lunch-1"}
+
+    first = await api.post("/api/expenses", json=lunch(group_id, alice_id), headers=headers)
+    assert first.status_code == 200, first.text
+    assert "idempotent-replayed" not in first.headers
+
+    retry = await api.post("/api/expenses", json=lunch(group_id, alice_id), headers=headers)
+    assert retry.status_code == 200
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+
+    # Another process only has the stored copy
+    server.idempotency_store.entries.clear()
+    stored = await api.post("/api/expenses", json=lunch(group_id, alice_id), headers=headers)
+    assert stored.headers["idempotent-replayed"] == "true"
+    assert stored.json() == first.json()
+
+    assert await server.db.expenses.count_documents({"group_id": group_id}) == 1
+
+
+async def test_reused_key_with_a_different_body_is_rejected(api, indexed):
+    group_id, (alice, alice_id), _ = await group_of_two(api)
+    headers = {**alice, "Idempotency-Key": "lunch-1"}
+    await api.post("/api/expenses", json=lunch(group_id, alice_id), headers=headers)
+
+    changed = await api.post("/api/expenses", json=lunch(group_id, alice_id, amount=40), headers=headers)
+    assert changed.status_code == 422
+    assert await server.db.expenses.count_documents({"group_id": group_id}) == 1
+
+
+async def test_keys_are_scoped_to_the_user(api, indexed):
+    group_id, (alice, alice_id), (bob, _) = await group_of_two(api)
+    await api.post("/api/expenses", json=lunch(group_id, alice_id), headers={**alice, "Idempotency-Key": "k"})
+    other = await api.post("/api/expenses", json=lunch(group_id, alice_id), headers={**bob, "Idempotency-Key": "k"})
+    assert "idempotent-replayed" not in other.headers
+    assert await server.db.expenses.count_documents({"group_id": group_id}) == 2
+
+
+async def test_failure_after_the_write_is_not_repeated(api, indexed, monkeypatch):
+    group_id, (alice, alice_id), _ = await group_of_two(api)
+    headers = {**alice, "Idempotency-Key": "lunch-1"}
+
+    record_activity = server.record_activity
+    calls = 0
+
+    async def unavailable_once(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise HTTPException(status_code=503, detail="Database unavailable")
+        return await record_activity(*args, **kwargs)
+
+    # The expense is inserted before the activity feed write fails
+    monkeypatch.setattr(server, "record_activity", unavailable_once)
+    failed = await api.post("/api/expenses", json=lunch(group_id, alice_id), headers=headers)
+    assert failed.status_code == 503
+
+    retry = await api.post("/api/expenses", json=lunch(group_id, alice_id), headers=headers)
+    assert retry.status_code == 409
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert await server.db.expenses.count_documents({"group_id": group_id}) == 1
+
+    fresh = await api.post("/api/expenses", json=lunch(group_id, alice_id), headers={**alice, "Idempotency-Key": "2"})
+    assert fresh.status_code == 200, fresh.text
+
+
+async def test_unhandled_exception_in_the_handler_keeps_the_key(api, indexed, monkeypatch):
+    group_id, (alice, alice_id), _ = await group_of_two(api)
+    headers = {**alice, "Idempotency-Key": "lunch-1"}
+    fail_group_reads_once(monkeypatch, RuntimeError("connection reset"))
+
+    with pytest.raises(RuntimeError):
+        await api.post("/api/expenses", json=lunch(group_id, alice_id), headers=headers)
+    assert (await server.db.idempotency_keys.find_one({}))["status"] == "failed"
+
+    server.idempotency_store.entries.clear()
+    retry = await api.post("/api/expenses", json=lunch(group_id, alice_id), headers=headers)
+    assert retry.status_code == 409
+
+
+async def test_failure_before_the_handler_releases_the_key(db, indexed):
+    calls = []
+
+    async def overloaded(scope, receive, send):
+        # Answers without reaching a route, like a shed request
+        calls.append(scope["path"])
+        await send_stored_response(send, json_response(503 if len(calls) == 1 else 201, "busy"))
+
+    store = IdempotencyStore(lambda: server.db.idempotency_keys, max_size=10)
+    app = IdempotencyMiddleware(overloaded, store=store, identify=lambda scope: "user-1")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        first = await client.post("/api/expenses", json={}, headers={"Idempotency-Key": "k"})
+        assert first.status_code == 503
+        assert await server.db.idempotency_keys.count_documents({}) == 0
+        retry = await client.post("/api/expenses", json={}, headers={"Idempotency-Key": "k"})
+    assert retry.status_code == 201
+    assert len(calls) == 2
+
+
+async def test_auth_responses_are_not_stored(api, indexed):
+    response = await api.post("/api/auth/register", headers={"Idempotency-Key": "signup"},
+                              json={"email": "carol@example.com", "password": "secret", "name": "Carol"})
+    assert response.status_code == 200
+    assert await server.db.idempotency_keys.count_documents({}) == 0
+    await register(api, "dave@example.com", "Dave")
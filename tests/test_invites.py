@@ -0,0 +1,100 @@
+"""Invite redemption: use limits, expiry and the per-minute cap."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from tests.conftest import patch_collection, register
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def real_mongo_after(db, monkeypatch):
+    # mongomock's find_one_and_update with ReturnDocument.AFTER re-applies the
+    # filter to the updated document and returns None when it no longer
+    # matches; real MongoDB returns the updated document. The join filter
+    # ($ne on members.user_id) never matches after the $addToSet, so every
+    # redemption would look like "already a member" and hand its use back.
+    async def find_one_and_update(original, filter, update, *args, return_document=False, **kwargs):
+        if not return_document:
+            return await original(filter, update, *args, **kwargs)
+        before = await original(filter, update, *args, **kwargs)
+        if before is None:
+            return None
+        return await server.db.groups.find_one({"id": before["id"]}, kwargs.get("projection"))
+
+    patch_collection(monkeypatch, "groups", "find_one_and_update", find_one_and_update)
+
+
+async def owner_with_invite(api, **invite) -> tuple:
+    alice, _ = await register(api, "alice@example.com", "Alice")
+    group = (await api.post("/api/groups", json={"name": "Trip"}, headers=alice)).json()
+    created = await api.post(f"/api/groups/{group['id']}/invites", json=invite, headers=alice)
+    assert created.status_code == 200, created.text
+    return alice, group["id"], created.json()
+
+
+async def join(api, token: str, email: str):
+    headers, _ = await register(api, email, email.split("@")[0].title())
+    return await api.post(f"/api/invites/{token}/accept", headers=headers)
+
+
+async def uses(invite_id: str) -> int:
+    return (await server.db.invites.find_one({"id": invite_id}))["uses"]
+
+
+async def test_max_uses_is_never_exceeded(api):
+    _, group_id, invite = await owner_with_invite(api, max_uses=2)
+
+    assert (await join(api, invite["token"], "bob@example.com")).status_code == 200
+    assert (await join(api, invite["token"], "carol@example.com")).status_code == 200
+    used_up = await join(api, invite["token"], "dave@example.com")
+    assert used_up.status_code == 410 and used_up.json()["detail"] == "Invite has been used up"
+
+    group = await server.db.groups.find_one({"id": group_id})
+    assert len(group["members"]) == 3
+    assert await uses(invite["id"]) == 2
+
+
+async def test_an_expired_invite_is_refused(api):
+    _, group_id, invite = await owner_with_invite(api)
+    expired = server.create_invite_token(invite["id"], group_id, datetime.now(timezone.utc) - timedelta(seconds=5))
+
+    response = await join(api, expired, "bob@example.com")
+    assert response.status_code == 410 and response.json()["detail"] == "Invite has expired"
+    assert await uses(invite["id"]) == 0
+
+
+async def test_redemptions_per_minute_are_capped_per_token(api, monkeypatch):
+    # Mid-minute, so the test cannot straddle a window boundary
+    now = (int(datetime.now(timezone.utc).timestamp()) // 60) * 60 + 30
+    monkeypatch.setattr(server.time, "time", lambda: now)
+    monkeypatch.setattr(server, "INVITE_REDEMPTIONS_PER_MINUTE", 2)
+    _, _, invite = await owner_with_invite(api)
+
+    assert (await join(api, invite["token"], "bob@example.com")).status_code == 200
+    assert (await join(api, invite["token"], "carol@example.com")).status_code == 200
+    capped = await join(api, invite["token"], "dave@example.com")
+    assert capped.status_code == 429 and capped.headers["retry-after"] == "30"
+
+    # The next window starts a new count
+    monkeypatch.setattr(server.time, "time", lambda: now + 60)
+    assert (await join(api, invite["token"], "erin@example.com")).status_code == 200
+    assert await uses(invite["id"]) == 3
+
+
+async def test_joining_twice_does_not_consume_a_use(api):
+    _, group_id, invite = await owner_with_invite(api, max_uses=1)
+    bob, _ = await register(api, "bob@example.com", "Bob")
+
+    first = await api.post(f"/api/invites/{invite['token']}/accept", headers=bob)
+    assert first.status_code == 200, first.text
+    assert await uses(invite["id"]) == 1
+
+    # Already in: the slot taken by the repeat redemption is given back
+    await server.db.invites.update_one({"id": invite["id"]}, {"$set": {"max_uses": 2}})
+    again = await api.post(f"/api/invites/{invite['token']}/accept", headers=bob)
+    assert again.status_code == 200 and again.json()["id"] == group_id
+    assert await uses(invite["id"]) == 1
+    assert len((await server.db.groups.find_one({"id": group_id}))["members"]) == 2
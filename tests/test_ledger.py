@@ -0,0 +1,114 @@
+"""The incrementally maintained ledger must always equal a rebuild from history."""
+import asyncio
+
+import pytest
+
+import server
+from tests.conftest import group_of_two, patch_collection
+
+pytestmark = pytest.mark.anyio
+
+
+def expense(group_id: str, payer: str, amount: float, shares: dict) -> dict:
+    return {
+        "group_id": group_id, "description": "Dinner", "amount": amount, "paid_by": payer, "split_type": "exact",
+        "splits": [{"user_id": user_id, "amount": share} for user_id, share in shares.items()]
+    }
+
+
+async def assert_ledger_matches_history(group_id: str):
+    assert await server.verify_group_ledger(group_id) == []
+
+
+async def test_ledger_follows_every_write(api):
+    group_id, (alice, alice_id), (bob, bob_id) = await group_of_two(api)
+
+    created = await api.post("/api/expenses", json=expense(group_id, alice_id, 30, {alice_id: 10, bob_id: 20}),
+                             headers=alice)
+    assert created.status_code == 200, created.text
+    expense_id = created.json()["id"]
+    await assert_ledger_matches_history(group_id)
+
+    updated = await api.put(f"/api/expenses/{expense_id}", headers=alice, json={
+        "amount": 45.5, "splits": [{"user_id": alice_id, "amount": 15.5}, {"user_id": bob_id, "amount": 30}]
+    })
+    assert updated.status_code == 200, updated.text
+    await assert_ledger_matches_history(group_id)
+
+    settled = await api.post("/api/settlements", headers=bob,
+                             json={"group_id": group_id, "from_user": bob_id, "to_user": alice_id, "amount": 12.25})
+    assert settled.status_code == 200, settled.text
+    await assert_ledger_matches_history(group_id)
+
+    deleted = await api.delete(f"/api/expenses/{expense_id}", headers=alice)
+    assert deleted.status_code == 200, deleted.text
+    await assert_ledger_matches_history(group_id)
+
+    # Only the settlement is left, in integer cents
+    net = (await server.db.group_ledgers.find_one({"group_id": group_id}, {"_id": 0}))["net"]
+    assert net[bob_id].get(alice_id, 0) == -net[alice_id].get(bob_id, 0)
+    assert abs(net[bob_id][alice_id]) == 1225
+
+
+async def slow_group_reads(monkeypatch):
+    # mongomock never yields to the event loop; make concurrent requests interleave
+    async def slow_find_one(find_one, *args, **kwargs):
+        await asyncio.sleep(0.01)
+        return await find_one(*args, **kwargs)
+
+    patch_collection(monkeypatch, "groups", "find_one", slow_find_one)
+
+
+async def test_concurrent_deletes_apply_the_ledger_once(api, monkeypatch):
+    group_id, (alice, alice_id), (_, bob_id) = await group_of_two(api)
+    created = await api.post("/api/expenses", json=expense(group_id, alice_id, 20, {alice_id: 10, bob_id: 10}),
+                             headers=alice)
+    expense_id = created.json()["id"]
+
+    await slow_group_reads(monkeypatch)
+    responses = await asyncio.gather(*(api.delete(f"/api/expenses/{expense_id}", headers=alice) for _ in range(2)))
+
+    assert sorted(r.status_code for r in responses) == [200, 404]
+    await assert_ledger_matches_history(group_id)
+
+
+async def test_update_racing_a_delete_leaves_no_drift(api, monkeypatch):
+    group_id, (alice, alice_id), (_, bob_id) = await group_of_two(api)
+    created = await api.post("/api/expenses", json=expense(group_id, alice_id, 20, {alice_id: 10, bob_id: 10}),
+                             headers=alice)
+    expense_id = created.json()["id"]
+
+    await slow_group_reads(monkeypatch)
+    await asyncio.gather(
+        api.put(f"/api/expenses/{expense_id}", headers=alice,
+                json={"amount": 50, "splits": [{"user_id": alice_id, "amount": 25}, {"user_id": bob_id, "amount": 25}]}),
+        api.delete(f"/api/expenses/{expense_id}", headers=alice),
+    )
+
+    await assert_ledger_matches_history(group_id)
+
+
+async def test_removed_member_keeps_their_balance_on_rejoin(api):
+    group_id, (alice, alice_id), (bob, bob_id) = await group_of_two(api)
+    await api.post("/api/expenses", json=expense(group_id, alice_id, 10, {alice_id: 5, bob_id: 5}), headers=alice)
+
+    removed = await api.delete(f"/api/groups/{group_id}/members/{bob_id}", headers=alice)
+    assert removed.status_code == 200, removed.text
+    assert (await api.get("/api/dashboard", headers=bob)).json()["net_balance"] == 0
+
+    rejoined = await api.post(f"/api/groups/{group_id}/members", json={"email": "bob@example.com"}, headers=alice)
+    assert rejoined.status_code == 200, rejoined.text
+    dashboard = (await api.get("/api/dashboard", headers=bob)).json()
+    assert dashboard["net_balance"] == -5.0 and dashboard["total_owing"] == 5.0
+    await assert_ledger_matches_history(group_id)
+
+
+async def test_verify_reports_a_drifted_rollup(api):
+    group_id, (alice, alice_id), (_, bob_id) = await group_of_two(api)
+    await api.post("/api/expenses", json=expense(group_id, alice_id, 10, {alice_id: 5, bob_id: 5}), headers=alice)
+    await assert_ledger_matches_history(group_id)
+
+    await server.db.user_totals.update_one({"user_id": bob_id}, {"$inc": {f"groups.{group_id}.owing": 100}})
+    assert await server.verify_group_ledger(group_id) == [
+        {"user_id": bob_id, "rollup": "owing", "expected": 500, "stored": 600}
+    ]
@@ -0,0 +1,84 @@
+"""Integer-cent conversion and the legacy float migration."""
+import math
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from tests.conftest import group_of_two
+
+
+@pytest.mark.parametrize("amount, cents", [
+    (0.005, 1),
+    (1.005, 101),
+    (2.675, 268),
+    (10.0, 1000),
+    (0.1 + 0.2, 30),
+    (-0.005, -1),
+])
+def test_to_cents_rounds_half_up(amount, cents):
+    assert server.to_cents(amount) == cents
+
+
+@pytest.mark.parametrize("amount", [math.inf, math.nan, server.MAX_AMOUNT * 10])
+def test_to_cents_rejects_out_of_range(amount):
+    with pytest.raises(HTTPException) as raised:
+        server.to_cents(amount)
+    assert raised.value.status_code == 400
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("amount", [1e30, -5, 0])
+async def test_out_of_range_amounts_are_rejected(api, amount):
+    group_id, (alice, alice_id), _ = await group_of_two(api)
+    response = await api.post("/api/expenses", headers=alice, json={
+        "group_id": group_id, "description": "Dinner", "amount": amount, "paid_by": alice_id,
+        "split_type": "equal", "splits": [{"user_id": alice_id, "amount": amount}]
+    })
+    assert response.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_migrate_amounts_to_cents_is_safe_to_rerun(api):
+    group_id, (_, alice_id), (_, bob_id) = await group_of_two(api)
+    await server.db.expenses.insert_one({
+        "id": "legacy-expense", "group_id": group_id, "description": "Taxi", "amount": 20.05,
+        "paid_by": alice_id, "paid_by_name": "Alice", "split_type": "exact", "created_at": "2024-01-01",
+        "splits": [{"user_id": alice_id, "amount": 10.02}, {"user_id": bob_id, "amount": 10.03}]
+    })
+    await server.db.settlements.insert_one({
+        "id": "legacy-settlement", "group_id": group_id, "from_user": bob_id, "to_user": alice_id,
+        "amount": 5.5, "created_at": "2024-01-02"
+    })
+
+    first = await server.migrate_amounts_to_cents()
+    assert first["expenses"] == 1 and first["settlements"] == 1
+    migrated = await server.db.expenses.find_one({"id": "legacy-expense"}, {"_id": 0})
+    assert "amount" not in migrated
+    assert migrated["amount_cents"] == 2005
+    assert [s["amount_cents"] for s in migrated["splits"]] == [1002, 1003]
+    ledger = await server.db.group_ledgers.find_one({"group_id": group_id}, {"_id": 0})
+
+    second = await server.migrate_amounts_to_cents()
+    assert second["expenses"] == 0 and second["settlements"] == 0
+    assert await server.db.expenses.find_one({"id": "legacy-expense"}, {"_id": 0}) == migrated
+    assert (await server.db.group_ledgers.find_one({"group_id": group_id}, {"_id": 0}))["net"] == ledger["net"]
+    assert await server.verify_group_ledger(group_id) == []
+
+
+@pytest.mark.anyio
+async def test_startup_migrates_legacy_amounts(api):
+    group_id, (alice, alice_id), _ = await group_of_two(api)
+    await server.db.expenses.insert_one({
+        "id": "legacy-expense", "group_id": group_id, "description": "Taxi", "amount": 20.05,
+        "paid_by": alice_id, "paid_by_name": "Alice", "split_type": "exact", "created_at": "2024-01-01",
+        "splits": [{"user_id": alice_id, "amount": 20.05}]
+    })
+    with pytest.raises(KeyError):
+        await api.get("/api/expenses", params={"group_id": group_id}, headers=alice)
+
+    await server.migrate_legacy_amounts()
+    assert not await server.has_legacy_amounts()
+    listed = await api.get("/api/expenses", params={"group_id": group_id}, headers=alice)
+    assert listed.status_code == 200, listed.text
+    assert [e["amount"] for e in listed.json()] == [20.05]
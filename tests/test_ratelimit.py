@@ -0,0 +1,79 @@
+"""Token bucket refill and the 429 answer."""
+import pytest
+
+import ratelimit
+import server
+from ratelimit import LocalBucketStore, RateLimiter, RateLimitMiddleware
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    return now
+
+
+async def test_bucket_refills_at_the_configured_rate(clock):
+    store = LocalBucketStore()
+    # Burst of 2, one token every 2 seconds
+    assert await store.take("k", 2, 0.5) == (True, 1)
+    assert await store.take("k", 2, 0.5) == (True, 0)
+    assert await store.take("k", 2, 0.5) == (False, 0)
+
+    clock[0] += 1
+    assert await store.take("k", 2, 0.5) == (False, 0.5)
+    clock[0] += 1
+    assert await store.take("k", 2, 0.5) == (True, 0)
+
+    # Never refills past the burst
+    clock[0] += 3600
+    assert await store.take("k", 2, 0.5) == (True, 1)
+    assert await store.take("other", 2, 0.5) == (True, 1)
+
+
+async def test_bucket_store_evicts_the_least_recent_key(clock):
+    store = LocalBucketStore(max_keys=2)
+    for key in ("a", "b", "c"):
+        await store.take(key, 1, 1)
+    assert list(store.buckets) == ["b", "c"]
+
+
+async def login(app, forwarded_for: str) -> tuple:
+    scope = {
+        "type": "http", "method": "POST", "path": "/api/auth/login", "query_string": b"", "app": server.app,
+        "headers": [(b"x-forwarded-for", forwarded_for.encode())], "client": ("10.0.0.1", 5000),
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages[0]["status"], {k.decode(): v.decode() for k, v in messages[0]["headers"]}
+
+
+async def test_exhausted_bucket_answers_429_with_retry_after(clock):
+    async def ok(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    limiter = RateLimiter({"auth": (2, 8)}, LocalBucketStore(), identify=lambda scope: None)
+    app = RateLimitMiddleware(ok, limiter=limiter)
+
+    status, headers = await login(app, "203.0.113.7")
+    assert status == 200 and headers["ratelimit-remaining"] == "1"
+    assert (await login(app, "203.0.113.7"))[0] == 200
+    status, headers = await login(app, "203.0.113.7")
+    # One token per 4 seconds
+    assert status == 429 and headers["retry-after"] == "4"
+
+    clock[0] += 1
+    assert (await login(app, "203.0.113.7"))[1]["retry-after"] == "3"
+    # Behind the ingress every request shares its address; the forwarded one is the client
+    assert (await login(app, "spoofed, 198.51.100.2"))[0] == 200
+    assert limiter.stats()["limited"]["auth"] == 2
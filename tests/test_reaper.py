@@ -0,0 +1,33 @@
+"""Deleted groups are reaped, and reaped again when a racing write left records behind."""
+import pytest
+
+import reaper
+import server
+from tests.conftest import group_of_two
+
+pytestmark = pytest.mark.anyio
+
+group_reaper = server.group_reaper
+
+
+async def test_a_late_write_to_a_reaped_group_is_swept(api, monkeypatch):
+    monkeypatch.setattr(reaper, "REAP_CHUNK_DELAY", 0)
+    group_id, (alice, alice_id), _ = await group_of_two(api)
+    await api.post("/api/expenses", headers=alice, json={
+        "group_id": group_id, "description": "Lunch", "amount": 12, "paid_by": alice_id,
+        "split_type": "equal", "splits": [{"user_id": alice_id, "amount": 12}]
+    })
+    assert (await api.delete(f"/api/groups/{group_id}", headers=alice)).status_code == 200
+
+    assert await group_reaper.reap_all() == 1
+    assert await server.db.expenses.count_documents({"group_id": group_id}) == 0
+    assert (await server.db.deleted_groups.find_one({"id": group_id}))["reaped_at"] is not None
+    assert await group_reaper.reap_all() == 0
+    assert await group_reaper.sweep_reaped() == []
+
+    # An insert that passed its group check just before the delete
+    await server.db.expenses.insert_one({"id": "late", "group_id": group_id})
+    assert await group_reaper.sweep_reaped() == [group_id]
+    assert await group_reaper.reap_all() == 1
+    assert await server.db.expenses.count_documents({"group_id": group_id}) == 0
+    assert await group_reaper.sweep_reaped() == []
@@ -0,0 +1,125 @@
+"""The recurring scheduler creates every occurrence exactly once."""
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+import recurring
+import server
+from recurring import occurrence_date
+from tests.conftest import group_of_two, patch_collection
+
+scheduler = server.recurring_scheduler
+
+
+@pytest.fixture
+async def indexed(db):
+    # Duplicate occurrences are caught by the unique index on expenses.id
+    await server.ensure_indexes()
+
+
+async def create_rule(api, headers: dict, group_id: str, payer: str, frequency: str, start: date) -> dict:
+    response = await api.post("/api/recurring-expenses", headers=headers, json={
+        "group_id": group_id, "description": "Rent", "amount": 30, "paid_by": payer, "split_type": "equal",
+        "splits": [{"user_id": payer, "amount": 30}], "frequency": frequency, "start_date": start.isoformat()
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def expense_dates(group_id: str) -> list:
+    return sorted([e["date"] async for e in server.db.expenses.find({"group_id": group_id}, {"_id": 0, "date": 1})])
+
+
+def days_ago(days: int) -> date:
+    return datetime.now(timezone.utc).date() - timedelta(days=days)
+
+
+@pytest.mark.anyio
+async def test_concurrent_and_repeated_passes_create_each_occurrence_once(api, indexed, monkeypatch):
+    group_id, (alice, alice_id), _ = await group_of_two(api)
+    await create_rule(api, alice, group_id, alice_id, "daily", days_ago(9))
+
+    # mongomock never yields to the event loop; make two workers' passes interleave
+    async def slow(method, *args, **kwargs):
+        await asyncio.sleep(0.01)
+        return await method(*args, **kwargs)
+
+    patch_collection(monkeypatch, "recurring_expenses", "find_one_and_update", slow)
+    patch_collection(monkeypatch, "expenses", "insert_many", slow)
+    passes = scheduler.passes
+    await asyncio.gather(scheduler.run_once(), scheduler.run_once())
+    await scheduler.run_once()
+
+    # Only one worker got the template; the other found it leased
+    assert scheduler.passes == passes + 1
+    assert await expense_dates(group_id) == [days_ago(n).isoformat() for n in range(9, -1, -1)]
+    assert await server.verify_group_ledger(group_id) == []
+
+
+@pytest.mark.anyio
+async def test_a_leased_template_waits_for_the_lease_to_expire(api, indexed):
+    group_id, (alice, alice_id), _ = await group_of_two(api)
+    rule = await create_rule(api, alice, group_id, alice_id, "daily", days_ago(0))
+
+    # Another worker holds it
+    lease_until = datetime.now(timezone.utc) + timedelta(seconds=60)
+    await server.db.recurring_expenses.update_one({"id": rule["id"]}, {"$set": {"lease_until": lease_until}})
+    assert await scheduler.run_due() == 0
+    assert await expense_dates(group_id) == []
+
+    # ...and died
+    lease_until = datetime.now(timezone.utc) - timedelta(seconds=1)
+    await server.db.recurring_expenses.update_one({"id": rule["id"]}, {"$set": {"lease_until": lease_until}})
+    assert await scheduler.run_due() == 1
+    assert await expense_dates(group_id) == [days_ago(0).isoformat()]
+    template = await server.db.recurring_expenses.find_one({"id": rule["id"]})
+    assert "lease_until" not in template and template["occurrences"] == 1
+
+
+@pytest.mark.anyio
+async def test_a_pass_retried_after_a_crash_does_not_duplicate(api, indexed):
+    group_id, (alice, alice_id), _ = await group_of_two(api)
+    rule = await create_rule(api, alice, group_id, alice_id, "daily", days_ago(2))
+    before = await server.db.recurring_expenses.find_one({"id": rule["id"]}, {"_id": 0})
+    await scheduler.run_once()
+    created = scheduler.expenses_created
+
+    # The pass inserted its expenses but died before advancing the template
+    await server.db.recurring_expenses.replace_one({"id": rule["id"]}, before)
+    await scheduler.run_once()
+
+    assert await expense_dates(group_id) == [days_ago(n).isoformat() for n in (2, 1, 0)]
+    assert scheduler.expenses_created == created
+    assert await server.verify_group_ledger(group_id) == []
+
+
+@pytest.mark.anyio
+async def test_a_template_that_fell_behind_catches_up(api, indexed, monkeypatch):
+    group_id, (alice, alice_id), _ = await group_of_two(api)
+    rule = await create_rule(api, alice, group_id, alice_id, "weekly", days_ago(35))
+
+    monkeypatch.setattr(recurring, "RECURRING_CATCHUP", 4)
+    assert await scheduler.run_due() == 1
+    assert len(await expense_dates(group_id)) == 4
+    await scheduler.run_once()
+
+    assert await expense_dates(group_id) == [days_ago(7 * n).isoformat() for n in range(5, -1, -1)]
+    template = await server.db.recurring_expenses.find_one({"id": rule["id"]})
+    assert template["occurrences"] == 6 and template["next_date"] == (days_ago(0) + timedelta(weeks=1)).isoformat()
+
+
+@pytest.mark.parametrize("start, dates", [
+    ("2025-01-31", ["2025-01-31", "2025-02-28", "2025-03-31", "2025-04-30"]),
+    ("2024-01-31", ["2024-01-31", "2024-02-29", "2024-03-31", "2024-04-30"]),
+])
+def test_monthly_rules_clamp_to_short_months(start, dates):
+    template = {"start_date": start, "frequency": "monthly", "interval": 1}
+    assert [occurrence_date(template, n).isoformat() for n in range(4)] == dates
+
+
+def test_yearly_rule_from_a_leap_day():
+    template = {"start_date": "2024-02-29", "frequency": "yearly", "interval": 1}
+    assert [occurrence_date(template, n).isoformat() for n in range(5)] == [
+        "2024-02-29", "2025-02-28", "2026-02-28", "2027-02-28", "2028-02-29"
+    ]
@@ -0,0 +1,75 @@
+"""The settle-up planner settles every position, in the fewest transfers for small groups."""
+import random
+
+import pytest
+
+import server
+
+
+def settles(positions: dict, transfers: list) -> bool:
+    left = dict(positions)
+    for from_user, to_user, amount in transfers:
+        assert amount > 0
+        left[from_user] += amount
+        left[to_user] -= amount
+    return not any(left.values())
+
+
+def fewest_transfers(amounts: list) -> int:
+    # Backtracking over who settles the first open balance; exponential but exact
+    def search(start: int) -> int:
+        while start < len(amounts) and amounts[start] == 0:
+            start += 1
+        if start == len(amounts):
+            return 0
+        best = len(amounts)
+        for other in range(start + 1, len(amounts)):
+            if amounts[other] * amounts[start] < 0:
+                amounts[other] += amounts[start]
+                best = min(best, 1 + search(start + 1))
+                amounts[other] -= amounts[start]
+        return best
+
+    return search(0)
+
+
+def random_positions(rng: random.Random, members: int) -> dict:
+    amounts = [rng.choice([-1, 1]) * rng.choice([500, 1000, 1500, 2500, 4000]) for _ in range(members - 1)]
+    amounts.append(-sum(amounts))
+    return {f"user-{i}": amount for i, amount in enumerate(amounts)}
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_exact_plan_uses_the_fewest_transfers(seed):
+    rng = random.Random(seed)
+    positions = random_positions(rng, rng.randint(2, 7))
+
+    method, transfers = server.plan_transfers(positions)
+    assert method == "exact"
+    assert settles(positions, transfers)
+    assert len(transfers) == fewest_transfers(list(positions.values()))
+
+
+def test_exact_plan_beats_greedy_on_a_hidden_subgroup():
+    # c and d cancel out, but greedy pairs e (largest debtor) with c first
+    positions = {"a": 200, "b": 200, "c": 300, "d": -300, "e": -400}
+    assert len(server.plan_greedy_transfers(positions)) == 4
+    method, transfers = server.plan_transfers(positions)
+    assert (method, len(transfers)) == ("exact", 3)
+    assert ("d", "c", 300) in transfers
+
+
+def test_large_groups_fall_back_to_greedy(monkeypatch):
+    monkeypatch.setattr(server, "SETTLE_EXACT_MAX", 4)
+    positions = random_positions(random.Random(1), 6)
+    assert sum(1 for amount in positions.values() if amount) > 4
+
+    method, transfers = server.plan_transfers(positions)
+    assert method == "greedy"
+    assert settles(positions, transfers)
+    assert len(transfers) <= len(positions) - 1
+
+    # Zero positions do not count towards the limit
+    small = {**{f"idle-{i}": 0 for i in range(10)}, "a": 700, "b": -700}
+    assert server.plan_transfers(small)[0] == "exact"
+    assert server.plan_transfers(small, exact=False)[0] == "greedy"
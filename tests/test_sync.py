@@ -0,0 +1,107 @@
+"""/sync cursors only advance over contiguous change sequences."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from tests.conftest import group_of_two
+
+pytestmark = pytest.mark.anyio
+
+
+async def sync(api, headers: dict, since: str = None) -> dict:
+    response = await api.get("/api/sync", headers=headers, params={"since": since} if since else None)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def test_first_sync_resets_then_follows_changes(api):
+    group_id, (alice, alice_id), _ = await group_of_two(api)
+    first = await sync(api, alice)
+    assert first["reset"] == [group_id] and first["changes"] == []
+
+    await api.post("/api/expenses", headers=alice, json={
+        "group_id": group_id, "description": "Lunch", "amount": 12, "paid_by": alice_id,
+        "split_type": "equal", "splits": [{"user_id": alice_id, "amount": 12}]
+    })
+    second = await sync(api, alice, first["cursor"])
+    assert [(c["kind"], c["op"]) for c in second["changes"]] == [("expense", "upsert")]
+    version = (await server.db.groups.find_one({"id": group_id}))["version"]
+    assert server.decode_sync_cursor(second["cursor"]) == {group_id: version}
+
+
+async def test_sync_stops_at_a_gap_until_it_fills(api):
+    group_id, (alice, _), _ = await group_of_two(api)
+    cursor = (await sync(api, alice))["cursor"]
+    seen = server.decode_sync_cursor(cursor)[group_id]
+
+    # Two writes took sequence numbers, but the first one's change is not stored yet
+    await server.db.groups.update_one({"id": group_id}, {"$inc": {"version": 2}})
+    await server.append_changes(group_id, seen + 2, [server.change_entry("member", "upsert", "late", None)])
+
+    gapped = await sync(api, alice, cursor)
+    assert gapped["changes"] == []
+    assert server.decode_sync_cursor(gapped["cursor"]) == {group_id: seen}
+
+    await server.append_changes(group_id, seen + 1, [server.change_entry("member", "upsert", "early", None)])
+    filled = await sync(api, alice, gapped["cursor"])
+    assert [c["seq"] for c in filled["changes"]] == [seen + 1, seen + 2]
+    assert server.decode_sync_cursor(filled["cursor"]) == {group_id: seen + 2}
+
+
+async def test_removed_groups_are_reported(api):
+    group_id, (alice, _), (bob, bob_id) = await group_of_two(api)
+    cursor = (await sync(api, bob))["cursor"]
+    removed = await api.delete(f"/api/groups/{group_id}/members/{bob_id}", headers=alice)
+    assert removed.status_code == 200, removed.text
+    assert (await sync(api, bob, cursor))["removed"] == [group_id]
+
+
+async def age_feed(group_id: str, seconds: int):
+    # Backdates the group's last bump and every change row, as if written `seconds` ago
+    then = (datetime.now(timezone.utc) - timedelta(seconds=seconds)).isoformat()
+    await server.db.groups.update_one({"id": group_id}, {"$set": {"changed_at": then}})
+    await server.db.changes.update_many({"group_id": group_id}, {"$set": {"created_at": then}})
+
+
+async def test_an_old_gap_resets_the_group(api):
+    group_id, (alice, _), _ = await group_of_two(api)
+    cursor = (await sync(api, alice))["cursor"]
+    seen = server.decode_sync_cursor(cursor)[group_id]
+
+    # The write behind seen + 1 died after its bump and will never append
+    await server.db.groups.update_one({"id": group_id}, {"$inc": {"version": 2}})
+    await server.append_changes(group_id, seen + 2, [server.change_entry("member", "upsert", "late", None)])
+    await age_feed(group_id, server.SYNC_GAP_GRACE + 5)
+
+    lost = await sync(api, alice, cursor)
+    assert lost["reset"] == [group_id] and lost["changes"] == []
+    assert server.decode_sync_cursor(lost["cursor"]) == {group_id: seen + 2}
+
+
+async def test_an_old_gap_at_the_end_of_the_feed_resets_the_group(api):
+    group_id, (alice, _), _ = await group_of_two(api)
+    cursor = (await sync(api, alice))["cursor"]
+    seen = server.decode_sync_cursor(cursor)[group_id]
+
+    await server.db.groups.update_one({"id": group_id}, server.bump_version({}))
+    held = await sync(api, alice, cursor)
+    assert held["reset"] == [] and server.decode_sync_cursor(held["cursor"]) == {group_id: seen}
+
+    await age_feed(group_id, server.SYNC_GAP_GRACE + 5)
+    lost = await sync(api, alice, cursor)
+    assert lost["reset"] == [group_id]
+    assert server.decode_sync_cursor(lost["cursor"]) == {group_id: seen + 1}
+
+
+async def test_groups_past_the_first_hundred_are_not_removed(api):
+    group_id, (alice, alice_id), _ = await group_of_two(api)
+    await server.db.groups.insert_many([
+        {"id": f"extra-{i}", "name": f"Extra {i}", "version": 0, "members": [{"user_id": alice_id}]}
+        for i in range(120)
+    ])
+    first = await sync(api, alice)
+    assert len(first["reset"]) == 121
+
+    second = await sync(api, alice, first["cursor"])
+    assert second["removed"] == [] and second["reset"] == []